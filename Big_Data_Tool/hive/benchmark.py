@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of event_statistics.py on synthetic events, checking that every
+engine writes the same outputs:
+  - each engine of event_statistics.py (duckdb, sqlite, pandas)
+  - the queries of event_statistics.hql as written (NOT IN / IN views, one
+    scan per output) on the same SQL engines
+  - the pandas path of ETL_and_Modeling/src/event_statistics.py, whose
+    averages, medians, minima and maxima must match
+
+python hive/benchmark.py [number of events]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import importlib.util
+
+from event_statistics import (GROUPS, CODES, DIALECTS, available_engines, event_statistics,
+                              hive_text, load_duckdb, load_sqlite)
+
+# Default number of synthetic events
+N_ROWS = 1000000
+
+LITERAL_VIEWS_SQL = [
+    "CREATE TEMP VIEW alive_events AS SELECT events.patient_id, events.event_id, events.time FROM events "
+    "WHERE events.patient_id NOT IN (SELECT patient_id FROM mortality)",
+    "CREATE TEMP VIEW dead_events AS SELECT events.patient_id, events.event_id, events.time FROM events "
+    "WHERE events.patient_id IN (SELECT patient_id FROM mortality)",
+]
+
+# A few rows Hive reads in its own way: an invalid date, a time of day, a NULL time and patient, an extra
+# field, an empty event_id, and a dead patient listed twice in mortality
+EDGE_EVENTS = """1,DIAG1,a,2013-01-01,1.0
+1,DIAG1,a,2013-01-05 10:00:00,1.0
+1,LAB1,b,2013-02-30,2.0
+2,DRUG1,c,\\N,
+2,diag1,d,2013-01-02,
+\\N,DIAG2,e,2013-01-02,
+3,LAB2,f,g,2013-01-03,1.0
+3,,h,2013-01-04,
+4,DRUG2,i,2013-03-01,1.0
+"""
+EDGE_MORTALITY = "3,2013-02-01,1\n3,2013-02-01,1\n4,2013-04-01,1\n"
+
+
+def timed(fn, *args):
+    start_time = time.time()
+    result = fn(*args)
+    return result, time.time() - start_time
+
+
+def as_text(results):
+    return dict((name, [",".join(hive_text(value) for value in row) for row in rows])
+                for name, rows in results.items())
+
+
+def synthetic_events(directory, n_rows, n_patients=None, dead_ratio=0.1, n_days=2000, seed=6505):
+    """
+    Write headerless events.csv and mortality.csv to directory, and the same tables with a header
+    as events.csv and mortality_events.csv to directory/etl for the ETL_and_Modeling reader
+    """
+    rng = random.Random(seed)
+    n_patients = n_patients or max(1, n_rows // 200)
+    event_ids = (['DIAG%d' % i for i in range(1000)] + ['DRUG%d' % i for i in range(1000)] +
+                 ['LAB%d' % i for i in range(500)])
+    # Skewed code frequencies, so that the top 5 are not ties
+    weights = [1.0 / (i + 1) for i in range(len(event_ids))]
+    days = ['%04d-%02d-%02d' % (2000 + d // 336, d // 28 % 12 + 1, d % 28 + 1) for d in range(n_days)]
+    events = ["%d,%s,,%s,%.2f\n" % (rng.randrange(n_patients), event_id, rng.choice(days), rng.random() * 10)
+              for event_id in rng.choices(event_ids, weights, k=n_rows)]
+    dead = rng.sample(range(n_patients), int(n_patients * dead_ratio))
+    mortality = ["%d,%s,1\n" % (patient_id, rng.choice(days)) for patient_id in dead]
+
+    os.makedirs(os.path.join(directory, 'etl'))
+    for path, header, lines in [('events.csv', None, events), ('mortality.csv', None, mortality),
+                                ('etl/events.csv', 'patient_id,event_id,event_description,timestamp,value\n', events),
+                                ('etl/mortality_events.csv', 'patient_id,timestamp,label\n', mortality)]:
+        with open(os.path.join(directory, path), 'w') as f:
+            if header:
+                f.write(header)
+            f.writelines(lines)
+
+
+def literal_statistics(connection, dialect):
+    """
+    The queries of event_statistics.hql as written, with the event_id tie-break of the top 5
+    """
+    execute = connection.execute
+    for sql in LITERAL_VIEWS_SQL:
+        execute(sql)
+    median, datediff = DIALECTS[dialect]['median'], DIALECTS[dialect]['datediff']
+    results = {}
+    for group in GROUPS:
+        results['event_count_' + group] = execute(
+            "SELECT avg(event_count), min(event_count), max(event_count) FROM (SELECT patient_id, "
+            "count(event_id) AS event_count FROM %s_events GROUP BY patient_id) t" % group).fetchall()
+        for metric, expression in [('encounter_count', "count(DISTINCT time)"), ('record_length', datediff)]:
+            results['%s_%s' % (metric, group)] = execute(
+                "SELECT avg({0}), {1}, min({0}), max({0}) FROM (SELECT patient_id, {2} AS {0} "
+                "FROM {3}_events GROUP BY patient_id) t".format(
+                    metric, median.format(metric), expression, group)).fetchall()
+        for name, prefix in CODES:
+            results['common_%s_%s' % (name, group)] = execute(
+                "SELECT event_id, count(*) AS code_count FROM %s_events WHERE event_id LIKE '%s%%' "
+                "GROUP BY event_id ORDER BY code_count DESC, event_id LIMIT 5" % (group, prefix)).fetchall()
+    return results
+
+
+def bench_literal(dialect, events_path, mortality_path):
+    load = load_duckdb if dialect == 'duckdb' else load_sqlite
+    start_time = time.time()
+    connection = load(events_path, mortality_path)
+    try:
+        return literal_statistics(connection, dialect), time.time() - start_time
+    finally:
+        connection.close()
+
+
+def load_etl_statistics():
+    """
+    ETL_and_Modeling/src/event_statistics.py, None if it is not in this checkout
+    """
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ETL_and_Modeling', 'src')
+    path = os.path.join(src, 'event_statistics.py')
+    if not os.path.exists(path):
+        return None
+    sys.path.append(src)
+    spec = importlib.util.spec_from_file_location('etl_event_statistics', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_etl(module, directory):
+    def run(filepath):
+        events, mortality = module.read_csv(filepath)
+        return module.summary_statistics(module.patient_statistics(events, mortality))
+
+    return timed(run, os.path.join(directory, 'etl') + os.sep)
+
+
+def check_etl(stats, results):
+    for (metric, group), values in stats.items():
+        row = results['%s_%s' % (metric, group)][0]
+        expected = [values['avg'], values['min'], values['max']]
+        if metric == 'event_count':
+            actual = [row[0], row[1], row[2]]
+        else:
+            expected.append(values['median'])
+            actual = [row[0], row[2], row[3], row[1]]
+        assert [float(v) for v in expected] == [float(v) for v in actual], (metric, group, expected, actual)
+
+
+def check_edge_cases(directory):
+    events_path, mortality_path = os.path.join(directory, 'edge_events.csv'), os.path.join(directory, 'edge_mortality.csv')
+    with open(events_path, 'w') as f:
+        f.write(EDGE_EVENTS)
+    with open(mortality_path, 'w') as f:
+        f.write(EDGE_MORTALITY)
+    engines = available_engines()
+    expected = as_text(event_statistics(events_path, mortality_path, engines[0]))
+    assert expected['event_count_alive'] == ['2.5,2,3'] and expected['event_count_dead'] == ['1.5,1,2']
+    assert expected['encounter_count_alive'] == ['1.5,1.5,1,2'] and expected['record_length_alive'] == ['2.0,2.0,0,4']
+    assert expected['common_diag_alive'] == ['DIAG1,2'] and expected['common_lab_dead'] == ['LAB2,1']
+    for engine in engines[1:]:
+        assert as_text(event_statistics(events_path, mortality_path, engine)) == expected, engine
+    print("edge cases: %s agree" % ", ".join(engines))
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else N_ROWS
+    directory = tempfile.mkdtemp()
+    try:
+        check_edge_cases(directory)
+        synthetic_events(directory, n_rows)
+        events_path, mortality_path = os.path.join(directory, 'events.csv'), os.path.join(directory, 'mortality.csv')
+        print("Synthetic events: %d rows" % n_rows)
+
+        expected = None
+        for engine in available_engines():
+            results, seconds = timed(event_statistics, events_path, mortality_path, engine)
+            expected = expected or results
+            assert as_text(results) == as_text(expected), engine
+            print("%s: %.3fs" % (engine, seconds))
+        for dialect in [engine for engine in available_engines() if engine in DIALECTS]:
+            results, seconds = bench_literal(dialect, events_path, mortality_path)
+            assert as_text(results) == as_text(expected), dialect
+            print("%s, hql as written: %.3fs" % (dialect, seconds))
+
+        module = load_etl_statistics()
+        if module is not None:
+            stats, seconds = bench_etl(module, directory)
+            check_etl(stats, expected)
+            print("ETL_and_Modeling pandas path: %.3fs" % seconds)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
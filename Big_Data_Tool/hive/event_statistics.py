@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+
+"""
+Run the queries of event_statistics.hql on one machine, against the
+headerless events.csv and mortality.csv of its two tables, and write the
+same local directories (event_count_alive/000000_0, ...):
+
+python hive/event_statistics.py -e events.csv -m mortality.csv -o <output directory>
+
+Engines, the first one available is the default:
+  duckdb - the SQL below on DuckDB's vectorized columnar engine
+  sqlite - the SQL below on the standard library's embedded database, with
+           the dead patients indexed
+  pandas - the same computation on DataFrames
+
+The alive_events and dead_events views are an anti-join (NOT EXISTS) and a
+semi-join (EXISTS) with the distinct patients of mortality instead of the
+NOT IN / IN subqueries, and each view is scanned twice instead of six times:
+once for the per-patient counts behind the event count, encounter count and
+record length outputs, once for the code counts behind the top 5 outputs.
+
+As in Hive, fields are split on every comma (no quoting, \\N is NULL) and a
+time that is not a yyyy-MM-dd date is NULL; medians interpolate linearly as
+Hive's percentile does. Values are written as Hive writes them: doubles in
+the format of Java's Double.toString, NULL as \\N. Ties of the top 5 codes,
+which Hive leaves in any order, are broken by event_id.
+"""
+
+import os
+import sys
+import csv
+import math
+import shutil
+from decimal import Decimal
+from datetime import datetime
+from functools import lru_cache
+from optparse import OptionParser
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+ENGINES = ('duckdb', 'sqlite', 'pandas')
+GROUPS = ('alive', 'dead')
+EVENT_COLUMNS = ('patient_id', 'event_id', 'event_description', 'time', 'value')
+MORTALITY_COLUMNS = ('patient_id', 'time', 'label')
+# Output name and event_id prefix of the top 5 codes
+CODES = (('diag', 'DIAG'), ('lab', 'LAB'), ('med', 'DRUG'))
+
+# Dialect of each SQL engine: median of a column, record length of a patient's events
+DIALECTS = {
+    'duckdb': {'median': "quantile_cont({0}, 0.5)",
+               'datediff': "datediff('day', min(time), max(time))"},
+    'sqlite': {'median': "percentile({0}, 0.5)",
+               'datediff': "CAST(julianday(max(time)) - julianday(min(time)) AS INTEGER)"},
+}
+
+VIEWS_SQL = [
+    "CREATE TEMP TABLE mortality_patients AS SELECT DISTINCT patient_id FROM mortality WHERE patient_id IS NOT NULL",
+    "CREATE TEMP VIEW alive_events AS SELECT e.patient_id, e.event_id, e.time FROM events e "
+    "WHERE e.patient_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM mortality_patients m WHERE m.patient_id = e.patient_id)",
+    "CREATE TEMP VIEW dead_events AS SELECT e.patient_id, e.event_id, e.time FROM events e "
+    "WHERE EXISTS (SELECT 1 FROM mortality_patients m WHERE m.patient_id = e.patient_id)",
+]
+
+PATIENTS_SQL = ("CREATE TEMP TABLE {group}_patients AS SELECT patient_id, count(event_id) AS event_count, "
+                "count(DISTINCT time) AS encounter_count, {datediff} AS record_length "
+                "FROM {group}_events GROUP BY patient_id")
+
+CODES_SQL = ("CREATE TEMP TABLE {group}_codes AS SELECT event_id, count(*) AS code_count FROM {group}_events "
+             "WHERE " + " OR ".join("event_id LIKE '%s%%'" % prefix for _, prefix in CODES) + " GROUP BY event_id")
+
+
+def percentile(values, p):
+    """
+    Hive's percentile of integers: linear interpolation between the two closest ranks, None if there are no values
+    """
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    position = p * (len(values) - 1)
+    lower, upper = int(math.floor(position)), int(math.ceil(position))
+    if values[lower] == values[upper]:
+        return float(values[lower])
+    return (upper - position) * values[lower] + (position - lower) * values[upper]
+
+
+class _Percentile:
+    """
+    percentile(column, p) aggregate for sqlite3
+    """
+
+    def __init__(self):
+        self.values = []
+        self.p = None
+
+    def step(self, value, p):
+        self.p = p
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        return percentile(self.values, self.p)
+
+
+@lru_cache(maxsize=None)
+def hive_date(field):
+    """
+    ISO string of the yyyy-MM-dd date a DATE field holds (a time of day may follow), None if it holds none
+    """
+    if field is None:
+        return None
+    try:
+        return datetime.strptime(field.split(' ', 1)[0], '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        return None
+
+
+def java_double(x):
+    """
+    Java's Double.toString: the shortest digits that read back as x, in decimal notation
+    for 1e-3 <= |x| < 1e7 and in computerized scientific notation (1.0E7) otherwise
+    """
+    if math.isnan(x):
+        return 'NaN'
+    if math.isinf(x):
+        return 'Infinity' if x > 0 else '-Infinity'
+    if x == 0:
+        return '-0.0' if math.copysign(1.0, x) < 0 else '0.0'
+    sign = '-' if x < 0 else ''
+    _, digits, exponent = Decimal(repr(abs(x))).as_tuple()
+    digits = ''.join(map(str, digits))
+    exponent += len(digits) - len(digits.rstrip('0'))
+    digits = digits.rstrip('0')
+    point = len(digits) + exponent
+    if not 1e-3 <= abs(x) < 1e7:
+        return "%s%s.%sE%d" % (sign, digits[0], digits[1:] or '0', point - 1)
+    if point <= 0:
+        return sign + '0.' + '0' * -point + digits
+    if point >= len(digits):
+        return sign + digits + '0' * (point - len(digits)) + '.0'
+    return sign + digits[:point] + '.' + digits[point:]
+
+
+def hive_text(value):
+    """
+    A value as Hive writes it to a text file
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, float):
+        return java_double(value)
+    return str(value)
+
+
+def read_hive_text(path, n_columns):
+    """
+    Rows of a headerless text table of ROW FORMAT DELIMITED FIELDS TERMINATED BY ',':
+    fields split on every comma, cut or padded with None to n_columns, \\N read as None
+    """
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split(',', n_columns)[:n_columns]
+            fields += [None] * (n_columns - len(fields))
+            yield [None if field == '\\N' else field for field in fields]
+
+
+def available_engines():
+    modules = {'duckdb': duckdb, 'sqlite': sqlite3, 'pandas': pd}
+    return [engine for engine in ENGINES if modules[engine] is not None]
+
+
+def load_sqlite(events_path, mortality_path):
+    """
+    In-memory sqlite3 database with the events (patient_id, event_id, time) and mortality (patient_id) tables
+    """
+    connection = sqlite3.connect(':memory:')
+    connection.create_aggregate('percentile', 2, _Percentile)
+    # Hive's LIKE is case sensitive
+    connection.execute("PRAGMA case_sensitive_like = ON")
+    connection.execute("CREATE TABLE events (patient_id TEXT, event_id TEXT, time TEXT)")
+    connection.execute("CREATE TABLE mortality (patient_id TEXT)")
+    connection.executemany("INSERT INTO events VALUES (?, ?, ?)",
+                           ((row[0], row[1], hive_date(row[3]))
+                            for row in read_hive_text(events_path, len(EVENT_COLUMNS))))
+    connection.executemany("INSERT INTO mortality VALUES (?)",
+                           (row[:1] for row in read_hive_text(mortality_path, len(MORTALITY_COLUMNS))))
+    return connection
+
+
+def _duckdb_table(columns):
+    return ("read_csv(?, auto_detect=false, header=false, delim=',', quote='', escape='', nullstr='\\N', "
+            "null_padding=true, strict_mode=false, columns={%s})" %
+            ", ".join("'%s': 'VARCHAR'" % column for column in columns))
+
+
+def load_duckdb(events_path, mortality_path):
+    """
+    In-memory DuckDB database with the events (patient_id, event_id, time) and mortality (patient_id) tables
+    """
+    connection = duckdb.connect()
+    connection.execute("CREATE TABLE events AS SELECT patient_id, event_id, "
+                       "try_strptime(split_part(time, ' ', 1), '%Y-%m-%d')::DATE AS time FROM " +
+                       _duckdb_table(EVENT_COLUMNS), [events_path])
+    connection.execute("CREATE TABLE mortality AS SELECT patient_id FROM " + _duckdb_table(MORTALITY_COLUMNS),
+                       [mortality_path])
+    return connection
+
+
+def sql_statistics(connection, dialect):
+    """
+    Run the statistics on a database with the events and mortality tables.
+    Return {output directory: rows}
+    """
+    execute = connection.execute
+    for sql in VIEWS_SQL:
+        execute(sql)
+    if dialect == 'sqlite':
+        execute("CREATE UNIQUE INDEX mortality_patients_id ON mortality_patients (patient_id)")
+    median, datediff = DIALECTS[dialect]['median'], DIALECTS[dialect]['datediff']
+    results = {}
+    for group in GROUPS:
+        execute(PATIENTS_SQL.format(group=group, datediff=datediff))
+        execute(CODES_SQL.format(group=group))
+        results['event_count_' + group] = execute(
+            "SELECT avg(event_count), min(event_count), max(event_count) FROM %s_patients" % group).fetchall()
+        for metric in ['encounter_count', 'record_length']:
+            results['%s_%s' % (metric, group)] = execute(
+                "SELECT avg({0}), {1}, min({0}), max({0}) FROM {2}_patients".format(
+                    metric, median.format(metric), group)).fetchall()
+        for name, prefix in CODES:
+            results['common_%s_%s' % (name, group)] = execute(
+                "SELECT event_id, code_count FROM %s_codes WHERE event_id LIKE '%s%%' "
+                "ORDER BY code_count DESC, event_id LIMIT 5" % (group, prefix)).fetchall()
+    return results
+
+
+def _read_pandas(path, columns, usecols):
+    return pd.read_csv(path, header=None, names=list(columns), usecols=usecols, dtype=str,
+                       quoting=csv.QUOTE_NONE, na_values=['\\N'], keep_default_na=False)
+
+
+def _summary(values, median):
+    """
+    avg, (median,) min and max of an integer Series, NULLs if it is empty
+    """
+    if not len(values):
+        return (None,) * (4 if median else 3)
+    row = [float(values.mean())]
+    if median:
+        row.append(percentile(values.tolist(), 0.5))
+    return tuple(row + [int(values.min()), int(values.max())])
+
+
+def pandas_statistics(events_path, mortality_path):
+    """
+    The statistics computed with pandas. Return {output directory: rows}
+    """
+    events = _read_pandas(events_path, EVENT_COLUMNS, ['patient_id', 'event_id', 'time'])
+    mortality = _read_pandas(mortality_path, MORTALITY_COLUMNS, ['patient_id'])
+    # Every distinct time string is parsed once
+    codes, uniques = pd.factorize(events['time'])
+    dates = pd.to_datetime(pd.Series([hive_date(time) for time in uniques] + [None], dtype=object))
+    events['time'] = dates.values[codes]
+    dead = events['patient_id'].isin(mortality['patient_id'].dropna().unique())
+
+    results = {}
+    for group, rows in [('alive', events[~dead & events['patient_id'].notna()]), ('dead', events[dead])]:
+        per_patient = rows.groupby('patient_id').agg(
+            event_count=('event_id', 'count'), encounter_count=('time', 'nunique'),
+            first_event=('time', 'min'), last_event=('time', 'max'))
+        record_length = (per_patient['last_event'] - per_patient['first_event']).dt.days.dropna().astype('int64')
+        results['event_count_' + group] = [_summary(per_patient['event_count'], False)]
+        results['encounter_count_' + group] = [_summary(per_patient['encounter_count'], True)]
+        results['record_length_' + group] = [_summary(record_length, True)]
+
+        counts = rows['event_id'].value_counts().rename_axis('event_id').reset_index(name='code_count')
+        for name, prefix in CODES:
+            top = counts[counts['event_id'].str.startswith(prefix)]
+            top = top.sort_values(['code_count', 'event_id'], ascending=[False, True]).head(5)
+            results['common_%s_%s' % (name, group)] = [(event_id, int(count)) for event_id, count in top.values]
+    return results
+
+
+def event_statistics(events_path, mortality_path, engine=None):
+    """
+    Compute the outputs of event_statistics.hql with engine (default: the first available).
+    Return {output directory: rows}
+    """
+    engine = engine or available_engines()[0]
+    if engine not in available_engines():
+        raise ValueError("engine %s is not available, use one of %s" % (engine, ", ".join(available_engines())))
+    if engine == 'pandas':
+        return pandas_statistics(events_path, mortality_path)
+    load = load_duckdb if engine == 'duckdb' else load_sqlite
+    connection = load(events_path, mortality_path)
+    try:
+        return sql_statistics(connection, engine)
+    finally:
+        connection.close()
+
+
+def write_outputs(results, output_dir='.'):
+    """
+    Write every output as INSERT OVERWRITE LOCAL DIRECTORY does: the directory is replaced by one with a
+    000000_0 file of comma separated values
+    """
+    for name, rows in sorted(results.items()):
+        path = os.path.join(output_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        with open(os.path.join(path, '000000_0'), 'w') as f:
+            f.writelines(",".join(hive_text(value) for value in row) + "\n" for row in rows)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-e", "--events", action="store", dest="events",
+                      default="events.csv", help="headerless events.csv")
+    parser.add_option("-m", "--mortality", action="store", dest="mortality",
+                      default="mortality.csv", help="headerless mortality.csv")
+    parser.add_option("-o", "--output", action="store", dest="output",
+                      default=".", help="directory where the output directories are written")
+    parser.add_option("-g", "--engine", action="store", dest="engine",
+                      type="choice", choices=list(ENGINES),
+                      help="duckdb, sqlite or pandas (default: the first available)")
+
+    options, args = parser.parse_args(sys.argv)
+
+    write_outputs(event_statistics(options.events, options.mortality, options.engine), options.output)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmarks for the SGD logistic regression tools, on synthetic svmlight data
+"""
+
+import os
+import sys
+import math
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+import pickle
+
+from lrsgd import LogisticRegressionSGD, SparseLogisticRegressionSGD, dumps_model, loads_model, np
+from utils import parse_svm_light_line, parse_svm_light_lines, parse_svm_light_batches, svmlight_to_binary
+from train_parallel import MODES, train_parallel
+import mapper
+import mapreduce_local
+
+
+def synthetic_svmlight(n_samples, n_feature, nnz, seed=6505, weight=None):
+    """
+    Lines of "label idx:value ..." with about nnz sorted features per sample.
+    Labels are random, or drawn from a logistic model of weights {feature: weight} if weight is given
+    """
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(n_samples):
+        features = sorted(rng.sample(range(n_feature), rng.randint(1, 2 * nnz)))
+        values = [rng.random() for _ in features]
+        if weight is None:
+            label = 1 if rng.random() < 0.5 else 0
+        else:
+            z = sum(weight.get(f, 0.0) * v for f, v in zip(features, values))
+            label = 1 if rng.random() < 1.0 / (1.0 + math.exp(-z)) else 0
+        lines.append("%d %s" % (label, " ".join("%d:%f" % (f, v) for f, v in zip(features, values))))
+    return lines
+
+
+def timed(fn, *args):
+    start_time = time.time()
+    fn(*args)
+    return time.time() - start_time
+
+
+def check_model_format():
+    """
+    dumps_model/loads_model round trips of the dense and sparse layouts, of a
+    model without non-zero weights, and of reducer output with the tabs of
+    TextOutputFormat; pickles load only with legacy_pickle
+    """
+    rng = random.Random(6505)
+    dense = SparseLogisticRegressionSGD(0.01, 0.1, 10)
+    dense.weight = [rng.gauss(0.0, 1.0) for _ in range(10)]
+    sparse = SparseLogisticRegressionSGD(0.01, 0.1, 1000, penalty='l1')
+    sparse.weight[3], sparse.weight[999] = 0.5, -2.0
+    empty = SparseLogisticRegressionSGD(0.01, 0.1, 10, penalty='l1')
+    for classifier, layout in [(dense, b'dense'), (sparse, b'sparse'), (empty, b'sparse')]:
+        data = dumps_model(classifier)
+        assert data.split()[1] == layout
+        for loaded in [loads_model(data), loads_model(data.replace(b'\n', b'\t\n')), loads_model(data, use_numpy=np is not None)]:
+            assert list(loaded.weight) == list(classifier.weight)
+            assert (loaded.eta, loaded.C, loaded.penalty) == (classifier.eta, classifier.C, classifier.penalty)
+    pickled = pickle.dumps(dense, protocol=0)
+    try:
+        loads_model(pickled)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a pickle loaded without legacy_pickle")
+    assert list(loads_model(pickled, legacy_pickle=True).weight) == dense.weight
+
+
+def check_parser_errors():
+    """
+    The batch parser raises ValueError on the same malformed lines with and
+    without NumPy, including float-looking feature indices
+    """
+    malformed = ["1 1e5:3", "1 1.0:3", "0 2:1 1.5:2", "1 2E1:1", "1 -1:2", "1 3::2", "1 3:", "1 2:1:3", "1 a:1", "x 1:2"]
+    for line in malformed:
+        for use_numpy in [False, True]:
+            try:
+                parse_svm_light_lines(["1 1:0.5", line], use_numpy=use_numpy)
+            except ValueError:
+                continue
+            raise AssertionError("%r parsed with use_numpy=%s" % (line, use_numpy))
+
+
+def check_shuffle(n_runs=300, sort_factor=16):
+    """
+    The shuffle of mapreduce_local writes the same reduce inputs whether the
+    runs are merged at once or sort_factor at a time, and keeps the order of
+    the runs among equal keys
+    """
+    rng = random.Random(6505)
+    workdir = tempfile.mkdtemp()
+    try:
+        runs = []
+        for run in range(n_runs):
+            lines = sorted((("%d\t%d %d\n" % (rng.randint(0, 9), run, i)).encode() for i in range(rng.randint(0, 20))),
+                           key=mapreduce_local.record_key)
+            runs.append(os.path.join(workdir, 'run-%05d' % run))
+            with open(runs[-1], 'wb') as f:
+                f.writelines(lines)
+        contents = []
+        for name, factor in [('all', n_runs), ('bounded', sort_factor)]:
+            copies = [shutil.copy(run, run + '.' + name) for run in runs]
+            inputs = mapreduce_local.shuffle(copies, os.path.join(workdir, name), factor)
+            reduce_inputs = []
+            for path in inputs:
+                with open(path, 'rb') as f:
+                    reduce_inputs.append(f.read())
+            contents.append(reduce_inputs)
+        assert contents[0] == contents[1]
+        for data in contents[0]:
+            order = [tuple(map(int, line.split(b'\t')[1].split())) for line in data.splitlines()]
+            assert order == sorted(order)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def check_l1_defaults(n_samples=20000, n_feature=3190, nnz=50):
+    """
+    train.py -p l1 with its default step size and penalty, on data where 300
+    features carry the label: the model keeps non-zero weights, zeroes some
+    others and scores held-out samples better than chance
+    """
+    rng = random.Random(0)
+    weight = dict((f, rng.choice([-3.0, 3.0])) for f in rng.sample(range(n_feature), 300))
+    lines = synthetic_svmlight(n_samples, n_feature, nnz, seed=1, weight=weight)
+    held_out = synthetic_svmlight(n_samples // 4, n_feature, nnz, seed=2, weight=weight)
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'model.txt')
+    try:
+        train = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train.py')
+        subprocess.run([sys.executable, train, '-f', str(n_feature), '-p', 'l1', '-m', path],
+                       input="\n".join(lines).encode(), check=True)
+        with open(path, 'rb') as f:
+            classifier = loads_model(f.read())
+    finally:
+        shutil.rmtree(workdir)
+    nonzero = sum(1 for w in classifier.weight if w != 0.0)
+    loss = 0.0
+    for X, y in map(parse_svm_light_line, held_out):
+        p = min(max(classifier.predict_prob(X), 1e-15), 1.0 - 1e-15)
+        loss -= math.log(p) if y > 0.5 else math.log(1.0 - p)
+    loss /= len(held_out)
+    print("train.py -p l1 defaults: %d non-zero weights of %d, held-out log loss %.4f" % (nonzero, n_feature, loss))
+    assert 0 < nonzero < n_feature
+    assert loss < math.log(2.0) - 0.05
+
+
+def bench_backends(lines, n_feature, C=0.0, batch_size=64):
+    """
+    Samples per second of one training pass with each weight backend
+    """
+    samples = [parse_svm_light_line(line) for line in lines]
+    pre_parsed = [([f for f, _ in X], [v for _, v in X], y) for X, y in samples]
+
+    def fit_pairs(classifier):
+        for X, y in samples:
+            classifier.fit(X, y)
+
+    def fit_sparse(classifier):
+        for indices, values, y in pre_parsed:
+            classifier.fit_sparse(indices, values, y)
+
+    def fit_batch(classifier):
+        for start in range(0, len(pre_parsed), batch_size):
+            batch = pre_parsed[start:start + batch_size]
+            classifier.fit_batch([x[0] for x in batch], [x[1] for x in batch], [x[2] for x in batch])
+
+    runs = [("list weights, fit(pairs)", fit_pairs, LogisticRegressionSGD(0.01, C, n_feature)),
+            ("list weights, fit_sparse", fit_sparse, SparseLogisticRegressionSGD(0.01, C, n_feature)),
+            ("list weights, fit_batch(%d)" % batch_size, fit_batch, SparseLogisticRegressionSGD(0.01, C, n_feature))]
+    if np is not None:
+        runs += [("numpy, fit_sparse", fit_sparse, SparseLogisticRegressionSGD(0.01, C, n_feature, use_numpy=True)),
+                 ("numpy, fit_batch(%d)" % batch_size, fit_batch, SparseLogisticRegressionSGD(0.01, C, n_feature, use_numpy=True))]
+    for name, fit, classifier in runs:
+        seconds = timed(fit, classifier)
+        print("%-28s %10.0f samples/s" % (name, len(samples) / seconds))
+
+
+def bench_parser(lines, n_checked=10000):
+    """
+    Lines per second of the per-line parser against the batch parser, with
+    and without NumPy, checking on the first n_checked lines that they parse
+    the same features
+    """
+    def parse_per_line(lines):
+        for line in lines:
+            parse_svm_light_line(line)
+
+    def parse_batches(lines, use_numpy):
+        for batch in parse_svm_light_batches(lines, use_numpy=use_numpy):
+            pass
+
+    megabytes = sum(len(line) + 1 for line in lines) / 1e6
+    runs = [("per line", parse_per_line, ()), ("batches, array", parse_batches, (False,))]
+    if np is not None:
+        runs.append(("batches, numpy", parse_batches, (True,)))
+    for name, parse, args in runs:
+        seconds = timed(parse, lines, *args)
+        print("%-28s %10.0f lines/s %8.1f MB/s" % (name, len(lines) / seconds, megabytes / seconds))
+
+    samples = [parse_svm_light_line(line) for line in lines[:n_checked]]
+    for use_numpy in [False, True]:
+        batches = list(parse_svm_light_batches(lines[:n_checked], use_numpy=use_numpy))
+        assert [int(f) for batch in batches for f in batch[1]] == [f for X, _ in samples for f, _ in X]
+        assert [float(v) for batch in batches for v in batch[2]] == [v for X, _ in samples for _, v in X]
+
+
+def bench_workers(lines, n_feature, workers, epochs=2):
+    """
+    Samples per second of train_parallel in each mode with each number of worker processes
+    """
+    workdir = tempfile.mkdtemp()
+    prefix = os.path.join(workdir, 'train')
+    try:
+        svmlight_to_binary(lines, prefix)
+        for mode in MODES:
+            for n_workers in workers:
+                start_time = time.time()
+                train_parallel(prefix, 0.01, 0.0, n_feature, n_workers, mode, epochs)
+                seconds = time.time() - start_time
+                print("%-28s %10.0f samples/s" % ("%s, %d workers" % (mode, n_workers), epochs * len(lines) / seconds))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_ensemble(lines, n_feature, model_counts):
+    """
+    Samples per second of ensemble scoring, one classifier and one sample at
+    a time against testensemble.EnsembleScorer, checking they agree
+    """
+    from testensemble import EnsembleScorer, predict_prob
+    from utils import iter_samples
+
+    rng = random.Random(6505)
+    batches = list(parse_svm_light_batches(lines))
+    for n_model in model_counts:
+        classifiers = []
+        for _ in range(n_model):
+            classifier = SparseLogisticRegressionSGD(0.01, 0.0, n_feature)
+            classifier.weight = [rng.gauss(0.0, 1.0) for _ in range(n_feature)]
+            classifiers.append(classifier)
+        start_time = time.time()
+        old = [predict_prob(classifiers, indices, values) for batch in batches for indices, values, _ in iter_samples(*batch)]
+        before = time.time() - start_time
+        start_time = time.time()
+        scorer = EnsembleScorer(classifiers)
+        new = [p for batch in batches for p in scorer.predict_prob(*batch[1:])]
+        after = time.time() - start_time
+        assert max(abs(a - b) for a, b in zip(old, new)) < 1e-9
+        print("%-28s %10.0f samples/s before, %10.0f samples/s after" %
+              ("ensemble, %d models" % n_model, len(lines) / before, len(lines) / after))
+
+
+def bench_mapper(lines, model_counts, ratio=0.4):
+    """
+    Input lines per second of the original mapper loop against mapper.run in each sampling mode
+    """
+    def original(lines, output, n_model):
+        rng = random.Random(6505)
+        for line in lines:
+            for i in range(n_model):
+                key = rng.randint(0, n_model - 1)
+                value = line.strip()
+                cutoff = n_model * ratio
+                if key < cutoff:
+                    print("%d\t%s" % (i, value), file=output)
+
+    runs = [("original", original, ())] + \
+        [(mode, mapper.run, (ratio, mode)) for mode in mapper.MODES] + [("bernoulli, compact", mapper.run, (ratio, 'bernoulli', True))]
+    with open(os.devnull, 'w', buffering=1 << 20) as output:
+        for n_model in model_counts:
+            for name, run, args in runs:
+                seconds = timed(run, lines, output, n_model, *args)
+                print("%-28s %10.0f lines/s" % ("mapper %s, %d models" % (name, n_model), len(lines) / seconds))
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", "--samples", action="store", dest="n_samples",
+                      default=20000, help="number of synthetic samples", type="int")
+    parser.add_option("-f", "--feature-num", action="store", dest="n_feature",
+                      default=3190, help="number of features", type="int")
+    parser.add_option("-z", "--nnz", action="store", dest="nnz",
+                      default=50, help="average number of features per sample", type="int")
+    parser.add_option("-l", "--parse-lines", action="store", dest="n_lines",
+                      default=1000000, help="number of lines of the parser benchmark", type="int")
+    parser.add_option("-M", "--models", action="store", dest="models",
+                      default="5,50", help="comma separated numbers of models of the ensemble benchmark")
+    parser.add_option("-w", "--workers", action="store", dest="workers",
+                      default="1,2,4,8", help="comma separated numbers of worker processes")
+
+    options, args = parser.parse_args(sys.argv)
+
+    check_model_format()
+    check_parser_errors()
+    check_shuffle()
+    check_l1_defaults()
+    lines = synthetic_svmlight(options.n_samples, options.n_feature, options.nnz)
+    for C in [0.0, 0.01]:
+        print("C = %g" % C)
+        bench_backends(lines, options.n_feature, C)
+    print("parser, %d lines" % options.n_lines)
+    bench_parser((lines * (options.n_lines // len(lines) + 1))[:options.n_lines])
+    bench_ensemble(lines, options.n_feature, [int(n) for n in options.models.split(',')])
+    bench_mapper(lines, [5, 50, 500])
+    print("parallel training, %d cpus" % os.cpu_count())
+    bench_workers(lines, options.n_feature, [int(n) for n in options.workers.split(',')])
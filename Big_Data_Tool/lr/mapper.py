@@ -1,24 +1,121 @@
 #!/usr/bin/env python
 
+import io
 import sys
+import math
 import random
 
 from optparse import OptionParser
 
-parser = OptionParser()
-parser.add_option("-n", "--model-num", action="store", dest="n_model",
-                  help="number of models to train", type="int")
-parser.add_option("-r", "--sample-ratio", action="store", dest="ratio",
-                  help="ratio to sample for each ensemble", type="float")
+from utils import BATCH_SIZE, parse_svm_light_lines, pack_samples
 
-options, args = parser.parse_args(sys.argv)
+MODES = ('legacy', 'bernoulli', 'poisson')
 
-random.seed(6505)
 
-for line in sys.stdin:
-    for i in range(options.n_model):
-        key = random.randint(0, options.n_model - 1)
-        value = line.strip()
-        cutoff = options.n_model * options.ratio
-        if key < cutoff:
-            print("%d\t%s" % (i, value))
+def inclusion_probability(n_model, ratio):
+    """
+    Probability that the legacy draw, randint(0, n_model - 1) < n_model * ratio, keeps a line for a model
+    """
+    cutoff = n_model * ratio
+    return min(n_model, max(0, int(math.ceil(cutoff)))) / float(n_model)
+
+
+def legacy_models(rng, n_model, ratio):
+    """
+    Models that get the line, with the draws of the original mapper: one randint per model
+    """
+    cutoff = n_model * ratio
+    randrange = rng.randrange
+    return [i for i in range(n_model) if randrange(n_model) < cutoff]
+
+
+def bernoulli_models(rng, n_model, p):
+    """
+    Models that get the line, each independently with probability p as in the legacy mode, drawing only the
+    gaps between selected models (geometric skips), so a line costs O(selected models) instead of O(n_model)
+    """
+    if p >= 1.0:
+        return list(range(n_model))
+    if p <= 0.0:
+        return []
+    log_q = math.log(1.0 - p)
+    models = []
+    i = int(math.log(1.0 - rng.random()) / log_q)
+    while i < n_model:
+        models.append(i)
+        i += 1 + int(math.log(1.0 - rng.random()) / log_q)
+    return models
+
+
+def poisson_models(rng, n_model, rate):
+    """
+    Poisson bootstrap: every model gets Poisson(rate) copies of the line. The total number of copies is drawn
+    from exponential inter-arrival times and each copy goes to a uniform model, so a line costs O(copies).
+    Return the model of every copy, sorted
+    """
+    total = rate * n_model
+    if total <= 0.0:
+        return []
+    models = []
+    t = -math.log(1.0 - rng.random())
+    while t < total:
+        models.append(rng.randrange(n_model))
+        t -= math.log(1.0 - rng.random())
+    models.sort()
+    return models
+
+
+def run(input, output, n_model, ratio, mode='legacy', compact=False, seed=6505):
+    """
+    Write "model<TAB>sample" for every model that gets each input line. The legacy mode writes exactly what
+    the original mapper printed for the same seed. With compact, samples are written packed by
+    utils.pack_samples (blank lines are dropped), so the reducers do not parse any text.
+    """
+    rng = random.Random(seed)
+    p = inclusion_probability(n_model, ratio)
+    if mode == 'legacy':
+        select = lambda: legacy_models(rng, n_model, ratio)
+    elif mode == 'bernoulli':
+        select = lambda: bernoulli_models(rng, n_model, p)
+    else:
+        select = lambda: poisson_models(rng, n_model, p)
+    write = output.write
+    keys = ["%d\t" % i for i in range(n_model)]
+
+    def emit(values):
+        for value in values:
+            value += "\n"
+            write("".join([keys[i] + value for i in select()]))
+
+    if not compact:
+        emit(line.strip() for line in input)
+        return
+    lines = []
+    for line in input:
+        if line.strip():
+            lines.append(line)
+        if len(lines) == BATCH_SIZE:
+            emit(pack_samples(*parse_svm_light_lines(lines, use_numpy=False)))
+            lines = []
+    if lines:
+        emit(pack_samples(*parse_svm_light_lines(lines, use_numpy=False)))
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", "--model-num", action="store", dest="n_model",
+                      help="number of models to train", type="int")
+    parser.add_option("-r", "--sample-ratio", action="store", dest="ratio",
+                      help="ratio to sample for each ensemble", type="float")
+    parser.add_option("-s", "--sampling", action="store", dest="mode", default="legacy",
+                      type="choice", choices=list(MODES),
+                      help="legacy (one draw per model), bernoulli (same distribution, geometric skips) "
+                           "or poisson (bootstrap with replacement)")
+    parser.add_option("-c", "--compact", action="store_true", dest="compact", default=False,
+                      help="write samples pre-parsed in the packed format of utils.pack_samples")
+
+    options, args = parser.parse_args(sys.argv)
+
+    output = io.open(sys.stdout.fileno(), 'w', buffering=1 << 20, closefd=False)
+    run(sys.stdin, output, options.n_model, options.ratio, options.mode, options.compact)
+    output.flush()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+"""
+Run a Hadoop streaming job (mapper | shuffle/sort | reducer) on one machine,
+e.g. the ensemble of the README without a cluster:
+
+python lr/mapreduce_local.py -i pig/training -o models -m "python lr/mapper.py -n 5 -r 0.4" -r "python lr/reducer.py -f <number of features>"
+
+Map: one mapper process per input file, in a pool of worker processes. The
+output of every map task is cut into runs of at most spill-lines lines,
+each sorted by key and spilled to a temporary file.
+Shuffle: the runs are merged by key (bytewise, as Hadoop sorts Text keys)
+without holding them in memory, and split into one reduce input per key.
+At most sort-factor runs are open at once: with more runs, consecutive
+groups of sort-factor runs are first merged into intermediate runs, as
+Hadoop's io.sort.factor bounds its merges.
+Reduce: one reducer process per key, in the pool. Its output is written
+unchanged to part-NNNNN, in key order.
+The time of every phase is reported on stderr.
+"""
+
+import os
+import sys
+import time
+import heapq
+import shlex
+import shutil
+import tempfile
+import subprocess
+from multiprocessing import Pool
+from optparse import OptionParser
+
+# Map output lines sorted in memory before a run is spilled to disk
+SPILL_LINES = 1000000
+# Runs merged at once (open files) by the shuffle
+SORT_FACTOR = 64
+
+
+def record_key(line):
+    """
+    Key of a streaming record: the text before the first tab, the whole line if it has none
+    """
+    return line.rstrip(b'\n').split(b'\t', 1)[0]
+
+
+def _spill(lines, path):
+    lines.sort(key=record_key)
+    with open(path, 'wb') as f:
+        f.writelines(lines)
+    return path
+
+
+def _map_task(command, input_path, spill_prefix, spill_lines):
+    """
+    Run the mapper on one input file and spill its output as sorted runs.
+    Return the paths of the runs, in output order
+    """
+    runs = []
+    with open(input_path, 'rb') as stdin:
+        process = subprocess.Popen(shlex.split(command), stdin=stdin, stdout=subprocess.PIPE)
+        lines = []
+        for line in process.stdout:
+            if not line.endswith(b'\n'):
+                line += b'\n'
+            lines.append(line)
+            if len(lines) == spill_lines:
+                runs.append(_spill(lines, "%s-%05d" % (spill_prefix, len(runs))))
+                lines = []
+        if lines:
+            runs.append(_spill(lines, "%s-%05d" % (spill_prefix, len(runs))))
+        if process.wait():
+            raise subprocess.CalledProcessError(process.returncode, command)
+    return runs
+
+
+def merge_runs(runs, merge_prefix, sort_factor=SORT_FACTOR):
+    """
+    Merge consecutive groups of sort_factor sorted runs into one run each,
+    in passes until at most sort_factor runs are left. Merging consecutive
+    runs keeps their order among equal keys. The merged runs are deleted.
+    Return the paths of the remaining runs, in order
+    """
+    if sort_factor < 2:
+        raise ValueError("sort_factor must be at least 2, not %d" % sort_factor)
+    n_merged = 0
+    while len(runs) > sort_factor:
+        merged = []
+        for start in range(0, len(runs), sort_factor):
+            group = runs[start:start + sort_factor]
+            if len(group) == 1:
+                merged.extend(group)
+                continue
+            path = "%s-%05d" % (merge_prefix, n_merged)
+            n_merged += 1
+            files = [open(run, 'rb') for run in group]
+            try:
+                with open(path, 'wb') as output:
+                    output.writelines(heapq.merge(*files, key=record_key))
+            finally:
+                for f in files:
+                    f.close()
+            for run in group:
+                os.remove(run)
+            merged.append(path)
+        runs = merged
+    return runs
+
+
+def shuffle(runs, reduce_prefix, sort_factor=SORT_FACTOR):
+    """
+    Merge sorted runs by key, keeping the order of the runs (and of the lines
+    in a run) among equal keys, into one file per key.
+    Return the paths of the reduce inputs, in key order
+    """
+    runs = merge_runs(runs, reduce_prefix + '-merge', sort_factor)
+    files = [open(path, 'rb') for path in runs]
+    inputs = []
+    try:
+        key, output = None, None
+        for line in heapq.merge(*files, key=record_key):
+            if output is None or record_key(line) != key:
+                if output is not None:
+                    output.close()
+                key = record_key(line)
+                inputs.append("%s-%05d" % (reduce_prefix, len(inputs)))
+                output = open(inputs[-1], 'wb')
+            output.write(line)
+        if output is not None:
+            output.close()
+    finally:
+        for f in files:
+            f.close()
+    return inputs
+
+
+def _reduce_task(command, input_path, output_path):
+    """
+    Run the reducer on the records of one key and write its output unchanged to output_path
+    """
+    with open(input_path, 'rb') as stdin, open(output_path, 'wb') as stdout:
+        subprocess.run(shlex.split(command), stdin=stdin, stdout=stdout, check=True)
+    return output_path
+
+
+def input_files(paths):
+    """
+    Input files of a job: the given files, and the files of the given directories (not starting with _ or .)
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if not name.startswith(('_', '.')) and os.path.isfile(os.path.join(path, name)))
+        else:
+            files.append(path)
+    return files
+
+
+def run_job(inputs, output, mapper, reducer, n_workers=None, spill_lines=SPILL_LINES, tmp_dir=None, log=sys.stderr,
+            sort_factor=SORT_FACTOR):
+    """
+    Run mapper and reducer (shell-style command lines) over the input files
+    and directories, writing part-NNNNN files and an empty _SUCCESS to output.
+    Return the seconds spent in the map, shuffle and reduce phases
+    """
+    if os.path.exists(output):
+        raise ValueError("output directory %s already exists" % output)
+    work_dir = tempfile.mkdtemp(prefix='mapreduce-', dir=tmp_dir)
+    timings = {}
+    try:
+        with Pool(n_workers) as pool:
+            start_time = time.time()
+            files = input_files(inputs)
+            tasks = [(mapper, path, os.path.join(work_dir, 'map-%05d' % i), spill_lines) for i, path in enumerate(files)]
+            runs = [run for task_runs in pool.starmap(_map_task, tasks) for run in task_runs]
+            timings['map'] = time.time() - start_time
+            log.write("map: %.2fs, %d tasks, %d spilled runs\n" % (timings['map'], len(tasks), len(runs)))
+
+            start_time = time.time()
+            reduce_inputs = shuffle(runs, os.path.join(work_dir, 'reduce'), sort_factor)
+            timings['shuffle'] = time.time() - start_time
+            log.write("shuffle: %.2fs, %d keys\n" % (timings['shuffle'], len(reduce_inputs)))
+
+            start_time = time.time()
+            os.makedirs(output)
+            tasks = [(reducer, path, os.path.join(output, 'part-%05d' % i)) for i, path in enumerate(reduce_inputs)]
+            pool.starmap(_reduce_task, tasks)
+            open(os.path.join(output, '_SUCCESS'), 'wb').close()
+            timings['reduce'] = time.time() - start_time
+            log.write("reduce: %.2fs, %d tasks\n" % (timings['reduce'], len(tasks)))
+    finally:
+        shutil.rmtree(work_dir)
+    return timings
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-i", "--input", action="append", dest="inputs", default=[],
+                      help="input file or directory (repeatable)")
+    parser.add_option("-o", "--output", action="store", dest="output",
+                      help="output directory, must not exist")
+    parser.add_option("-m", "--mapper", action="store", dest="mapper",
+                      help="mapper command line")
+    parser.add_option("-r", "--reducer", action="store", dest="reducer",
+                      help="reducer command line")
+    parser.add_option("-w", "--workers", action="store", dest="n_workers",
+                      help="number of worker processes (default: number of cpus)", type="int")
+    parser.add_option("-s", "--spill-lines", action="store", dest="spill_lines",
+                      default=SPILL_LINES, help="map output lines sorted in memory per spilled run", type="int")
+    parser.add_option("-t", "--tmp-dir", action="store", dest="tmp_dir",
+                      help="directory of the spilled runs and reduce inputs")
+    parser.add_option("-f", "--sort-factor", action="store", dest="sort_factor",
+                      default=SORT_FACTOR, help="spilled runs merged at once by the shuffle", type="int")
+
+    options, args = parser.parse_args(sys.argv)
+    if not (options.inputs and options.output and options.mapper and options.reducer):
+        parser.error("-i, -o, -m and -r are required")
+
+    run_job(options.inputs, options.output, options.mapper, options.reducer,
+            options.n_workers, options.spill_lines, options.tmp_dir, sort_factor=options.sort_factor)
@@ -2,8 +2,8 @@
 import sys
 import pickle
 from optparse import OptionParser
-from lrsgd import LogisticRegressionSGD
-from utils import parse_svm_light_line
+from lrsgd import SparseLogisticRegressionSGD, dumps_model, L1
+from utils import parse_svm_light_batches, iter_samples
 import os
 
 parser = OptionParser()
@@ -13,15 +13,26 @@ parser.add_option("-c", "--Regularization-Constant", action="store", dest="C",
                   default=0.0, help="regularization strength", type="float")
 parser.add_option("-f", "--feature-num", action="store", dest="n_feature",
                   help="number of features", type="int")
+parser.add_option("-p", "--penalty", action="store", dest="penalty", default="sample",
+                  type="choice", choices=list(SparseLogisticRegressionSGD.PENALTIES),
+                  help="regularization: sample (shrink the features of each sample) or l1 (lazy cumulative L1)")
+parser.add_option("-l", "--l1", action="store", dest="l1", default=L1, type="float",
+                  help="L1 penalty per sample of -p l1 (-c is not used with -p l1)")
+parser.add_option("-k", "--pickle", action="store_true", dest="pickle", default=False,
+                  help="write the model as a protocol 0 pickle instead of the compact format of lrsgd.dumps_model")
 options, args = parser.parse_args(sys.argv)
 
-classifier = LogisticRegressionSGD(options.eta, options.C, options.n_feature)
+classifier = SparseLogisticRegressionSGD(options.eta, options.C, options.n_feature, penalty=options.penalty, l1=options.l1)
 
-for line in sys.stdin:
-    key, value = line.split("\t", 1)
-    value = value.strip()
-    X, y = parse_svm_light_line(value)
-    classifier.fit(X, y)
+lines = (line.split("\t", 1)[1] for line in sys.stdin)
+for batch in parse_svm_light_batches(lines):
+    for indices, values, y in iter_samples(*batch):
+        classifier.fit_sparse(indices, values, y)
+classifier.apply_penalty()
 
 file = os.fdopen(sys.stdout.fileno(), 'wb')
-pickle.dump(classifier, file, protocol = 0)
\ No newline at end of file
+if options.pickle:
+    pickle.dump(classifier, file, protocol = 0)
+else:
+    file.write(dumps_model(classifier))
+file.flush()
\ No newline at end of file
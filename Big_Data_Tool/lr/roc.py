@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""
+ROC curve and AUC of probability scores in constant memory: the scores of
+each class are counted in a fixed number of equal-width bins over [0, 1],
+so a test set of any size is summarized by two histograms, and histograms
+of several shards can be added up.
+
+Run on histograms saved by test.py or testensemble.py (-H) to merge shards:
+python lr/roc.py -r roc shard1.json shard2.json
+"""
+
+import sys
+import json
+from optparse import OptionParser
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Default number of bins; scores closer than 1 / N_BINS count as ties
+N_BINS = 10000
+
+
+class StreamingROC:
+    """
+    Histograms of the scores of positive and negative samples. The AUC is
+    exact but for pairs of a positive and a negative sample whose scores fall
+    in the same bin, which count as ties (one half).
+    """
+
+    def __init__(self, n_bins=N_BINS):
+        self.n_bins = n_bins
+        if np is not None:
+            self.positive = np.zeros(n_bins, dtype=np.int64)
+            self.negative = np.zeros(n_bins, dtype=np.int64)
+        else:
+            self.positive = [0] * n_bins
+            self.negative = [0] * n_bins
+
+    def _bin(self, score):
+        return min(max(int(score * self.n_bins), 0), self.n_bins - 1)
+
+    def update(self, y, score):
+        """
+        Count one sample: label y (positive if > 0.5) and its probability score
+        """
+        if y > 0.5:
+            self.positive[self._bin(score)] += 1
+        else:
+            self.negative[self._bin(score)] += 1
+
+    def update_batch(self, labels, scores):
+        """
+        Count a batch of samples given as sequences of labels and scores
+        """
+        if np is None:
+            for y, score in zip(labels, scores):
+                self.update(y, score)
+            return
+        labels = np.asarray(labels, dtype=np.float64)
+        bins = np.clip((np.asarray(scores, dtype=np.float64) * self.n_bins).astype(np.int64), 0, self.n_bins - 1)
+        self.positive += np.bincount(bins[labels > 0.5], minlength=self.n_bins)
+        self.negative += np.bincount(bins[labels <= 0.5], minlength=self.n_bins)
+
+    def merge(self, other):
+        """
+        Add the counts of another StreamingROC with the same number of bins, e.g. of another shard
+        """
+        if other.n_bins != self.n_bins:
+            raise ValueError("cannot merge histograms of %d and %d bins" % (self.n_bins, other.n_bins))
+        if np is not None:
+            self.positive += np.asarray(other.positive)
+            self.negative += np.asarray(other.negative)
+            return self
+        for counts, other_counts in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for b in range(self.n_bins):
+                counts[b] += other_counts[b]
+        return self
+
+    def roc_curve(self):
+        """
+        Return fpr, tpr, thresholds with one point per non-empty bin, from the highest scores down,
+        starting at (0, 0) like sklearn.metrics.roc_curve
+        """
+        n_positive, n_negative = max(int(sum(self.positive)), 1), max(int(sum(self.negative)), 1)
+        fpr, tpr, thresholds = [0.0], [0.0], [float('inf')]
+        tp = fp = 0
+        for b in range(self.n_bins - 1, -1, -1):
+            if self.positive[b] or self.negative[b]:
+                tp += int(self.positive[b])
+                fp += int(self.negative[b])
+                fpr.append(fp / float(n_negative))
+                tpr.append(tp / float(n_positive))
+                thresholds.append(b / float(self.n_bins))
+        return fpr, tpr, thresholds
+
+    def auc(self):
+        """
+        Area under the ROC curve: the probability that a positive sample scores above a negative one
+        """
+        n_positive, n_negative = int(sum(self.positive)), int(sum(self.negative))
+        if not n_positive or not n_negative:
+            return float('nan')
+        area = 0.0
+        tp = 0
+        for b in range(self.n_bins - 1, -1, -1):
+            positive, negative = int(self.positive[b]), int(self.negative[b])
+            area += negative * (tp + positive / 2.0)
+            tp += positive
+        return area / (float(n_positive) * n_negative)
+
+    def save(self, path):
+        """
+        Write the histograms as JSON, only the non-empty bins
+        """
+        with open(path, 'w') as f:
+            json.dump({'n_bins': self.n_bins,
+                       'positive': dict((b, int(c)) for b, c in enumerate(self.positive) if c),
+                       'negative': dict((b, int(c)) for b, c in enumerate(self.negative) if c)}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        roc = cls(data['n_bins'])
+        for counts, saved in [(roc.positive, data['positive']), (roc.negative, data['negative'])]:
+            for b, c in saved.items():
+                counts[int(b)] = c
+        return roc
+
+
+def plot_roc(fpr, tpr, roc_auc, path):
+    """
+    Save the ROC curve figure; matplotlib is only imported here
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    # Plot of a ROC curve for a specific class
+    plt.figure()
+    plt.plot(fpr, tpr, label='ROC curve (area = %0.2f)' % roc_auc)
+    plt.plot([0, 1], [0, 1], 'k--')
+    plt.xlim([0.0, 1.0])
+    plt.ylim([0.0, 1.05])
+    plt.xlabel('False Positive Rate')
+    plt.ylabel('True Positive Rate')
+    plt.title('Receiver operating characteristic')
+    plt.legend(loc="lower right")
+    plt.savefig(path)
+
+
+def report(roc, result=None, histogram=None):
+    """
+    Print the AUC, save the histograms to histogram and the ROC figure to result if they are given
+    """
+    roc_auc = roc.auc()
+    print("AUC: %.6f" % roc_auc)
+    if histogram:
+        roc.save(histogram)
+    if result:
+        fpr, tpr, _ = roc.roc_curve()
+        plot_roc(fpr, tpr, roc_auc, result)
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options] histogram.json ...")
+    parser.add_option("-r", "--result", action="store", dest="result",
+                      help="path of the saved roc figure (no figure if not given)")
+    parser.add_option("-H", "--histogram", action="store", dest="histogram",
+                      help="path where the merged histograms are saved")
+
+    options, args = parser.parse_args(sys.argv)
+    if len(args) < 2:
+        parser.error("no histogram given")
+
+    roc = StreamingROC.load(args[1])
+    for path in args[2:]:
+        roc.merge(StreamingROC.load(path))
+    report(roc, options.result, options.histogram)
@@ -5,18 +5,11 @@ This file should test the model you develop in LogisticRegressionSGD,
 """
 
 import sys
-import pickle
 from optparse import OptionParser
 
-from sklearn.metrics import roc_curve, auc
-from sklearn.datasets import load_svmlight_file
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-
-from lrsgd import LogisticRegressionSGD
-from utils import parse_svm_light_data
+from lrsgd import LogisticRegressionSGD, loads_model
+from roc import StreamingROC, report
+from utils import parse_svm_light_batches, iter_samples
 
 if __name__ == '__main__':
     parser = OptionParser()
@@ -24,29 +17,21 @@ if __name__ == '__main__':
                       default="model.txt", help="path where trained classifier was saved")
     parser.add_option("-r", "--result", action="store", dest="result",
                       default="roc", help="path of the saved roc figure, make sure the folder exists")
+    parser.add_option("-n", "--no-plot", action="store_true", dest="no_plot", default=False,
+                      help="only print the AUC, do not save the roc figure")
+    parser.add_option("-H", "--histogram", action="store", dest="histogram",
+                      help="path where the score histograms are saved, to merge shards with roc.py")
+    parser.add_option("-k", "--pickle", action="store_true", dest="pickle", default=False,
+                      help="also load a model saved as a pickle (by train.py -k or an older version)")
 
     options, args = parser.parse_args(sys.argv)
 
     with open(options.path, 'rb') as f:
-        classifier = pickle.load(f)
-        y_test_prob = []
-        y_test = []
-        for X, y in parse_svm_light_data(sys.stdin):
-            y_prob = classifier.predict_prob(X)
-            y_test.append(y)
-            y_test_prob.append(y_prob)
-
-        fpr, tpr, _ = roc_curve(y_test, y_test_prob)
-        roc_auc = auc(fpr, tpr)
-
-        # Plot of a ROC curve for a specific class
-        plt.figure()
-        plt.plot(fpr, tpr, label='ROC curve (area = %0.2f)' % roc_auc)
-        plt.plot([0, 1], [0, 1], 'k--')
-        plt.xlim([0.0, 1.0])
-        plt.ylim([0.0, 1.05])
-        plt.xlabel('False Positive Rate')
-        plt.ylabel('True Positive Rate')
-        plt.title('Receiver operating characteristic')
-        plt.legend(loc="lower right")
-        plt.savefig(options.result)
+        classifier = loads_model(f.read(), legacy_pickle=options.pickle)
+        roc = StreamingROC()
+        for batch in parse_svm_light_batches(sys.stdin):
+            for indices, values, y in iter_samples(*batch):
+                y_prob = classifier.predict_prob_sparse(indices, values)
+                roc.update(y, y_prob)
+
+        report(roc, None if options.no_plot else options.result, options.histogram)
@@ -2,33 +2,37 @@
 
 import sys
 import os
-import pickle
 
+from concurrent.futures import ThreadPoolExecutor
 from optparse import OptionParser
 
-from sklearn.metrics import roc_curve, auc
-from sklearn.datasets import load_svmlight_file
+try:
+    import numpy as np
+    from scipy.sparse import csr_matrix
+except ImportError:
+    np = csr_matrix = None
 
-import matplotlib
-matplotlib.use('Agg')
+from lrsgd import LogisticRegressionSGD, loads_model
+from roc import StreamingROC, report
+from utils import parse_svm_light_batches, iter_samples
 
-import matplotlib.pyplot as plt
 
-from lrsgd import LogisticRegressionSGD
-from utils import parse_svm_light_data
+def load_model(path, legacy_pickle=False):
+    with open(path, 'rb') as f:
+        return loads_model(f.read(), legacy_pickle=legacy_pickle)
 
 
-def load_model(path):
-    with open(path, 'rb') as f:
-        content_list = [x.replace(b'\t\n', b'\n') for x in f.readlines()]
-    with open('pickled.txt', 'wb') as ufile:
-        for line in content_list:
-            ufile.write(line)
-    with open('pickled.txt', 'rb') as ifile:
-        classifier = pickle.load(ifile)
-    return classifier
-
-def predict_prob(classifiers, X):
+def load_models(path, n_jobs=None, legacy_pickle=False):
+    """
+    Load the classifiers of all the part files of a reducer output folder,
+    reading and decoding the files concurrently in n_jobs threads
+    """
+    files = sorted(os.path.join(path, filename) for filename in os.listdir(path) if filename.startswith('part'))
+    with ThreadPoolExecutor(n_jobs or min(32, len(files) or 1)) as executor:
+        return list(executor.map(lambda path: load_model(path, legacy_pickle), files))
+
+
+def predict_prob(classifiers, indices, values):
     """
     Given a list of trained classifiers,
     predict the probability of positive label.
@@ -36,41 +40,64 @@ def predict_prob(classifiers, X):
     """
     prob_tot = 0.0
     for classifier in classifiers:
-        y_prob = classifier.predict_prob(X)
+        y_prob = classifier.predict_prob_sparse(indices, values)
         prob_tot += y_prob
     return prob_tot / len(classifiers)
 
 
+class EnsembleScorer:
+    """
+    Scores batches of samples with all the classifiers at once: the weights
+    are stacked into one n_feature x n_model matrix and a batch, as flat
+    arrays from utils.parse_svm_light_lines, is scored with one sparse
+    matrix product, so the cost per sample grows with its number of
+    features rather than with the number of models. Needs NumPy and SciPy.
+    """
+
+    def __init__(self, classifiers):
+        n_feature = max(len(classifier.weight) for classifier in classifiers)
+        self.weights = np.zeros((n_feature, len(classifiers)))
+        for j, classifier in enumerate(classifiers):
+            self.weights[:len(classifier.weight), j] = classifier.weight
+
+    def predict_prob(self, indices, values, offsets, per_model=False):
+        """
+        Average probability of the positive label of every sample of a batch
+        (and the n_sample x n_model probabilities of every model if per_model)
+        """
+        X = csr_matrix((np.asarray(values, dtype=np.float64), np.asarray(indices), np.asarray(offsets)),
+                       shape=(len(offsets) - 1, self.weights.shape[0]))
+        probs = 1.0 / (1.0 + np.exp(-np.clip(X.dot(self.weights), -700.0, 700.0)))
+        if per_model:
+            return probs.mean(axis=1), probs
+        return probs.mean(axis=1)
+
+
 if __name__ == '__main__':
     parser = OptionParser()
     parser.add_option("-m", "--model-path", action="store", dest="path",
                       default="models", help="path where trained classifiers are saved")
     parser.add_option("-r", "--result", action="store", dest="result",
                       default="roc", help="name of the figure")
+    parser.add_option("-n", "--no-plot", action="store_true", dest="no_plot", default=False,
+                      help="only print the AUC, do not save the roc figure")
+    parser.add_option("-H", "--histogram", action="store", dest="histogram",
+                      help="path where the score histograms are saved, to merge shards with roc.py")
+    parser.add_option("-k", "--pickle", action="store_true", dest="pickle", default=False,
+                      help="also load models saved as pickles (by reducer.py -k or an older version)")
     
     options, args = parser.parse_args(sys.argv)
 
-    files = [options.path + "/" +
-             filename for filename in os.listdir(options.path) if filename.startswith('part')]
-    classifiers = list(map(load_model, files))
-    y_test_prob = []
-    y_test = []
-    for X, y in parse_svm_light_data(sys.stdin):
-        y_prob = predict_prob(classifiers, X)
-        y_test.append(y)
-        y_test_prob.append(y_prob)
-
-    fpr, tpr, _ = roc_curve(y_test, y_test_prob)
-    roc_auc = auc(fpr, tpr)
-
-    # Plot of a ROC curve for a specific class
-    plt.figure()
-    plt.plot(fpr, tpr, label='ROC curve (area = %0.2f)' % roc_auc)
-    plt.plot([0, 1], [0, 1], 'k--')
-    plt.xlim([0.0, 1.0])
-    plt.ylim([0.0, 1.05])
-    plt.xlabel('False Positive Rate')
-    plt.ylabel('True Positive Rate')
-    plt.title('Receiver operating characteristic')
-    plt.legend(loc="lower right")
-    plt.savefig(options.result)
+    classifiers = load_models(options.path, legacy_pickle=options.pickle)
+    roc = StreamingROC()
+    if csr_matrix is not None:
+        scorer = EnsembleScorer(classifiers)
+        for labels, indices, values, offsets in parse_svm_light_batches(sys.stdin):
+            roc.update_batch(labels, scorer.predict_prob(indices, values, offsets))
+    else:
+        # without NumPy or SciPy every sample is scored by every classifier in turn
+        for batch in parse_svm_light_batches(sys.stdin):
+            for indices, values, y in iter_samples(*batch):
+                roc.update(y, predict_prob(classifiers, indices, values))
+
+    report(roc, None if options.no_plot else options.result, options.histogram)
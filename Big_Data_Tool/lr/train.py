@@ -2,14 +2,98 @@
 
 """
 This file should train the model you develop in LogisticRegressionSGD,
+
+Without -i the training data is read once from stdin, as before. With
+-i FILE the svmlight file is first converted to the binary format of
+utils.svmlight_to_binary (once, then reused while it is newer than FILE)
+and the model is trained for several epochs over the memory mapped arrays,
+visiting blocks of consecutive samples in a random order, with a step size
+schedule and early stopping on the log loss of a held-out slice.
 """
 
 import sys
+import math
 import pickle
+import random
+import copy
 from optparse import OptionParser
 
-from lrsgd import LogisticRegressionSGD
-from utils import parse_svm_light_data
+from lrsgd import SparseLogisticRegressionSGD, dumps_model, L1
+from utils import parse_svm_light_batches, iter_samples, binary_is_stale, svmlight_to_binary, load_binary
+
+SCHEDULES = ('constant', 'inverse', 'exponential')
+
+
+def step_size(eta, schedule, decay, epoch):
+    """
+    Step size of an epoch (counted from 0) under a schedule:
+    constant eta, inverse eta / (1 + decay * epoch), exponential eta * decay ** epoch
+    """
+    if schedule == 'inverse':
+        return eta / (1.0 + decay * epoch)
+    if schedule == 'exponential':
+        return eta * decay ** epoch
+    return eta
+
+
+def shuffled_blocks(start, stop, block_size, rng):
+    """
+    Sample ranges of at most block_size consecutive samples covering [start, stop), in a random order
+    """
+    blocks = [(lo, min(lo + block_size, stop)) for lo in range(start, stop, block_size)]
+    rng.shuffle(blocks)
+    return blocks
+
+
+def log_loss(classifier, labels, indices, values, offsets, start, stop):
+    """
+    Mean log loss of the classifier on samples [start, stop)
+    """
+    if stop <= start:
+        return 0.0
+    loss = 0.0
+    for x_indices, x_values, y in iter_samples(labels, indices, values, offsets, start, stop, not classifier.use_numpy):
+        p = min(max(classifier.predict_prob_sparse(x_indices, x_values), 1e-15), 1.0 - 1e-15)
+        loss -= math.log(p) if y > 0.5 else math.log(1.0 - p)
+    return loss / (stop - start)
+
+
+def train_epochs(classifier, prefix, epochs, schedule='constant', decay=1.0, block_size=1024,
+                 holdout=0.0, patience=2, seed=6505, log=sys.stderr):
+    """
+    Train on the binary data of prefix for at most epochs passes. The last
+    holdout fraction of the samples is not trained on; when it is not empty,
+    training stops after patience epochs without a lower held-out log loss
+    and the classifier of the best epoch is returned.
+    Return classifier
+    """
+    labels, indices, values, offsets = load_binary(prefix)
+    n_samples = len(labels)
+    n_train = n_samples - int(n_samples * holdout)
+    rng = random.Random(seed)
+    eta = classifier.eta
+    best, best_loss, bad_epochs = classifier, None, 0
+    for epoch in range(epochs):
+        classifier.eta = step_size(eta, schedule, decay, epoch)
+        for lo, hi in shuffled_blocks(0, n_train, block_size, rng):
+            for x_indices, x_values, y in iter_samples(labels, indices, values, offsets, lo, hi, not classifier.use_numpy):
+                classifier.fit_sparse(x_indices, x_values, y)
+        if n_train == n_samples:
+            log.write("epoch %d: eta %g\n" % (epoch + 1, classifier.eta))
+            continue
+        evaluated = copy.deepcopy(classifier)
+        evaluated.apply_penalty()
+        loss = log_loss(evaluated, labels, indices, values, offsets, n_train, n_samples)
+        log.write("epoch %d: eta %g, held-out log loss %.6f\n" % (epoch + 1, classifier.eta, loss))
+        if best_loss is None or loss < best_loss:
+            best, best_loss, bad_epochs = evaluated, loss, 0
+        else:
+            bad_epochs += 1
+            if bad_epochs >= patience:
+                break
+    best.eta = eta
+    return best
+
 
 if __name__ == '__main__':
     parser = OptionParser()
@@ -19,16 +103,56 @@ if __name__ == '__main__':
                       dest="C", default=0.01, help="regularization strength", type="float")
     parser.add_option("-f", "--feature-num", action="store",
                       dest="n_feature", help="number of features", type="int")
+    parser.add_option("-p", "--penalty", action="store", dest="penalty", default="sample",
+                      type="choice", choices=list(SparseLogisticRegressionSGD.PENALTIES),
+                      help="regularization: sample (shrink the features of each sample) or l1 (lazy cumulative L1)")
+    parser.add_option("-l", "--l1", action="store", dest="l1", default=L1, type="float",
+                      help="L1 penalty per sample of -p l1 (-c is not used with -p l1)")
     parser.add_option("-m", "--model-path", action="store", dest="path",
                       default="model.txt", help="path where trained classifier will be saved")
+    parser.add_option("-i", "--input", action="store", dest="input",
+                      help="svmlight training file; train for several epochs on its binary form instead of reading stdin")
+    parser.add_option("-b", "--binary", action="store", dest="binary",
+                      help="path prefix of the binary training data (default: the input path)")
+    parser.add_option("-n", "--epochs", action="store", dest="epochs",
+                      default=1, help="number of passes over the input", type="int")
+    parser.add_option("-s", "--schedule", action="store", dest="schedule", default="constant",
+                      type="choice", choices=list(SCHEDULES), help="step size schedule: constant, inverse or exponential")
+    parser.add_option("-d", "--decay", action="store", dest="decay",
+                      default=1.0, help="decay of the step size schedule", type="float")
+    parser.add_option("-B", "--block-size", action="store", dest="block_size",
+                      default=1024, help="consecutive samples per shuffled block", type="int")
+    parser.add_option("-o", "--holdout", action="store", dest="holdout",
+                      default=0.0, help="fraction of the input held out for early stopping", type="float")
+    parser.add_option("-t", "--patience", action="store", dest="patience",
+                      default=2, help="epochs without improvement before stopping", type="int")
+    parser.add_option("-r", "--seed", action="store", dest="seed",
+                      default=6505, help="seed of the block shuffle", type="int")
+    parser.add_option("-u", "--numpy", action="store_true", dest="use_numpy",
+                      default=False, help="keep the weights in a NumPy array")
+    parser.add_option("-k", "--pickle", action="store_true", dest="pickle", default=False,
+                      help="write the model as a protocol 0 pickle instead of the compact format of lrsgd.dumps_model")
 
     options, args = parser.parse_args(sys.argv)
 
-    classifier = LogisticRegressionSGD(
-        options.eta, options.C, options.n_feature)
+    classifier = SparseLogisticRegressionSGD(
+        options.eta, options.C, options.n_feature, use_numpy=options.use_numpy, penalty=options.penalty, l1=options.l1)
 
-    for X, y in parse_svm_light_data(sys.stdin):
-        classifier.fit(X, y)
+    if options.input:
+        prefix = options.binary or options.input
+        if binary_is_stale(prefix, options.input):
+            with open(options.input) as f:
+                svmlight_to_binary(f, prefix)
+        classifier = train_epochs(classifier, prefix, options.epochs, options.schedule, options.decay,
+                                  options.block_size, options.holdout, options.patience, options.seed)
+    else:
+        for batch in parse_svm_light_batches(sys.stdin):
+            for x_indices, x_values, y in iter_samples(*batch, as_list=not classifier.use_numpy):
+                classifier.fit_sparse(x_indices, x_values, y)
+    classifier.apply_penalty()
 
     with open(options.path, "wb") as f:
-        pickle.dump(classifier, f, protocol = 0)
+        if options.pickle:
+            pickle.dump(classifier, f, protocol = 0)
+        else:
+            f.write(dumps_model(classifier))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""
+Train the model of LogisticRegressionSGD on several cores of one machine.
+
+The svmlight input is converted once to the binary format of
+utils.svmlight_to_binary and split into one contiguous shard per worker
+process. Two modes:
+  hogwild - every worker updates one weight vector in shared memory without
+            locks; updates of sparse samples seldom touch the same weights
+  average - every worker trains its own copy of the weights on the next
+            sync samples of its shard, then the copies are averaged; one
+            round per epoch unless sync is set
+The saved model is a SparseLogisticRegressionSGD, written as by train.py.
+"""
+
+import sys
+import pickle
+from multiprocessing import Pool, RawArray
+from optparse import OptionParser
+
+from lrsgd import SparseLogisticRegressionSGD, dumps_model, np, L1
+from utils import binary_is_stale, svmlight_to_binary, load_binary, iter_samples
+from train import SCHEDULES, step_size
+
+MODES = ('hogwild', 'average')
+
+# State of the worker processes, set once per worker by _init_worker so tasks only ship sample ranges
+_data = None
+_shared = None
+_params = None
+
+
+def _init_worker(prefix, shared, params):
+    global _data, _shared, _params
+    _data = load_binary(prefix)
+    _shared = shared
+    _params = params
+
+
+def _classifier(eta, weight):
+    _, C, n_feature, penalty, use_numpy, l1 = _params
+    classifier = SparseLogisticRegressionSGD(eta, C, n_feature, use_numpy=use_numpy, penalty=penalty, l1=l1)
+    classifier.weight = weight
+    return classifier
+
+
+def _fit_range(classifier, start, stop):
+    for indices, values, y in iter_samples(*_data, start=start, stop=stop, as_list=not classifier.use_numpy):
+        classifier.fit_sparse(indices, values, y)
+    classifier.apply_penalty()
+
+
+def _hogwild_shard(eta, start, stop):
+    if _params[4]:
+        weight = np.frombuffer(_shared, dtype=np.float64)
+    else:
+        weight = memoryview(_shared).cast('B').cast('d')
+    _fit_range(_classifier(eta, weight), start, stop)
+
+
+def _average_shard(eta, weight, start, stop):
+    classifier = _classifier(eta, np.array(weight) if _params[4] else list(weight))
+    _fit_range(classifier, start, stop)
+    return classifier.weight
+
+
+def shards(n_samples, n_workers):
+    """
+    Split [0, n_samples) into n_workers contiguous ranges of nearly equal size
+    """
+    bounds = [n_samples * i // n_workers for i in range(n_workers + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def train_parallel(prefix, eta, C, n_feature, n_workers, mode='hogwild', epochs=1, schedule='constant',
+                   decay=1.0, sync=None, penalty='sample', use_numpy=False, l1=L1):
+    """
+    Train on the binary data of prefix with n_workers processes (in this
+    process if n_workers is 1). In average mode the weights are averaged
+    after every sync samples of each shard, or once per epoch if sync is None.
+    Return classifier
+    """
+    if mode not in MODES:
+        raise ValueError("mode must be one of %s, not %r" % (", ".join(MODES), mode))
+    use_numpy = use_numpy and np is not None
+    n_samples = len(load_binary(prefix)[0])
+    ranges = shards(n_samples, n_workers)
+    shared = RawArray('d', n_feature)
+    params = (eta, C, n_feature, penalty, use_numpy, l1)
+    pool = None
+    if n_workers == 1:
+        _init_worker(prefix, shared, params)
+    else:
+        pool = Pool(n_workers, initializer=_init_worker, initargs=(prefix, shared, params))
+
+    weight = [0.0] * n_feature
+    try:
+        for epoch in range(epochs):
+            epoch_eta = step_size(eta, schedule, decay, epoch)
+            if mode == 'hogwild':
+                tasks = [(epoch_eta, start, stop) for start, stop in ranges]
+                if pool is None:
+                    _hogwild_shard(*tasks[0])
+                else:
+                    pool.starmap(_hogwild_shard, tasks)
+                continue
+            step = sync or max(stop - start for start, stop in ranges) or 1
+            for offset in range(0, max(stop - start for start, stop in ranges), step):
+                tasks = [(epoch_eta, weight, start + offset, min(start + offset + step, stop))
+                         for start, stop in ranges if start + offset < stop]
+                if pool is None:
+                    results = [_average_shard(*task) for task in tasks]
+                else:
+                    results = pool.starmap(_average_shard, tasks)
+                weight = [sum(w) / len(results) for w in zip(*results)]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    classifier = SparseLogisticRegressionSGD(eta, C, n_feature, use_numpy=use_numpy, penalty=penalty, l1=l1)
+    weight = list(shared) if mode == 'hogwild' else weight
+    classifier.weight = np.array(weight) if use_numpy else weight
+    return classifier
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-e", "--eta", action="store",
+                      dest="eta", default=0.1, help="step size", type="float")
+    parser.add_option("-c", "--Regularization-Constant", action="store",
+                      dest="C", default=0.01, help="regularization strength", type="float")
+    parser.add_option("-f", "--feature-num", action="store",
+                      dest="n_feature", help="number of features", type="int")
+    parser.add_option("-p", "--penalty", action="store", dest="penalty", default="sample",
+                      type="choice", choices=list(SparseLogisticRegressionSGD.PENALTIES),
+                      help="regularization: sample (shrink the features of each sample) or l1 (lazy cumulative L1)")
+    parser.add_option("-l", "--l1", action="store", dest="l1", default=L1, type="float",
+                      help="L1 penalty per sample of -p l1 (-c is not used with -p l1)")
+    parser.add_option("-m", "--model-path", action="store", dest="path",
+                      default="model.txt", help="path where trained classifier will be saved")
+    parser.add_option("-i", "--input", action="store", dest="input",
+                      help="svmlight training file")
+    parser.add_option("-b", "--binary", action="store", dest="binary",
+                      help="path prefix of the binary training data (default: the input path)")
+    parser.add_option("-w", "--workers", action="store", dest="n_workers",
+                      default=4, help="number of worker processes", type="int")
+    parser.add_option("-a", "--mode", action="store", dest="mode", default="hogwild",
+                      type="choice", choices=list(MODES), help="hogwild (shared weights) or average (parameter averaging)")
+    parser.add_option("-y", "--sync", action="store", dest="sync",
+                      help="samples per shard between two averagings (default: once per epoch)", type="int")
+    parser.add_option("-n", "--epochs", action="store", dest="epochs",
+                      default=1, help="number of passes over the input", type="int")
+    parser.add_option("-s", "--schedule", action="store", dest="schedule", default="constant",
+                      type="choice", choices=list(SCHEDULES), help="step size schedule: constant, inverse or exponential")
+    parser.add_option("-d", "--decay", action="store", dest="decay",
+                      default=1.0, help="decay of the step size schedule", type="float")
+    parser.add_option("-u", "--numpy", action="store_true", dest="use_numpy",
+                      default=False, help="keep the weights in a NumPy array")
+    parser.add_option("-k", "--pickle", action="store_true", dest="pickle", default=False,
+                      help="write the model as a protocol 0 pickle instead of the compact format of lrsgd.dumps_model")
+
+    options, args = parser.parse_args(sys.argv)
+    if not options.input:
+        parser.error("-i/--input is required")
+
+    prefix = options.binary or options.input
+    if binary_is_stale(prefix, options.input):
+        with open(options.input) as f:
+            svmlight_to_binary(f, prefix)
+    classifier = train_parallel(prefix, options.eta, options.C, options.n_feature, options.n_workers,
+                                options.mode, options.epochs, options.schedule, options.decay, options.sync,
+                                options.penalty, options.use_numpy, options.l1)
+
+    with open(options.path, "wb") as f:
+        if options.pickle:
+            pickle.dump(classifier, f, protocol = 0)
+        else:
+            f.write(dumps_model(classifier))
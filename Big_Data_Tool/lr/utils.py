@@ -1,5 +1,35 @@
+import os
+import sys
+import mmap
+import base64
+import struct
+from array import array
+from itertools import accumulate
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 to_float_tuple = lambda x: (int(x[0]), float(x[1]))
 
+# Lines parsed at a time by parse_svm_light_batches; larger batches parse slower as they fall out of cache
+BATCH_SIZE = 1000
+
+# Maps digits and signs to 'x', the other characters of well-formed numbers to 'f' and whitespace to ' ', leaving
+# the separators of a batch. An idx written as a float (e.g. 1.0:3 or 1e5:3), which int() rejects but NumPy
+# parses, is the only way an 'f' can be followed by ':' once the 'x' are deleted
+_SEPARATORS = bytes(bytearray(ord('x') if chr(c) in '0123456789+-' else ord('f') if chr(c) in '.eE'
+                              else ord(' ') if chr(c) in '\t\n\r' else c for c in range(256)))
+
+# First character of a sample packed by pack_samples, and its header: number of features, label
+PACKED_PREFIX = '@'
+_PACKED_HEADER = struct.Struct('<id')
+
+# Files of the binary format written by svmlight_to_binary, as (suffix, array typecode).
+# offsets[i]:offsets[i + 1] is the slice of indices/values holding sample i; native byte order.
+BINARY_ARRAYS = [('.labels', 'd'), ('.indices', 'i'), ('.values', 'd'), ('.offsets', 'q')]
+
 
 def parse_svm_light_data(input):
 
@@ -17,3 +47,229 @@ def parse_svm_light_line(line):
     else:
         X = []
     return (X, y)
+
+
+def _parse_svm_light_strict(lines, first_line=1):
+    """
+    Parse svmlight lines one token at a time, raising ValueError with the
+    line number on the first malformed label or idx:value token.
+    Return labels, indices, values, offsets as arrays
+    """
+    labels, indices, values, offsets = array('d'), array('i'), array('d'), array('q', [0])
+    for line_no, line in enumerate(lines, first_line):
+        splits = line.split()
+        if not splits:
+            continue
+        try:
+            labels.append(float(splits[0]))
+            for token in splits[1:]:
+                index, sep, value = token.partition(':')
+                if not (index and sep and value):
+                    raise ValueError("expected idx:value")
+                index = int(index)
+                if index < 0:
+                    raise ValueError("negative feature index")
+                indices.append(index)
+                values.append(float(value))
+        except (ValueError, OverflowError) as e:
+            raise ValueError("line %d: malformed svmlight data %r (%s)" % (line_no, line.strip()[:80], e))
+        offsets.append(len(indices))
+    return labels, indices, values, offsets
+
+
+def parse_svm_light_lines(lines, use_numpy=True, first_line=1):
+    """
+    Parse a batch of svmlight lines at once into flat arrays: the labels,
+    the feature indices and values of all samples one after the other, and
+    offsets such that offsets[i]:offsets[i + 1] is the slice of sample i.
+    Blank lines are skipped. Lines of samples packed by pack_samples are
+    unpacked instead of parsed.
+
+    With NumPy, the feature tokens of the whole batch are joined and
+    converted in one go, after checking that besides number characters only
+    ':' and whitespace are used, that no ':' has an empty side, no token has
+    two ':' and no idx is written as a float; with as many numbers as twice
+    the ':' count, every token is then exactly idx:value. Without NumPy, and
+    for a batch that fails the check or the conversion, the lines are parsed
+    token by token, which either accepts them (e.g. nan values) or raises
+    ValueError with the number of the malformed line.
+    Return labels, indices, values, offsets as NumPy arrays if use_numpy and
+    NumPy is installed, as array('d'), array('i'), array('d'), array('q') otherwise
+    """
+    lines = list(lines)
+    if lines and lines[0].startswith(PACKED_PREFIX):
+        return unpack_samples(lines, use_numpy)
+    if not use_numpy or np is None:
+        return _parse_svm_light_strict(lines, first_line)
+    labels, rests = [], []
+    for line in lines:
+        splits = line.split(None, 1)
+        if splits:
+            labels.append(splits[0])
+            rests.append(splits[1] if len(splits) > 1 else '')
+    text = ' '.join(rests).strip()
+    n = text.count(':')
+    try:
+        shape = text.encode().translate(_SEPARATORS)
+        marks = shape.translate(None, b'x')
+        separators = marks.translate(None, b'f')
+        if b' :' in shape or b': ' in shape or shape.startswith(b':') or shape.endswith(b':') \
+                or b'::' in separators or len(separators) - separators.count(b' ') != n or b'f:' in marks:
+            raise ValueError("malformed feature token")
+        offsets = list(accumulate([0] + [rest.count(':') for rest in rests]))
+        numbers = np.array(text.replace(':', ' ').split(), dtype=np.float64)
+        index = numbers[0::2]
+        if len(numbers) != 2 * n or (index != np.floor(index)).any() or (index < 0).any() \
+                or (n and index.max() > np.iinfo(np.int32).max):
+            raise ValueError("malformed feature token")
+        return (np.array([float(label) for label in labels]), index.astype(np.int32),
+                numbers[1::2].copy(), np.array(offsets, dtype=np.int64))
+    except (ValueError, OverflowError):
+        labels, indices, values, offsets = _parse_svm_light_strict(lines, first_line)
+        return (np.frombuffer(labels, dtype=np.float64), np.frombuffer(indices, dtype=np.int32),
+                np.frombuffer(values, dtype=np.float64), np.frombuffer(offsets, dtype=np.int64))
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def pack_samples(labels, indices, values, offsets):
+    """
+    Pack every sample of flat arrays into one line of text: PACKED_PREFIX,
+    then the base64 of the number of features and the label, the int32
+    indices and the float64 values, little-endian. parse_svm_light_lines
+    reads such lines back without parsing any number.
+    Return a list of str, one per sample
+    """
+    indices = _little_endian(array('i', indices)).tobytes()
+    values = _little_endian(array('d', values)).tobytes()
+    packed = []
+    for i in range(len(labels)):
+        lo, hi = int(offsets[i]), int(offsets[i + 1])
+        data = _PACKED_HEADER.pack(hi - lo, labels[i]) + indices[4 * lo:4 * hi] + values[8 * lo:8 * hi]
+        packed.append(PACKED_PREFIX + base64.b64encode(data).decode('ascii'))
+    return packed
+
+
+def unpack_samples(lines, use_numpy=True):
+    """
+    Read back lines written by pack_samples (blank lines are skipped).
+    Return labels, indices, values, offsets as parse_svm_light_lines does
+    """
+    labels, indices, values, offsets = array('d'), array('i'), array('d'), array('q', [0])
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith(PACKED_PREFIX):
+            raise ValueError("expected a packed sample, got %r" % line[:80])
+        data = base64.b64decode(line[1:])
+        n, label = _PACKED_HEADER.unpack_from(data)
+        if len(data) != _PACKED_HEADER.size + 12 * n:
+            raise ValueError("truncated packed sample %r" % line[:80])
+        labels.append(label)
+        indices.frombytes(data[_PACKED_HEADER.size:_PACKED_HEADER.size + 4 * n])
+        values.frombytes(data[_PACKED_HEADER.size + 4 * n:])
+        offsets.append(len(indices))
+    _little_endian(indices)
+    _little_endian(values)
+    if use_numpy and np is not None:
+        return (np.frombuffer(labels, dtype=np.float64), np.frombuffer(indices, dtype=np.int32),
+                np.frombuffer(values, dtype=np.float64), np.frombuffer(offsets, dtype=np.int64))
+    return labels, indices, values, offsets
+
+
+def parse_svm_light_batches(input, batch_size=BATCH_SIZE, use_numpy=True):
+    """
+    Iterate over the lines of input in batches of batch_size lines parsed by parse_svm_light_lines
+    """
+    lines = []
+    first_line = 1
+    for line in input:
+        lines.append(line)
+        if len(lines) == batch_size:
+            yield parse_svm_light_lines(lines, use_numpy, first_line)
+            first_line += len(lines)
+            lines = []
+    if lines:
+        yield parse_svm_light_lines(lines, use_numpy, first_line)
+
+
+def iter_samples(labels, indices, values, offsets, start=0, stop=None, as_list=True):
+    """
+    Iterate over (indices, values, label) of samples [start, stop) of flat
+    arrays. With as_list the slice is copied to lists first, which the list
+    weights of SparseLogisticRegressionSGD index much faster than array elements.
+    """
+    if stop is None:
+        stop = len(labels)
+    base = offsets[start]
+    block_offsets = offsets[start:stop + 1]
+    block_indices = indices[base:offsets[stop]]
+    block_values = values[base:offsets[stop]]
+    block_labels = labels[start:stop]
+    if as_list:
+        block_offsets, block_indices, block_values, block_labels = \
+            block_offsets.tolist(), block_indices.tolist(), block_values.tolist(), block_labels.tolist()
+    for i in range(stop - start):
+        lo, hi = block_offsets[i] - base, block_offsets[i + 1] - base
+        yield block_indices[lo:hi], block_values[lo:hi], block_labels[i]
+
+
+def binary_is_stale(prefix, source=None):
+    """
+    True if the binary files of prefix are missing or older than source
+    """
+    paths = [prefix + suffix for suffix, _ in BINARY_ARRAYS]
+    if not all(os.path.exists(path) for path in paths):
+        return True
+    return source is not None and os.path.getmtime(source) > min(os.path.getmtime(path) for path in paths)
+
+
+def svmlight_to_binary(input, prefix, block_size=BATCH_SIZE):
+    """
+    Convert svmlight lines to the binary format: labels, feature indices,
+    feature values and sample offsets, each in its own flat file so they can
+    be memory mapped by load_binary. The files are written under temporary
+    names and the offsets file is renamed into place last, so an interrupted
+    conversion is seen as stale.
+    Return the number of samples
+    """
+    files = dict((suffix, open(prefix + suffix + '.tmp', 'wb')) for suffix, _ in BINARY_ARRAYS)
+    array('q', [0]).tofile(files['.offsets'])
+    n_samples = n_values = 0
+    for labels, indices, values, offsets in parse_svm_light_batches(input, block_size, use_numpy=False):
+        labels.tofile(files['.labels'])
+        indices.tofile(files['.indices'])
+        values.tofile(files['.values'])
+        array('q', [offset + n_values for offset in offsets[1:]]).tofile(files['.offsets'])
+        n_samples += len(labels)
+        n_values += len(values)
+    for suffix, f in files.items():
+        f.close()
+    for suffix, _ in BINARY_ARRAYS:
+        os.replace(prefix + suffix + '.tmp', prefix + suffix)
+    return n_samples
+
+
+def load_binary(prefix):
+    """
+    Memory map the files written by svmlight_to_binary.
+    Return labels, indices, values, offsets as read-only NumPy arrays, or as
+    memoryviews if NumPy is not installed
+    """
+    arrays = []
+    for suffix, typecode in BINARY_ARRAYS:
+        path = prefix + suffix
+        if np is not None:
+            arrays.append(np.memmap(path, dtype=np.dtype(typecode), mode='r') if os.path.getsize(path)
+                          else np.zeros(0, dtype=np.dtype(typecode)))
+        elif os.path.getsize(path):
+            with open(path, 'rb') as f:
+                arrays.append(memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode))
+        else:
+            arrays.append(memoryview(array(typecode)))
+    return arrays
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of svmlight_stream.py against the bag_to_svmlight UDF of utils.py
+on synthetic feature bags (their equivalence is tested by
+tests/test_svmlight_stream.py).
+The UDF is timed on tuples already in memory, the stream on the text of the
+bags, which it parses too: the timings are not those of the Pig jobs.
+
+python pig/benchmark.py [number of patients]
+"""
+
+import io
+import os
+import sys
+import time
+import random
+
+from etl import java_double
+from svmlight_stream import run
+
+# Default number of synthetic patients
+N_PATIENTS = 100000
+
+
+def timed(fn, *args):
+    start_time = time.time()
+    result = fn(*args)
+    return result, time.time() - start_time
+
+
+def load_udf():
+    """
+    bag_to_svmlight of utils.py. Its outputSchema decorator is defined by Pig's Jython runtime,
+    here as a decorator that returns the function unchanged
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils.py')
+    namespace = {'outputSchema': lambda schema: lambda fn: fn}
+    with open(path) as f:
+        exec(compile(f.read(), path, 'exec'), namespace)
+    return namespace['bag_to_svmlight']
+
+
+def synthetic_bags(n_patients, features_per_patient=100, n_features=3190, seed=6505):
+    """
+    {patientid: bag of (patientid, idx, normalizedfeaturevalue)} in a random order of idx, with the values of
+    counts divided by max counts, and some that Double.toString writes in scientific notation
+    """
+    rng = random.Random(seed)
+    bags = {}
+    for patientid in range(n_patients):
+        indices = rng.sample(range(n_features), rng.randint(1, 2 * features_per_patient))
+        bags[patientid] = [(patientid, idx, rng.randint(1, 20) / float(rng.choice([20, 30, 70, 100000])))
+                           for idx in indices]
+    return bags
+
+
+def stream_input(bags):
+    """
+    The groups as PigStreaming writes them to the streaming process
+    """
+    return ["%d\t{%s}\n" % (patientid, ",".join("(%d,%d,%s)" % (p, idx, java_double(value)) for p, idx, value in bag))
+            for patientid, bag in bags.items()]
+
+
+def bench_svmlight(n_patients):
+    bags = synthetic_bags(n_patients)
+    lines = stream_input(bags)
+    udf = load_udf()
+
+    def udf_lines(bags):
+        # the UDF gets each bag sorted by idx by the nested ORDER of etl.pig
+        return ["%d\t%s\n" % (patientid, udf(sorted(bag, key=lambda t: t[1]))) for patientid, bag in bags.items()]
+
+    def stream_lines(lines):
+        output = io.StringIO()
+        run(iter(lines), output)
+        return output.getvalue().splitlines(True)
+
+    expected, udf_time = timed(udf_lines, bags)
+    actual, stream_time = timed(stream_lines, lines)
+    megabytes = sum(len(line) for line in lines) / 1e6
+    print("svmlight: %d patients, %.1f MB of bags, %s output; udf (tuples in memory) %.3fs, "
+          "stream (parsing the bags) %.3fs" % (n_patients, megabytes, "same" if actual == expected else "DIFFERENT",
+                                               udf_time, stream_time))
+
+
+if __name__ == '__main__':
+    bench_svmlight(int(sys.argv[1]) if len(sys.argv) > 1 else N_PATIENTS)
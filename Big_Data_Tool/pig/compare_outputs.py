@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+Check that two runs of the ETL (etl.pig, etl_optimized.pig or etl.py) stored
+the same relations: for every STORE directory, the lines of its part files
+must be the same multiset, whatever their order and split into part files.
+
+python pig/compare_outputs.py <output directory> <other output directory>
+
+Exits with status 1 if a relation differs or is missing.
+"""
+
+import os
+import sys
+from collections import Counter
+from optparse import OptionParser
+
+from etl import STORES
+
+# Lines shown of each side of a difference
+N_EXAMPLES = 5
+
+
+def read_relation(directory):
+    """
+    Counter of the lines of the part files of a STORE directory (files starting with _ or . are skipped)
+    """
+    lines = Counter()
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.startswith(('_', '.')) or not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            lines.update(f.read().splitlines())
+    return lines
+
+
+def compare(first, second, names=None, log=sys.stdout):
+    """
+    Compare the STOREs names (default: all those of etl.pig) under the directories first and second.
+    Return the names that differ
+    """
+    differing = []
+    for name in names or [name for name, _ in STORES]:
+        missing = [directory for directory in [first, second] if not os.path.isdir(os.path.join(directory, name))]
+        if missing:
+            log.write("%s: missing in %s\n" % (name, ", ".join(missing)))
+            differing.append(name)
+            continue
+        lines, other_lines = read_relation(os.path.join(first, name)), read_relation(os.path.join(second, name))
+        if lines == other_lines:
+            log.write("%s: %d lines, same\n" % (name, sum(lines.values())))
+            continue
+        differing.append(name)
+        only_first, only_second = lines - other_lines, other_lines - lines
+        log.write("%s: %d lines only in %s, %d only in %s\n" %
+                  (name, sum(only_first.values()), first, sum(only_second.values()), second))
+        for sign, only in [('-', only_first), ('+', only_second)]:
+            for line in sorted(only)[:N_EXAMPLES]:
+                log.write("  %s %s\n" % (sign, line))
+    return differing
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options] output_directory other_output_directory")
+    parser.add_option("-s", "--store", action="append", dest="names",
+                      help="STORE to compare (repeatable, default: all those of etl.pig)")
+
+    options, args = parser.parse_args(sys.argv)
+    if len(args) != 3:
+        parser.error("two output directories are required")
+
+    sys.exit(1 if compare(args[1], args[2], options.names) else 0)
@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+
+"""
+Python port of etl.pig, to run and profile the pipeline on one multi-core
+machine without Pig:
+
+python pig/etl.py -e ../../data/events.csv -m ../../data/mortality.csv -o <output directory> -w <workers>
+
+The events are hash-partitioned by patientid and every partition is
+processed in a pool of worker processes, in two rounds:
+  1. join with mortality, index dates and time differences (aliveevents,
+     deadevents), observation window (filtered), counts per (patientid,
+     eventid) (features_aggregate), labels and the max count of each eventid
+  2. after the feature map (features) is built from the eventids of all
+     partitions: feature ids (features_map), min-max normalization
+     (features_normalized) and the svmlight line of every patient
+The sorted runs of the partitions are then merged into every STORE of the
+script, as <output>/<name>/part-r-00000, and the samples are split into
+training and testing with the draws of Pig's RANDOM('6505').
+
+Values are read and written as PigStorage does: fields split on every comma,
+empty fields are null (written back empty), value is a float and the
+normalized features are doubles, both in the format of Java's toString. Rows the
+script leaves in any order (equal ORDER BY keys) are ordered by their text.
+The time of every phase is reported on stderr.
+"""
+
+import os
+import sys
+import time
+import heapq
+import shutil
+import struct
+import tempfile
+from decimal import Decimal
+from datetime import datetime, timedelta
+from functools import lru_cache
+from collections import defaultdict
+from multiprocessing import Pool
+from optparse import OptionParser
+
+# Every STORE of etl.pig in script order, with its delimiter
+STORES = (('aliveevents', ','), ('deadevents', ','), ('filtered', ','), ('features_aggregate', ','),
+          ('features', ' '), ('features_map', ','), ('features_normalized', ','), ('samples', ' '),
+          ('testing', ' '), ('training', ' '))
+
+# ORDER BY columns (index, type) of the relations merged from the partition runs
+ORDERS = {
+    'aliveevents': [(0, int), (1, str)],
+    'deadevents': [(0, int), (1, str)],
+    'filtered': [(0, int), (1, str), (4, int)],
+    'features_aggregate': [(0, int), (1, str)],
+    'features_map': [(0, int), (1, int)],
+    'features_normalized': [(0, int), (1, int)],
+    # runs of "patientid,label sparsefeature", ordered by patientid as samples is
+    'samples': [(0, int)],
+}
+
+# Observation window of filtered, in days before the index date
+WINDOW = 2000
+# Days between death and the index date of dead patients
+DEATH_OFFSET = 30
+SEED = 6505
+TEST_RATIO = 0.20
+
+# Matches of a patient who is not in mortality: (mtimestamp, label) of the outer join
+NO_MORTALITY = [(None, None)]
+
+# Mortality by patientid, set once per worker by _init_worker
+_mortality = None
+
+
+class JavaRandom:
+    """
+    java.util.Random, which Pig's RANDOM(seed) UDF draws from with nextDouble
+    """
+
+    MULTIPLIER = 0x5DEECE66D
+    MASK = (1 << 48) - 1
+
+    def __init__(self, seed):
+        self.seed = (seed ^ self.MULTIPLIER) & self.MASK
+
+    def _next(self, bits):
+        self.seed = (self.seed * self.MULTIPLIER + 0xB) & self.MASK
+        return self.seed >> (48 - bits)
+
+    def next_double(self):
+        return ((self._next(26) << 27) + self._next(27)) / float(1 << 53)
+
+
+def _java_notation(x, shortest):
+    """
+    x laid out as Java's Float.toString and Double.toString do, from the shortest decimal string that reads back
+    as x: decimal notation for 1e-3 <= |x| < 1e7, computerized scientific notation (1.0E7) otherwise
+    """
+    if x != x:
+        return 'NaN'
+    if x in (float('inf'), float('-inf')):
+        return 'Infinity' if x > 0 else '-Infinity'
+    if x == 0:
+        return '-0.0' if str(x).startswith('-') else '0.0'
+    sign, digits, exponent = Decimal(shortest).as_tuple()
+    sign = '-' if sign else ''
+    digits = ''.join(map(str, digits))
+    exponent += len(digits) - len(digits.rstrip('0'))
+    digits = digits.rstrip('0')
+    point = len(digits) + exponent
+    if not 1e-3 <= abs(x) < 1e7:
+        return "%s%s.%sE%d" % (sign, digits[0], digits[1:] or '0', point - 1)
+    if point <= 0:
+        return sign + '0.' + '0' * -point + digits
+    if point >= len(digits):
+        return sign + digits + '0' * (point - len(digits)) + '.0'
+    return sign + digits[:point] + '.' + digits[point:]
+
+
+def to_float32(x):
+    try:
+        return struct.unpack('<f', struct.pack('<f', x))[0]
+    except OverflowError:
+        return float('inf') if x > 0 else float('-inf')
+
+
+def java_float(x):
+    """
+    Float.toString of the float (single precision) x
+    """
+    # binary search of the fewest digits after the first that read back as x; 8 always do
+    low, high = 0, 8
+    while low < high:
+        middle = (low + high) // 2
+        if to_float32(float('%.*e' % (middle, x))) == x:
+            high = middle
+        else:
+            low = middle + 1
+    return _java_notation(x, '%.*e' % (low, x))
+
+
+def java_double(x):
+    """
+    Double.toString of x
+    """
+    return _java_notation(x, repr(x))
+
+
+def pig_text(value):
+    """
+    A field as PigStorage writes it: null as an empty field, doubles with Double.toString
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return java_double(value)
+    return str(value)
+
+
+def _fields(line, n_fields):
+    """
+    The first n_fields fields of a PigStorage(',') line, None for empty or missing ones
+    """
+    fields = line.rstrip('\n').split(',', n_fields)[:n_fields]
+    fields += [''] * (n_fields - len(fields))
+    return [field or None for field in fields]
+
+
+def _to_int(field):
+    try:
+        return int(field)
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=1 << 16)
+def _float_text(field):
+    """
+    A value:float field as PigStorage reads it and writes it back, None if it is not a number
+    """
+    try:
+        return java_float(to_float32(float(field)))
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=None)
+def _to_date(field):
+    """
+    ToDate(field, 'yyyy-MM-dd'); a malformed date fails the job, as in Pig
+    """
+    if field is None:
+        return None
+    return datetime.strptime(field, '%Y-%m-%d').date()
+
+
+def _days_between(later, earlier):
+    if later is None or earlier is None:
+        return None
+    return (later - earlier).days
+
+
+def load_mortality(path):
+    """
+    {patientid: [(mtimestamp, label), ...]} of mortality.csv, in file order
+    """
+    mortality = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            patientid, timestamp, label = _fields(line, 3)
+            mortality[_to_int(patientid)].append((_to_date(timestamp), _to_int(label)))
+    mortality.pop(None, None)
+    return dict(mortality)
+
+
+def _order_key(line, columns):
+    fields = line.rstrip('\n').split(',')
+    key = []
+    for i, kind in columns:
+        value = None if fields[i] == '' else kind(fields[i])
+        # Pig orders nulls first
+        key.append((value is not None, value))
+    return tuple(key) + (line,)
+
+
+def _write_run(lines, path, name):
+    lines.sort(key=lambda line: _order_key(line, ORDERS[name]))
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+
+def _init_worker(mortality_path):
+    global _mortality
+    _mortality = load_mortality(mortality_path)
+
+
+def partition_events(events_path, n_partitions, prefix):
+    """
+    Split the events by hash of patientid into n_partitions files prefix-NNNNN.
+    Events without a patientid are dropped: they join no index date in etl.pig.
+    Return the paths
+    """
+    paths = ["%s-%05d" % (prefix, i) for i in range(n_partitions)]
+    files = [open(path, 'w') for path in paths]
+    try:
+        with open(events_path) as f:
+            for line in f:
+                patientid = _to_int(line.split(',', 1)[0] or None)
+                if patientid is not None:
+                    files[hash(patientid) % n_partitions].write(line)
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def _events_round(path):
+    """
+    Round 1 on one partition. Write its sorted runs path.<store> (and path.labels)
+    and return {eventid: max count of a patient}
+    """
+    patients = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            patientid, eventid, _, timestamp, value = _fields(line, 5)
+            # values are kept as the text they are stored as
+            patients[int(patientid)].append((eventid, _to_date(timestamp), _float_text(value)))
+
+    alive, dead = [], []
+    for patientid, events in patients.items():
+        alive_events = []
+        for eventid, etimestamp, value in events:
+            for mtimestamp, label in _mortality.get(patientid, NO_MORTALITY):
+                if label is None:
+                    alive_events.append((eventid, etimestamp, value))
+                else:
+                    index_date = None if mtimestamp is None else mtimestamp - timedelta(days=DEATH_OFFSET)
+                    dead.append((patientid, eventid, value, 1, _days_between(index_date, etimestamp)))
+        dates = [etimestamp for _, etimestamp, _ in alive_events if etimestamp is not None]
+        index_date = max(dates) if dates else None
+        alive.extend((patientid, eventid, value, 0, _days_between(index_date, etimestamp))
+                     for eventid, etimestamp, value in alive_events)
+
+    filtered = [row for row in alive + dead
+                if row[2] is not None and row[4] is not None and 0 <= row[4] <= WINDOW]
+    counts = defaultdict(int)
+    labels = set()
+    for patientid, eventid, _, label, _ in filtered:
+        # COUNT skips null eventids
+        counts[(patientid, eventid)] += eventid is not None
+        labels.add((patientid, label))
+    maxvalues = {}
+    for (patientid, eventid), count in counts.items():
+        maxvalues[eventid] = max(count, maxvalues.get(eventid, 0))
+
+    for name, rows in [('aliveevents', alive), ('deadevents', dead), ('filtered', filtered)]:
+        _write_run(["%d,%s,%s,%d,%s\n" % (patientid, pig_text(eventid), pig_text(value), label, pig_text(time_difference))
+                    for patientid, eventid, value, label, time_difference in rows], path + '.' + name, name)
+    _write_run(["%d,%s,%d\n" % (patientid, pig_text(eventid), count) for (patientid, eventid), count in counts.items()],
+               path + '.features_aggregate', 'features_aggregate')
+    with open(path + '.labels', 'w') as f:
+        f.writelines("%d,%d\n" % label for label in labels)
+    return maxvalues
+
+
+def _features_round(path, index, maxvalues):
+    """
+    Round 2 on one partition, given the idx and the max count of every eventid:
+    write its sorted runs path.features_map, path.features_normalized and path.samples
+    """
+    features = []
+    with open(path + '.features_aggregate') as f:
+        for line in f:
+            patientid, eventid, count = line.rstrip('\n').split(',')
+            # a null eventid joins no feature
+            if eventid:
+                features.append((int(patientid), index[eventid], int(count)))
+    features.sort()
+    labels = defaultdict(set)
+    with open(path + '.labels') as f:
+        for line in f:
+            patientid, label = line.rstrip('\n').split(',')
+            labels[int(patientid)].add(int(label))
+
+    normalized = [(patientid, idx, float(count) / float(maxvalues[idx])) for patientid, idx, count in features]
+    bags = defaultdict(list)
+    for patientid, idx, value in normalized:
+        bags[patientid].append("%s:%f" % (idx, value))
+    samples = ["%d,%d %s\n" % (patientid, label, " ".join(bag))
+               for patientid, bag in bags.items() for label in labels[patientid]]
+
+    _write_run(["%d,%d,%d\n" % row for row in features], path + '.features_map', 'features_map')
+    _write_run(["%d,%d,%s\n" % (patientid, idx, java_double(value)) for patientid, idx, value in normalized],
+               path + '.features_normalized', 'features_normalized')
+    _write_run(samples, path + '.samples', 'samples')
+
+
+def feature_index(maxvalues):
+    """
+    The feature map: eventids in ascending order (null first), ranked from 0. Return [(idx, eventid)]
+    """
+    return list(enumerate(sorted(maxvalues, key=lambda eventid: (eventid is not None, eventid or ''))))
+
+
+def _store(output, name, lines):
+    directory = os.path.join(output, name)
+    os.makedirs(directory)
+    with open(os.path.join(directory, 'part-r-00000'), 'w') as f:
+        f.writelines(lines)
+    open(os.path.join(directory, '_SUCCESS'), 'w').close()
+
+
+def _merged(paths, name):
+    files = [open(path) for path in paths]
+    try:
+        for line in heapq.merge(*files, key=lambda line: _order_key(line, ORDERS[name])):
+            yield line
+    finally:
+        for f in files:
+            f.close()
+
+
+def split_samples(samples, seed=SEED, ratio=TEST_RATIO):
+    """
+    SPLIT samples INTO testing IF RANDOM(seed) <= ratio, training OTHERWISE, one draw per sample in order.
+    Return testing, training
+    """
+    rng = JavaRandom(seed)
+    testing, training = [], []
+    for sample in samples:
+        (testing if rng.next_double() <= ratio else training).append(sample)
+    return testing, training
+
+
+def run_etl(events_path, mortality_path, output, n_workers=None, n_partitions=None, tmp_dir=None, log=sys.stderr):
+    """
+    Run the pipeline of etl.pig and write its STOREs to output, one directory each.
+    Return the seconds spent in every phase
+    """
+    for name, _ in STORES:
+        if os.path.exists(os.path.join(output, name)):
+            raise ValueError("output directory %s already exists" % os.path.join(output, name))
+    n_workers = n_workers or os.cpu_count() or 1
+    n_partitions = n_partitions or n_workers
+    work_dir = tempfile.mkdtemp(prefix='etl-', dir=tmp_dir)
+    timings = {}
+
+    def phase(name, start_time, detail):
+        timings[name] = time.time() - start_time
+        log.write("%s: %.2fs, %s\n" % (name, timings[name], detail))
+
+    try:
+        with Pool(n_workers, initializer=_init_worker, initargs=(mortality_path,)) as pool:
+            start_time = time.time()
+            paths = partition_events(events_path, n_partitions, os.path.join(work_dir, 'events'))
+            phase('partition', start_time, "%d partitions" % n_partitions)
+
+            start_time = time.time()
+            maxvalues = {}
+            for partition_maxvalues in pool.map(_events_round, paths):
+                for eventid, count in partition_maxvalues.items():
+                    maxvalues[eventid] = max(count, maxvalues.get(eventid, 0))
+            all_features = feature_index(maxvalues)
+            index = dict((eventid, idx) for idx, eventid in all_features if eventid is not None)
+            idx_maxvalues = dict((index[eventid], count) for eventid, count in maxvalues.items() if eventid is not None)
+            phase('events', start_time, "%d features" % len(all_features))
+
+            start_time = time.time()
+            pool.starmap(_features_round, [(path, index, idx_maxvalues) for path in paths])
+            phase('features', start_time, "%d tasks" % len(paths))
+
+        start_time = time.time()
+        os.makedirs(output, exist_ok=True)
+        for name in ['aliveevents', 'deadevents', 'filtered', 'features_aggregate']:
+            _store(output, name, _merged([path + '.' + name for path in paths], name))
+        _store(output, 'features', ("%d %s\n" % (idx, pig_text(eventid)) for idx, eventid in all_features))
+        for name in ['features_map', 'features_normalized']:
+            _store(output, name, _merged([path + '.' + name for path in paths], name))
+        samples = [line.split(',', 1)[1] for line in _merged([path + '.samples' for path in paths], 'samples')]
+        testing, training = split_samples(samples)
+        for name, lines in [('samples', samples), ('testing', testing), ('training', training)]:
+            _store(output, name, lines)
+        phase('store', start_time, "%d samples, %d testing" % (len(samples), len(testing)))
+    finally:
+        shutil.rmtree(work_dir)
+    return timings
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-e", "--events", action="store", dest="events",
+                      default="../../data/events.csv", help="events.csv, as loaded by etl.pig")
+    parser.add_option("-m", "--mortality", action="store", dest="mortality",
+                      default="../../data/mortality.csv", help="mortality.csv, as loaded by etl.pig")
+    parser.add_option("-o", "--output", action="store", dest="output",
+                      default=".", help="directory of the STORE directories, which must not exist")
+    parser.add_option("-w", "--workers", action="store", dest="n_workers",
+                      help="number of worker processes (default: number of cpus)", type="int")
+    parser.add_option("-p", "--partitions", action="store", dest="n_partitions",
+                      help="number of patientid hash partitions (default: number of workers)", type="int")
+    parser.add_option("-t", "--tmp-dir", action="store", dest="tmp_dir",
+                      help="directory of the partitions and their sorted runs")
+
+    options, args = parser.parse_args(sys.argv)
+
+    run_etl(options.events, options.mortality, options.output, options.n_workers, options.n_partitions,
+            options.tmp_dir)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+STREAM THROUGH alternative to the bag_to_svmlight Jython UDF of utils.py:
+one CPython process formats the svmlight features of all the patients of a
+task, instead of one UDF call per bag, and writes the same text (checked by
+tests/test_svmlight_stream.py). It is not faster than the UDF on tuples
+already in memory, as it also parses the bags, so etl_optimized.pig keeps
+the UDF; what the stream saves inside Pig (the Jython runtime and the nested
+ORDER) has not been measured. In a Pig script:
+
+DEFINE svmlight_stream `python svmlight_stream.py` SHIP('svmlight_stream.py');
+grpd = GROUP features BY patientid;
+features = STREAM grpd THROUGH svmlight_stream AS (patientid:int, sparsefeature:chararray);
+
+The input lines are the groups as PigStreaming writes them, the patientid
+and the bag of (patientid, idx, normalizedfeaturevalue) tuples, e.g.
+1<TAB>{(1,3,0.5),(1,1,1.0)}
+and every output line is the patientid and the features sorted by idx,
+formatted as bag_to_svmlight formats them:
+1<TAB>1:1.000000 3:0.500000
+"""
+
+import io
+import sys
+from operator import add
+
+# Output lines written at once
+BATCH_SIZE = 1000
+# Formatted values kept for reuse; normalized values (count / max count) repeat a lot
+CACHE_SIZE = 1 << 16
+
+
+class _FormattedValues(dict):
+    """
+    ":%f" text of the value fields of a bag split on ',', which end with ')' or ')}',
+    formatted on the first lookup of each field
+    """
+
+    def __missing__(self, field):
+        if len(self) >= CACHE_SIZE:
+            self.clear()
+        text = self[field] = ":%f" % float(field.rstrip(')}'))
+        return text
+
+
+_formatted = _FormattedValues()
+
+
+def svmlight_line(line):
+    """
+    The output line of one input line: patientid, tab, the idx:value pairs sorted by idx
+    """
+    patientid, bag = line.rstrip('\n').split('\t', 1)
+    # fields of the (patientid,idx,value) tuples; idx are unique in a bag, so they key the formatted features
+    fields = bag.split(',')
+    indices = fields[1::3]
+    features = dict(zip(map(int, indices), map(add, indices, map(_formatted.__getitem__, fields[2::3]))))
+    return patientid + '\t' + ' '.join(map(features.__getitem__, sorted(features))) + '\n'
+
+
+def run(input, output, batch_size=BATCH_SIZE):
+    lines = []
+    for line in input:
+        lines.append(svmlight_line(line))
+        if len(lines) == batch_size:
+            output.write("".join(lines))
+            lines = []
+    output.write("".join(lines))
+
+
+if __name__ == '__main__':
+    output = io.open(sys.stdout.fileno(), 'w', buffering=1 << 20, closefd=False)
+    run(sys.stdin, output)
+    output.flush()
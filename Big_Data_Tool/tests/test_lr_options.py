@@ -0,0 +1,29 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+LR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lr')
+
+
+def short_options(script):
+    """
+    {short option: long option} of the --help of an lr script
+    """
+    output = subprocess.run([sys.executable, os.path.join(LR_DIR, script), '--help'], stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return dict(re.findall(r'^\s+(-\w)(?: \w+)?, (--[\w-]+)', output, re.MULTILINE))
+
+
+@pytest.mark.parametrize('script', ['train.py', 'train_parallel.py', 'reducer.py', 'test.py', 'testensemble.py'])
+def test_k_is_pickle(script):
+    assert short_options(script)['-k'] == '--pickle'
+
+
+
+def test_train_parallel_letters_match_train():
+    train, train_parallel = short_options('train.py'), short_options('train_parallel.py')
+    assert dict((letter, train_parallel[letter]) for letter in train if letter in train_parallel) == \
+        dict((letter, train[letter]) for letter in train if letter in train_parallel)
@@ -0,0 +1,36 @@
+import io
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lr'))
+
+import mapreduce_local
+
+MAPPER = '%s -c "import sys; sys.stdout.write(sys.stdin.read())"' % sys.executable
+# prints "key values" (no tab) and a "key<TAB>count" line for the records of its key
+REDUCER = ('%s -c "import sys; records = [line.rstrip(chr(10)).split(chr(9)) for line in sys.stdin]; '
+           'print(records[0][0], chr(44).join(value for _, value in records)); '
+           'print(records[0][0] + chr(9) + str(len(records)))"' % sys.executable)
+
+
+def test_job_with_more_runs_than_sort_factor(tmp_path):
+    n_lines = 3 * mapreduce_local.SORT_FACTOR
+    input_path = str(tmp_path / 'input')
+    with open(input_path, 'w') as f:
+        f.writelines("k%d\t%d\n" % (i % 7, i) for i in range(n_lines))
+    output = str(tmp_path / 'output')
+    log = io.StringIO()
+    mapreduce_local.run_job([input_path], output, MAPPER, REDUCER, n_workers=2, spill_lines=1,
+                            tmp_dir=str(tmp_path), log=log)
+
+    assert int(re.search(r'(\d+) spilled runs', log.getvalue()).group(1)) == n_lines > mapreduce_local.SORT_FACTOR
+    parts = sorted(name for name in os.listdir(output) if name.startswith('part-'))
+    assert '_SUCCESS' in os.listdir(output) and len(parts) == 7
+    for key, name in enumerate(parts):
+        with open(os.path.join(output, name)) as f:
+            values = [i for i in range(n_lines) if i % 7 == key]
+            # the values of a key in input order, and the reducer's lines as it wrote them
+            assert f.read() == "k%d %s\nk%d\t%d\n" % (key, ",".join(map(str, values)), key, len(values))
+    # the spilled runs, merged runs and reduce inputs are removed
+    assert sorted(os.listdir(str(tmp_path))) == ['input', 'output']
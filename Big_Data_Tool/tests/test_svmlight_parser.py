@@ -0,0 +1,46 @@
+import os
+import sys
+import warnings
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lr'))
+
+from utils import np, parse_svm_light_line, parse_svm_light_lines, parse_svm_light_batches, pack_samples
+
+USE_NUMPY = [False, True] if np is not None else [False]
+
+LINES = ["1 3:0.5 7:1.000000 12:2e-3", "0", "", "1 0:-1.5 4:nan", "0 2:1 3190:+0.25"]
+
+
+def features(line):
+    X, y = parse_svm_light_line(line)
+    return y, [f for f, _ in X], [v for _, v in X]
+
+
+@pytest.mark.parametrize('use_numpy', USE_NUMPY)
+def test_same_features_as_line_parser(use_numpy):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        labels, indices, values, offsets = parse_svm_light_lines(LINES, use_numpy=use_numpy)
+    expected = [features(line) for line in LINES if line.strip()]
+    assert list(labels) == [y for y, _, _ in expected]
+    assert list(indices) == [f for _, fs, _ in expected for f in fs]
+    assert list(offsets) == [0, 3, 3, 5, 7]
+    # compared as text, which nan equals
+    assert [str(float(v)) for v in values] == [str(v) for _, _, vs in expected for v in vs]
+
+
+@pytest.mark.parametrize('use_numpy', USE_NUMPY)
+@pytest.mark.parametrize('line', ["1 1e5:3", "1 1.0:3", "0 2:1 1.5:2", "1 2E1:1", "1 -1:2", "1 3::2", "1 3:",
+                                  "1 2:1:3", "1 a:1", "x 1:2"])
+def test_malformed_line_raises(use_numpy, line):
+    with pytest.raises(ValueError, match="line 3"):
+        list(parse_svm_light_batches(["1 1:0.5", "0 2:1", line], batch_size=2, use_numpy=use_numpy))
+
+
+@pytest.mark.parametrize('use_numpy', USE_NUMPY)
+def test_packed_samples(use_numpy):
+    labels, indices, values, offsets = parse_svm_light_lines(LINES[:2], use_numpy=use_numpy)
+    unpacked = parse_svm_light_lines(pack_samples(labels, indices, values, offsets), use_numpy=use_numpy)
+    assert [list(a) for a in unpacked] == [list(a) for a in (labels, indices, values, offsets)]
@@ -0,0 +1,79 @@
+import io
+import os
+import random
+import sys
+
+PIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pig')
+sys.path.insert(0, PIG_DIR)
+
+import svmlight_stream
+from etl import java_double
+
+
+def load_udf():
+    """
+    bag_to_svmlight of utils.py, with a decorator returning the function unchanged as Pig's outputSchema
+    """
+    path = os.path.join(PIG_DIR, 'utils.py')
+    namespace = {'outputSchema': lambda schema: lambda fn: fn}
+    with open(path) as f:
+        exec(compile(f.read(), path, 'exec'), namespace)
+    return namespace['bag_to_svmlight']
+
+
+def synthetic_bags(n_patients=300, seed=6505):
+    """
+    {patientid: bag of (patientid, idx, normalizedfeaturevalue)} in a random order of idx, with values that
+    Double.toString writes in scientific notation and a patient with a single feature
+    """
+    rng = random.Random(seed)
+    bags = {}
+    for patientid in range(n_patients):
+        indices = rng.sample(range(3190), 1 if patientid == 0 else rng.randint(1, 200))
+        bags[patientid] = [(patientid, idx, rng.randint(1, 20) / float(rng.choice([20, 30, 70, 100000])))
+                           for idx in indices]
+    return bags
+
+
+def stream(lines):
+    output = io.StringIO()
+    svmlight_stream.run(iter(lines), output, batch_size=7)
+    return output.getvalue()
+
+
+def stream_input(bags):
+    """
+    The groups as PigStreaming writes them to the streaming process
+    """
+    return ["%d\t{%s}\n" % (patientid, ",".join("(%d,%d,%s)" % (p, idx, java_double(value)) for p, idx, value in bag))
+            for patientid, bag in bags.items()]
+
+
+def test_same_text_as_udf():
+    bags = synthetic_bags()
+    udf = load_udf()
+    # the UDF gets each bag sorted by idx by the nested ORDER of etl_optimized.pig
+    expected = "".join("%d\t%s\n" % (patientid, udf(sorted(bag, key=lambda t: t[1])))
+                       for patientid, bag in bags.items())
+    assert stream(stream_input(bags)) == expected
+
+
+def etl_lines(bags):
+    """
+    The lines of bags as pig/etl.py formats the features of a sample: "%s:%f" of the normalized values, sorted by idx
+    """
+    return "".join("%d\t%s\n" % (patientid, " ".join("%s:%f" % (idx, value) for _, idx, value in sorted(bag)))
+                   for patientid, bag in bags.items())
+
+
+def test_same_features_as_etl():
+    bags = synthetic_bags()
+    assert stream(stream_input(bags)) == etl_lines(bags)
+
+
+def test_value_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(svmlight_stream, 'CACHE_SIZE', 3)
+    svmlight_stream._formatted.clear()
+    bags = synthetic_bags(50)
+    assert stream(stream_input(bags)) == etl_lines(bags)
+    assert len(svmlight_stream._formatted) <= 3
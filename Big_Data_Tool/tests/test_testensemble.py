@@ -0,0 +1,49 @@
+import os
+import random
+import subprocess
+import sys
+
+LR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lr')
+sys.path.insert(0, LR_DIR)
+
+from lrsgd import SparseLogisticRegressionSGD, dumps_model
+
+# Runs testensemble.py as a script, with NumPy and SciPy made unimportable if the first argument is 'block'
+RUN = """
+import runpy, sys
+if sys.argv.pop(1) == 'block':
+    sys.modules['numpy'] = sys.modules['scipy'] = None
+sys.path.insert(0, %r)
+runpy.run_path(%r, run_name='__main__')
+""" % (LR_DIR, os.path.join(LR_DIR, 'testensemble.py'))
+
+
+def write_models(path, n_model=3, n_feature=50, seed=6505):
+    rng = random.Random(seed)
+    os.makedirs(path)
+    for i in range(n_model):
+        classifier = SparseLogisticRegressionSGD(0.01, 0.0, n_feature)
+        classifier.weight = [rng.gauss(0.0, 1.0) for _ in range(n_feature)]
+        with open(os.path.join(path, 'part-%05d' % i), 'wb') as f:
+            f.write(dumps_model(classifier))
+
+
+def svmlight_lines(n_samples=500, n_feature=50, seed=6505):
+    rng = random.Random(seed)
+    return "".join("%d %s\n" % (rng.randint(0, 1), " ".join("%d:%f" % (f, rng.random())
+                                                            for f in sorted(rng.sample(range(n_feature), 5))))
+                   for _ in range(n_samples))
+
+
+def auc_output(mode, models, lines):
+    return subprocess.run([sys.executable, '-c', RUN, mode, '-m', models, '-n'], input=lines,
+                          stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+
+
+def test_same_auc_without_numpy_and_scipy(tmp_path):
+    models = str(tmp_path / 'models')
+    write_models(models)
+    lines = svmlight_lines()
+    with_numpy = auc_output('keep', models, lines)
+    assert with_numpy.startswith("AUC: ")
+    assert auc_output('block', models, lines) == with_numpy
@@ -0,0 +1,160 @@
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import etl
+import utils
+
+# Default size of the synthetic events table
+N_ROWS = 10000000
+
+
+def synthetic_events(n_rows, n_patients=None, n_days=4000, seed=0):
+    '''
+    Build an events table with the columns of events.csv: patient_id, event_id, event_description, timestamp, value.
+    Timestamps are date strings drawn from n_days consecutive days, so they repeat heavily as in the real extract.
+    '''
+    rng = utils.np.random.RandomState(seed)
+    n_patients = n_patients or max(1, n_rows // 200)
+    event_ids = utils.np.array(['DIAG%d' % i for i in range(1000)] + ['DRUG%d' % i for i in range(1000)] +
+                               ['LAB%d' % i for i in range(500)], dtype=object)
+    days = utils.pd.date_range('2000-01-01', periods=n_days).strftime(utils.DATE_FORMAT).values.astype(object)
+    values = rng.rand(n_rows) * 10
+    values[rng.rand(n_rows) < 0.05] = utils.np.nan
+    return utils.pd.DataFrame({'patient_id': rng.randint(0, n_patients, n_rows),
+                               'event_id': event_ids[rng.randint(0, len(event_ids), n_rows)],
+                               'event_description': '',
+                               'timestamp': days[rng.randint(0, n_days, n_rows)],
+                               'value': values})
+
+
+def timed(fn, *args):
+    start_time = time.time()
+    result = fn(*args)
+    return result, time.time() - start_time
+
+
+def report(name, before, after):
+    print("%s: before %.3fs, after %.3fs (%.1fx)" % (name, before, after, before / max(after, 1e-9)))
+
+
+def bench_date_parsing(events):
+    '''
+    Per-row datetime.strptime (the old etl.filter_events path) against utils.parse_dates,
+    and the old per-patient pd.to_datetime record length against the grouped one.
+    '''
+    def strptime_apply(timestamps):
+        return timestamps.apply(lambda x: datetime.strptime(x, utils.DATE_FORMAT))
+
+    def record_length_apply(events):
+        uniq_ts = events.groupby('patient_id')['timestamp'].unique().reset_index()
+        return uniq_ts.apply(lambda row: (utils.pd.to_datetime(row['timestamp']).max() - utils.pd.to_datetime(row['timestamp']).min()).days, axis=1)
+
+    def record_length_grouped(events):
+        timestamps = utils.parse_dates(events['timestamp']).groupby(events['patient_id'])
+        return (timestamps.max() - timestamps.min()).dt.days
+
+    old, before = timed(strptime_apply, events['timestamp'])
+    new, after = timed(utils.parse_dates, events['timestamp'])
+    assert (old.values.astype('datetime64[ns]') == new.values).all()
+    report("date parsing", before, after)
+
+    old, before = timed(record_length_apply, events)
+    new, after = timed(record_length_grouped, events)
+    assert (old.values == new.values).all()
+    report("record length", before, after)
+
+
+def synthetic_features(n_patients, nnz_per_patient=100, n_features=3190, seed=0):
+    '''
+    Build sorted CSR features like create_features(..., csr=True) returns, with random labels.
+    '''
+    rng = utils.np.random.RandomState(seed)
+    sizes = rng.randint(0, 2 * nnz_per_patient, n_patients)
+    indptr = utils.np.concatenate(([0], utils.np.cumsum(sizes)))
+    indices = utils.np.concatenate([utils.np.sort(rng.choice(n_features, size, replace=False)) for size in sizes])
+    values = rng.rand(indptr[-1])
+    return utils.np.arange(n_patients) + 1, indptr, indices, values, rng.randint(0, 2, n_patients)
+
+
+def bench_svmlight_writer(n_patients):
+    '''
+    The old per-line save_svmlight against utils.write_svmlight (plain and gzip), in MB/s of svmlight text,
+    with a round trip of the output through load_svmlight_file.
+    '''
+    def write_per_line(patient_ids, indptr, indices, values, labels, op_file, op_deliverable):
+        deliverable1 = open(op_file, 'wb')
+        deliverable2 = open(op_deliverable, 'wb')
+        for i, key in enumerate(patient_ids):
+            features = list(zip(indices[indptr[i]:indptr[i + 1]], values[indptr[i]:indptr[i + 1]]))
+            d1 = str(int(labels[i])) + ' ' + str(utils.bag_to_svmlight(features))
+            d2 = str(int(key)) + ' ' + str(labels[i]) + ' ' + str(utils.bag_to_svmlight(features))
+            deliverable1.write(bytes((f"{d1} \n"), 'UTF-8'))
+            deliverable2.write(bytes((f"{d2} \n"), 'UTF-8'))
+        deliverable1.close()
+        deliverable2.close()
+
+    patient_ids, indptr, indices, values, labels = synthetic_features(n_patients)
+    workdir = tempfile.mkdtemp()
+    old_paths = [os.path.join(workdir, name) for name in ['old_svmlight', 'old_deliverable']]
+    new_paths = [os.path.join(workdir, name) for name in ['new_svmlight', 'new_deliverable']]
+    gz_paths = [path + '.gz' for path in new_paths]
+
+    _, before = timed(write_per_line, patient_ids, indptr, indices, values, labels, *old_paths)
+    _, after = timed(utils.write_svmlight, patient_ids, labels, indptr, indices, values, *new_paths)
+    _, after_gz = timed(utils.write_svmlight, patient_ids, labels, indptr, indices, values, *gz_paths)
+    for old_path, new_path in zip(old_paths, new_paths):
+        with open(old_path, 'rb') as old, open(new_path, 'rb') as new:
+            assert old.read() == new.read()
+
+    megabytes = sum(os.path.getsize(path) for path in new_paths) / 1e6
+    report("svmlight writer", before, after)
+    print("svmlight writer: %.1f MB, before %.1f MB/s, after %.1f MB/s, gzip %.1f MB/s" %
+          (megabytes, megabytes / before, megabytes / after, megabytes / after_gz))
+
+    for path in [new_paths[0], gz_paths[0]]:
+        X, Y = utils.load_svmlight_file(path, n_features=3190)
+        assert (X.indptr == indptr).all() and (X.indices == indices).all() and (Y == labels).all()
+        assert utils.np.abs(X.data - values).max() <= 5e-7
+    for path in old_paths + new_paths + gz_paths:
+        os.remove(path)
+    os.rmdir(workdir)
+
+
+def check_edge_cases():
+    '''
+    Inputs the single-pass rewrites must handle like the code they replaced.
+    '''
+    empty = utils.pd.DataFrame({'patient_id': [], 'feature_id': [], 'feature_value': []})
+    patient_ids, indptr, indices, values = etl.group_patient_features(empty)
+    assert len(patient_ids) == 0 and list(indptr) == [0] and len(indices) == 0 and len(values) == 0
+    patient_features, mortality = etl.build_features(empty, utils.pd.DataFrame({'patient_id': [1]}))
+    assert patient_features == {} and mortality == {}
+
+    # the feature cache cannot be written: the svmlight file is still read
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'features_svmlight.train')
+    with open(path, 'w') as f:
+        f.write('1 3:0.500000 7:1.000000 \n0 2:0.250000 \n')
+    open(path + utils.FEATURE_CACHE_SUFFIX, 'w').close()
+    X, Y = utils.get_data_from_svmlight(path, cache=True)
+    assert X.nnz == 3 and list(Y) == [1, 0]
+    os.remove(path + utils.FEATURE_CACHE_SUFFIX)
+    os.remove(path)
+    os.rmdir(workdir)
+
+
+def main():
+    check_edge_cases()
+
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else N_ROWS
+    events = synthetic_events(n_rows)
+    print("Synthetic events: %d rows, %d patients" % (len(events), events['patient_id'].nunique()))
+    bench_date_parsing(events)
+    bench_svmlight_writer(events['patient_id'].nunique())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-import models_partc
+import models
+from multiprocessing import Pool
 from sklearn.model_selection import KFold, ShuffleSplit
 from numpy import mean
 
@@ -9,54 +10,74 @@ import utils
 # USE THIS RANDOM STATE FOR ALL OF YOUR CROSS VALIDATION TESTS, OR THE TESTS WILL NEVER PASS
 RANDOM_STATE = 545510477
 
+# Training data of the worker processes, set once per worker by _init_worker so folds only ship their indices
+_X = None
+_Y = None
+
+def _init_worker(X, Y):
+	global _X, _Y
+	_X, _Y = X, Y
+
+def _fit_fold(pred, train_index, test_index, use_scores=False):
+	if use_scores:
+		Y_pred, Y_score = pred(_X[train_index], _Y[train_index], _X[test_index], return_scores=True)
+		return models.classification_metrics(Y_pred, _Y[test_index], Y_score)[0:2]
+	Y_pred = pred(_X[train_index], _Y[train_index], _X[test_index])
+	return models.classification_metrics(Y_pred, _Y[test_index])[0:2]
+
+#input: training data and corresponding labels, list of (train_index, test_index), list of predictors from models.py
+#output: list of (mean accuracy, mean auc), one per predictor
+#Note: all the folds of all the predictors run in one pool of n_jobs processes (all cores by default, in-process if 1)
+#Note: the AUC is computed from the predicted labels by default; with use_scores=True it is computed from the
+#predictors' scores instead, which gives a different (usually higher) number
+def get_acc_auc_cv(X, Y, splits, preds, n_jobs=None, use_scores=False):
+	tasks = [(pred, train_index, test_index, use_scores) for pred in preds for train_index, test_index in splits]
+	if n_jobs == 1:
+		_init_worker(X, Y)
+		results = [_fit_fold(*task) for task in tasks]
+	else:
+		with Pool(n_jobs, initializer=_init_worker, initargs=(X, Y)) as pool:
+			results = pool.starmap(_fit_fold, tasks)
+	scores = []
+	for i in range(len(preds)):
+		fold_results = results[i * len(splits):(i + 1) * len(splits)]
+		acc_list = [acc for acc, _ in fold_results]
+		auc_list = [auc for _, auc in fold_results]
+		scores.append((sum(acc_list) / len(acc_list), sum(auc_list) / len(auc_list)))
+	return scores
+
 #input: training data and corresponding labels
 #output: accuracy, auc
-def get_acc_auc_kfold(X,Y,k=5):
+def get_acc_auc_kfold(X,Y,k=5,pred=models.logistic_regression_pred,n_jobs=None,use_scores=False):
 	#First get the train indices and test indices for each iteration
 	#Then train the classifier accordingly
 	#Report the mean accuracy and mean auc of all the folds
 	kf = KFold(n_splits=k)
-	acc_list = []
-	auc_list = []
-	for train_index, test_index in kf.split(X):
-		X_train, X_test, Y_train, Y_test = X[train_index], X[test_index], Y[train_index], Y[test_index]
-		Y_pred = models_partc.logistic_regression_pred(X[train_index], Y[train_index], X[test_index])
-		acc, auc = models_partc.classification_metrics(Y_pred, Y[test_index])[0:2]
-		acc_list.append(acc)
-		auc_list.append(auc)
-	acc_mean = sum(acc_list) / len(acc_list)
-	auc_mean = sum(auc_list) / len(auc_list)
-	return acc_mean, auc_mean
+	return get_acc_auc_cv(X, Y, list(kf.split(X)), [pred], n_jobs, use_scores)[0]
 
 
 #input: training data and corresponding labels
 #output: accuracy, auc
-def get_acc_auc_randomisedCV(X,Y,iterNo=5,test_percent=0.2):
+def get_acc_auc_randomisedCV(X,Y,iterNo=5,test_percent=0.2,pred=models.logistic_regression_pred,n_jobs=None,use_scores=False):
 	#TODO: First get the train indices and test indices for each iteration
 	#Then train the classifier accordingly
 	#Report the mean accuracy and mean auc of all the iterations
 	rs = ShuffleSplit(n_splits=iterNo, test_size=test_percent, random_state=0)
-	acc_list = []
-	auc_list = []
-	for train_index, test_index in rs.split(X):
-		X_train, X_test, Y_train, Y_test = X[train_index], X[test_index], Y[train_index], Y[test_index]
-		Y_pred = models_partc.logistic_regression_pred(X[train_index], Y[train_index], X[test_index])
-		acc, auc = models_partc.classification_metrics(Y_pred, Y[test_index])[0:2]
-		acc_list.append(acc)
-		auc_list.append(auc)
-	acc_mean = sum(acc_list) / len(acc_list)
-	auc_mean = sum(auc_list) / len(auc_list)
-	return acc_mean, auc_mean
+	return get_acc_auc_cv(X, Y, list(rs.split(X)), [pred], n_jobs, use_scores)[0]
 
 def main():
-	X,Y = utils.get_data_from_svmlight("../deliverables/features_svmlight.train")
-	print("Classifier: Logistic Regression__________")
-	acc_k,auc_k = get_acc_auc_kfold(X,Y)
-	print(("Average Accuracy in KFold CV: "+str(acc_k)))
-	print(("Average AUC in KFold CV: "+str(auc_k)))
-	acc_r,auc_r = get_acc_auc_randomisedCV(X,Y)
-	print(("Average Accuracy in Randomised CV: "+str(acc_r)))
-	print(("Average AUC in Randomised CV: "+str(auc_r)))
+	X,Y = utils.get_data_from_svmlight("../deliverables/features_svmlight.train", cache=True)
+	classifiers = [("Logistic Regression", models.logistic_regression_pred), ("SVM", models.svm_pred),
+				   ("Decision Tree", models.decisionTree_pred)]
+	preds = [pred for _, pred in classifiers]
+	kfold = get_acc_auc_cv(X, Y, list(KFold(n_splits=5).split(X)), preds)
+	randomised = get_acc_auc_cv(X, Y, list(ShuffleSplit(n_splits=5, test_size=0.2, random_state=0).split(X)), preds)
+	for (name, _), (acc_k, auc_k), (acc_r, auc_r) in zip(classifiers, kfold, randomised):
+		print(("Classifier: " + name + "__________"))
+		print(("Average Accuracy in KFold CV: "+str(acc_k)))
+		print(("Average AUC in KFold CV: "+str(auc_k)))
+		print(("Average Accuracy in Randomised CV: "+str(acc_r)))
+		print(("Average AUC in Randomised CV: "+str(auc_r)))
 
 if __name__ == "__main__":
 	main()
@@ -1,5 +1,9 @@
 import utils
 
+# Observation window (days before the index date) and prediction window (days before death)
+OBSERVATION_WINDOW = 2000
+PREDICTION_WINDOW = 30
+
 def read_csv(filepath):
 
     '''
@@ -27,10 +31,9 @@ def calculate_index_date(events, mortality, deliverables_path):
     Return indx_date
     '''
 
-    alive_events = events[~events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id')['timestamp'].unique().reset_index()
-    alive_events['timestamp'] = alive_events.apply(lambda row: utils.pd.to_datetime(row['timestamp']).max(), axis=1)
-    mortality['timestamp'] = mortality['timestamp'].apply(lambda x: utils.date_convert(x))
-    mortality['timestamp'] = mortality['timestamp'] - utils.pd.Timedelta(days=30)
+    alive = ~events['patient_id'].isin(mortality['patient_id'])
+    alive_events = utils.parse_dates(events.loc[alive, 'timestamp']).groupby(events.loc[alive, 'patient_id']).max().reset_index()
+    mortality['timestamp'] = utils.parse_dates(mortality['timestamp']) - utils.pd.Timedelta(days=PREDICTION_WINDOW)
 
     indx_date = utils.pd.concat([mortality, alive_events]).reset_index()
     indx_date = indx_date.sort_values(by=['patient_id']).reset_index()
@@ -46,11 +49,11 @@ def filter_events(events, indx_date, deliverables_path):
     Return filtered_events
     '''
 
-    events['timestamp'] = events.loc[:,'timestamp'].apply(lambda x : utils.date_convert(x))
+    events['timestamp'] = utils.parse_dates(events['timestamp'])
     events = events.join(indx_date.set_index('patient_id'), on='patient_id')
     events['window'] = events['indx_date'] - events['timestamp']
 
-    filtered_events = events[(events['window'] >= utils.pd.Timedelta(days = 0)) & (events['window'] <= utils.pd.Timedelta(days = 2000))]
+    filtered_events = events[(events['window'] >= utils.pd.Timedelta(days = 0)) & (events['window'] <= utils.pd.Timedelta(days = OBSERVATION_WINDOW))]
     filtered_events = filtered_events.sort_values(by=['patient_id', 'event_id']).reset_index()
     filtered_events = filtered_events[['patient_id', 'event_id', 'value']]
     filtered_events.to_csv(deliverables_path + 'etl_filtered_events.csv', index=False)
@@ -69,6 +72,16 @@ def aggregate_events(filtered_events_df, mortality_df, feature_map_df, deliverab
     #count occurences for lab events
     lab = filtered_events_df.loc[filtered_events_df['event_id'].str.startswith('LAB', na=False)].groupby(['patient_id', 'event_id'], as_index=False)['value'].count()
     agg_events = utils.pd.concat([dia_med, lab])
+
+    return normalize_events(agg_events, feature_map_df, deliverables_path)
+
+
+def normalize_events(agg_events, feature_map_df, deliverables_path):
+    '''
+    Map the (patient_id, event_id, value) aggregates to feature ids and apply min-max normalization.
+    Save the result to etl_aggregated_events.csv in the deliverables folder.
+    Return agg_events
+    '''
     agg_events = utils.pd.merge(agg_events, feature_map_df, on='event_id')
 
     # Normalize
@@ -82,9 +95,34 @@ def aggregate_events(filtered_events_df, mortality_df, feature_map_df, deliverab
     return agg_events
 
 
-def create_features(events, mortality, feature_map):
+def group_patient_features(agg_events):
+    '''
+    Group agg_events by patient in a single pass: sort once on patient_id and split on the group boundaries.
+    Return patient_ids, indptr, indices, values in CSR layout - the features of patient_ids[i] are
+    indices[indptr[i]:indptr[i+1]] with values values[indptr[i]:indptr[i+1]], in the order they appear in agg_events.
+    '''
+    if len(agg_events) == 0:
+        return (agg_events['patient_id'].values, utils.np.zeros(1, dtype=utils.np.int64),
+                agg_events['feature_id'].values, agg_events['feature_value'].values)
+
+    order = utils.np.argsort(agg_events['patient_id'].values, kind='mergesort')
+    pids = agg_events['patient_id'].values[order]
+    indices = agg_events['feature_id'].values[order]
+    values = agg_events['feature_value'].values[order]
+
+    starts = utils.np.flatnonzero(pids[1:] != pids[:-1]) + 1
+    indptr = utils.np.concatenate(([0], starts, [len(pids)])).astype(utils.np.int64)
+    patient_ids = pids[indptr[:-1]]
+
+    return patient_ids, indptr, indices, values
+
+
+def create_features(events, mortality, feature_map, csr=False):
     deliverables_path = '../deliverables/'
 
+    # Parse the timestamps once for both the index date and the window filter
+    events['timestamp'] = utils.parse_dates(events['timestamp'])
+
     # Calculate index date
     indx_date = calculate_index_date(events, mortality, deliverables_path)
 
@@ -94,23 +132,32 @@ def create_features(events, mortality, feature_map):
     # Aggregate the event values for each patient
     agg_events = aggregate_events(filtered_events, mortality, feature_map, deliverables_path)
 
+    return build_features(agg_events, mortality, csr)
+
+
+def build_features(agg_events, mortality, csr=False):
     '''
     1. patient_features :  Key - patient_id and value is array of tuples(feature_id, feature_value)
+       (with csr=True, the (patient_ids, indptr, indices, values) arrays of group_patient_features instead)
     2. mortality : Key - patient_id and value is mortality label
     '''
-    patient_features = {}
-    mortality_dict = {}
+    patient_ids, indptr, indices, values = group_patient_features(agg_events)
+    labels = utils.np.isin(patient_ids, mortality['patient_id'].unique()).astype(int)
+    mortality_dict = dict(zip(patient_ids, labels.tolist()))
 
-    patient_ids = agg_events['patient_id'].unique()
-    mortality_ids = mortality['patient_id'].unique()
-    for i in patient_ids:
-        patient_features[i] = [(agg_events['feature_id'][j], agg_events['feature_value'][j]) for j in agg_events[agg_events['patient_id']==i].index]
-        mortality_dict[i] = 1 if i in mortality_ids else 0
+    if csr:
+        return (patient_ids, indptr, indices, values), mortality_dict
+
+    pairs = list(zip(indices.tolist(), values.tolist()))
+    bounds = indptr.tolist()
+    patient_features = {}
+    for i, key in enumerate(patient_ids):
+        patient_features[key] = pairs[bounds[i]:bounds[i + 1]]
 
     return patient_features, mortality_dict
 
 
-def save_svmlight(patient_features, mortality, op_file, op_deliverable):
+def save_svmlight(patient_features, mortality, op_file, op_deliverable, inputs=None):
     '''
     Create two files:
     1. op_file - which saves the features in svmlight format. (See instructions in Q3d for detailed explanation)
@@ -119,26 +166,44 @@ def save_svmlight(patient_features, mortality, op_file, op_deliverable):
        patient_id2 label feature_id:feature_value feature_id:feature_value feature_id:feature_value ...
 
     Note: features are ordered in ascending order, and patients are stored in ascending order as well.
+    If inputs (the paths the features were built from) are given, also write the binary feature cache of both files.
     '''
-    sorted_patient_features = {}
-    for key in sorted(patient_features.keys()):
-        sorted_patient_features[key] = sorted(patient_features[key], key=lambda x: x[0])
+    patient_ids = sorted(patient_features.keys())
+    sorted_features = [sorted(patient_features[key], key=lambda x: x[0]) for key in patient_ids]
+    indptr = utils.np.cumsum([0] + [len(x) for x in sorted_features])
+    indices = utils.np.array([fid for x in sorted_features for fid, _ in x], dtype=utils.np.int64)
+    values = utils.np.array([fvalue for x in sorted_features for _, fvalue in x], dtype=utils.np.float64)
+    labels = [mortality[key] for key in patient_ids]
+
+    save_svmlight_csr(patient_ids, indptr, indices, values, labels, op_file, op_deliverable, inputs)
 
-    deliverable1 = open(op_file, 'wb')
-    deliverable2 = open(op_deliverable, 'wb')
 
-    for key in sorted(sorted_patient_features.keys()):
-        d1 = str(int(mortality[key])) + ' ' + str(utils.bag_to_svmlight(sorted_patient_features[key]))
-        d2 = str(int(key)) + ' ' + str(mortality[key]) + ' ' + str(utils.bag_to_svmlight(sorted_patient_features[key]))
-        deliverable1.write(bytes((f"{d1} \n"), 'UTF-8'));  # Use 'UTF-8'
-        deliverable2.write(bytes((f"{d2} \n"), 'UTF-8'));
+def save_svmlight_csr(patient_ids, indptr, indices, values, labels, op_file, op_deliverable, inputs=None):
+    '''
+    save_svmlight for the CSR arrays of create_features(..., csr=True): patients in ascending order,
+    each with its features in ascending order. labels[i] is the mortality label of patient_ids[i].
+    '''
+    utils.write_svmlight(patient_ids, labels, indptr, indices, values, op_file, op_deliverable)
+
+    if inputs is not None:
+        patient_ids = utils.np.asarray(patient_ids, dtype=utils.np.int64)
+        labels = utils.np.asarray(labels, dtype=utils.np.float64)
+        indptr = utils.np.asarray(indptr)
+        # Cache the values as they read back from the text file, i.e. rounded by %f
+        values = utils.np.array(['%f' % v for v in utils.np.asarray(values, dtype=utils.np.float64).tolist()], dtype=utils.np.float64)
+        index_dtype = utils.np.int32 if indptr[-1] < 2 ** 31 else utils.np.int64
+        params = {'observation_window': OBSERVATION_WINDOW, 'prediction_window': PREDICTION_WINDOW}
+        utils.save_feature_cache(op_file, inputs, params, indptr=indptr.astype(index_dtype), indices=utils.np.asarray(indices).astype(index_dtype),
+                                 values=values, labels=labels, patient_ids=patient_ids)
+        utils.save_feature_cache(op_deliverable, inputs, params, patient_ids=patient_ids, labels=labels)
 
 def main():
     train_path = '../data/train/'
     events, mortality, feature_map = read_csv(train_path)
-    patient_features, mortality = create_features(events, mortality, feature_map)
-    save_svmlight(patient_features, mortality, '../deliverables/features_svmlight.train',
-                 '../deliverables/features.train')
+    (patient_ids, indptr, indices, values), mortality = create_features(events, mortality, feature_map, csr=True)
+    save_svmlight_csr(patient_ids, indptr, indices, values, [mortality[key] for key in patient_ids],
+                      '../deliverables/features_svmlight.train', '../deliverables/features.train',
+                      [train_path + 'events.csv', train_path + 'mortality_events.csv', train_path + 'event_feature_map.csv'])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import pickle
+import sys
+
+import utils
+import etl
+import etl_stream
+
+# Aggregate state kept between runs, in the deliverables folder
+STATE_FILE = 'etl_state.pkl'
+
+
+def _digest(path, offset=None):
+    '''
+    sha1 of the first offset bytes of path (of the whole file if offset is None).
+    '''
+    sha1 = hashlib.sha1()
+    remaining = os.path.getsize(path) if offset is None else offset
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            block = f.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            sha1.update(block)
+            remaining -= len(block)
+    return sha1.hexdigest()
+
+
+def read_events_from(filepath, offset, chunksize=etl_stream.CHUNK_SIZE):
+    '''
+    Iterate in chunks over the rows of events.csv that start at byte offset, i.e. the rows appended since a previous run.
+    '''
+    path = filepath + 'events.csv'
+    if offset >= os.path.getsize(path):
+        return
+    with open(path, 'rb') as f:
+        columns = f.readline().decode('UTF-8').strip().split(',')
+        f.seek(offset)
+        for chunk in utils.pd.read_csv(f, header=None, names=columns, usecols=etl_stream.EVENT_COLUMNS, chunksize=chunksize):
+            yield chunk
+
+
+def window_events(chunk, indx_date):
+    '''
+    The events of a chunk in the observation window before the patient's index date, as etl_stream.filter_events
+    selects them, with the parsed timestamp kept so that they can be filtered again when the index date moves.
+    '''
+    return _in_window(chunk.assign(timestamp=utils.parse_dates(chunk['timestamp'])), indx_date)
+
+
+def _in_window(events, indx_date):
+    window = events['patient_id'].map(indx_date.set_index('patient_id')['indx_date']) - events['timestamp']
+    in_window = (window >= utils.pd.Timedelta(days=0)) & (window <= utils.pd.Timedelta(days=etl.OBSERVATION_WINDOW))
+    return events.loc[in_window, ['patient_id', 'event_id', 'timestamp', 'value']]
+
+
+def feature_values(agg_events, feature_map):
+    '''
+    Map (patient_id, event_id, value) aggregates to (patient_id, feature_id, value), as etl.normalize_events does.
+    '''
+    agg_events = utils.pd.merge(agg_events, feature_map, on='event_id')
+    return agg_events[['patient_id', 'idx', 'value']].rename(columns={'idx': 'feature_id'})
+
+
+def save_outputs(state, mortality, filepath, deliverables_path):
+    '''
+    Write etl_index_dates.csv, etl_aggregated_events.csv and the svmlight deliverables from the state.
+    '''
+    state['indx_date'].to_csv(deliverables_path + 'etl_index_dates.csv', index=False)
+    agg_events = state['agg_events'].sort_values(by=['patient_id', 'feature_id']).reset_index(drop=True)
+    agg_events = agg_events[['patient_id', 'feature_id', 'feature_value']]
+    agg_events.to_csv(deliverables_path + 'etl_aggregated_events.csv', index=False)
+
+    (patient_ids, indptr, indices, values), mortality = etl.build_features(agg_events, mortality, csr=True)
+    etl.save_svmlight_csr(patient_ids, indptr, indices, values, [mortality[key] for key in patient_ids],
+                          deliverables_path + 'features_svmlight.train', deliverables_path + 'features.train',
+                          [filepath + 'events.csv', filepath + 'mortality_events.csv', filepath + 'event_feature_map.csv'])
+
+
+def build(filepath, mortality, feature_map, chunksize=etl_stream.CHUNK_SIZE):
+    '''
+    Full rebuild with the streaming ETL that also keeps the state update() starts from:
+    the events.csv prefix already consumed, the last event date and index date of every patient, the dead patients,
+    the events in the observation windows (in file order), the per (patient, event) accumulator,
+    the aggregated features and the max of every feature.
+    Return state
+    '''
+    offset = os.path.getsize(filepath + 'events.csv')
+    last_event = etl_stream.last_event_dates(etl_stream.read_events(filepath, chunksize))
+    indx_date = etl_stream.index_dates(last_event, mortality)
+    accumulator = etl_stream.EventAccumulator(feature_map)
+    windows = []
+    for chunk in etl_stream.read_events(filepath, chunksize):
+        windows.append(window_events(chunk, indx_date))
+        accumulator.update(windows[-1])
+
+    agg_events = feature_values(accumulator.to_frame(), feature_map)
+    feature_max = agg_events.groupby('feature_id')['value'].max()
+    agg_events['feature_value'] = agg_events['value'] / agg_events['feature_id'].map(feature_max)
+
+    return {'offset': offset, 'events_digest': _digest(filepath + 'events.csv', offset),
+            'feature_map_digest': _digest(filepath + 'event_feature_map.csv'),
+            'last_event': last_event, 'indx_date': indx_date, 'dead': utils.np.unique(mortality['patient_id']),
+            'window_events': utils.pd.concat(windows, ignore_index=True), 'accumulator': accumulator,
+            'agg_events': agg_events, 'feature_max': feature_max}
+
+
+def update(filepath, mortality, feature_map, state, chunksize=etl_stream.CHUNK_SIZE):
+    '''
+    Bring the state up to date with the rows appended to events.csv since it was saved and with the current mortality.
+    Only affected patients are re-aggregated: patients with new events whose index date did not move get the new
+    events in the window added to their aggregates. Patients alive before and after the update whose index date moved
+    (a new last event) are re-aggregated from the window events kept in the state and the new events, since their
+    window only moves forward. Patients whose mortality record is new, changed or removed are re-aggregated from
+    their full history, which takes one more pass over the whole events.csv when there are any.
+    Only the features of affected patients, and the features whose max changed, are renormalized.
+    Falls back to build() if events.csv was rewritten rather than appended to, or if the feature map changed.
+    Return state
+    '''
+    events_path = filepath + 'events.csv'
+    if ('window_events' not in state or os.path.getsize(events_path) < state['offset']
+            or _digest(events_path, state['offset']) != state['events_digest']
+            or _digest(filepath + 'event_feature_map.csv') != state['feature_map_digest']):
+        return build(filepath, mortality, feature_map, chunksize)
+
+    offset = os.path.getsize(events_path)
+    batch_last_event = etl_stream.last_event_dates(read_events_from(filepath, state['offset'], chunksize))
+    last_event = utils.pd.concat([state['last_event'], batch_last_event]).groupby(level=0).max()
+    indx_date = etl_stream.index_dates(last_event, mortality)
+
+    old_dates = state['indx_date'].set_index('patient_id')['indx_date']
+    new_dates = indx_date.set_index('patient_id')['indx_date']
+    old_dates, new_dates = old_dates.align(new_dates)
+    moved = new_dates.index[(old_dates != new_dates) & ~(old_dates.isna() & new_dates.isna())].values
+    affected = utils.np.union1d(moved, batch_last_event.index.values)
+    dead = utils.np.unique(mortality['patient_id'])
+    # alive patients' index dates only move forward, past all their previous events: their new window is covered by
+    # the window events kept in the state and the new events
+    shifted = moved[~utils.np.isin(moved, state['dead']) & ~utils.np.isin(moved, dead)]
+    rescanned = utils.np.setdiff1d(moved, shifted)
+
+    accumulator = state['accumulator']
+    accumulator.drop_patients(moved)
+    windows = state['window_events']
+    windows = windows[~windows['patient_id'].isin(rescanned)]
+    is_shifted = windows['patient_id'].isin(shifted)
+    windows = utils.pd.concat([windows[~is_shifted], _in_window(windows[is_shifted], indx_date)]).sort_index()
+    accumulator.update(windows[windows['patient_id'].isin(shifted)])
+    windows = [windows]
+    if len(rescanned):
+        for chunk in etl_stream.read_events(filepath, chunksize):
+            windows.append(window_events(chunk[chunk['patient_id'].isin(rescanned)], indx_date))
+            accumulator.update(windows[-1])
+    for chunk in read_events_from(filepath, state['offset'], chunksize):
+        windows.append(window_events(chunk[~chunk['patient_id'].isin(rescanned)], indx_date))
+        accumulator.update(windows[-1])
+
+    agg_events = state['agg_events']
+    agg_events = utils.pd.concat([agg_events[~agg_events['patient_id'].isin(affected)],
+                                  feature_values(accumulator.to_frame(affected), feature_map)], ignore_index=True)
+    feature_max = agg_events.groupby('feature_id')['value'].max()
+    old_max, new_max = state['feature_max'].align(feature_max)
+    changed = new_max.index[old_max != new_max].values
+    renormalize = (agg_events['patient_id'].isin(affected) | agg_events['feature_id'].isin(changed)).values
+    agg_events.loc[renormalize, 'feature_value'] = \
+        agg_events.loc[renormalize, 'value'] / agg_events.loc[renormalize, 'feature_id'].map(feature_max)
+
+    state.update({'offset': offset, 'events_digest': _digest(events_path, offset), 'last_event': last_event,
+                  'indx_date': indx_date, 'dead': dead, 'window_events': utils.pd.concat(windows, ignore_index=True),
+                  'accumulator': accumulator, 'agg_events': agg_events, 'feature_max': feature_max})
+    return state
+
+
+def main():
+    train_path = '../data/train/'
+    deliverables_path = '../deliverables/'
+    mortality = utils.pd.read_csv(train_path + 'mortality_events.csv')
+    feature_map = utils.pd.read_csv(train_path + 'event_feature_map.csv')
+
+    state_path = deliverables_path + STATE_FILE
+    if os.path.exists(state_path) and '--full' not in sys.argv:
+        with open(state_path, 'rb') as f:
+            state = update(train_path, mortality, feature_map, pickle.load(f))
+    else:
+        state = build(train_path, mortality, feature_map)
+
+    save_outputs(state, mortality, train_path, deliverables_path)
+    with open(state_path, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import utils
+import etl
+
+# Rows of events.csv held in memory at a time
+CHUNK_SIZE = 1000000
+
+EVENT_COLUMNS = ['patient_id', 'event_id', 'timestamp', 'value']
+
+
+def read_events(filepath, chunksize=CHUNK_SIZE):
+    '''
+    Iterate over events.csv in chunks of at most chunksize rows.
+    '''
+    return utils.pd.read_csv(filepath + 'events.csv', usecols=EVENT_COLUMNS, chunksize=chunksize)
+
+
+def last_event_dates(chunks, exclude=()):
+    '''
+    Latest event timestamp of every patient in a stream of event chunks, skipping the patient ids in exclude.
+    '''
+    last_event = utils.pd.Series([], dtype='datetime64[ns]', name='timestamp')
+    for chunk in chunks:
+        chunk = chunk[~chunk['patient_id'].isin(exclude)]
+        chunk_max = utils.parse_dates(chunk['timestamp']).groupby(chunk['patient_id']).max()
+        last_event = utils.pd.concat([last_event, chunk_max]).groupby(level=0).max()
+    last_event.index.name = 'patient_id'
+    return last_event.rename('timestamp')
+
+
+def index_dates(last_event, mortality):
+    '''
+    The index date of an alive patient is its last event date, the index date of a dead patient is
+    the mortality date minus the prediction window. Return indx_date sorted by patient_id.
+    '''
+    alive = last_event[~last_event.index.isin(mortality['patient_id'])].reset_index()
+    dead = mortality[['patient_id']].copy()
+    dead['timestamp'] = utils.parse_dates(mortality['timestamp']) - utils.pd.Timedelta(days=etl.PREDICTION_WINDOW)
+
+    indx_date = utils.pd.concat([dead, alive]).sort_values(by=['patient_id']).reset_index(drop=True)
+    return indx_date.rename(columns={'timestamp': 'indx_date'})
+
+
+def calculate_index_date(filepath, mortality, deliverables_path, chunksize=CHUNK_SIZE):
+    '''
+    First pass over events.csv: compute the index dates from the last event date of the alive patients.
+    Save indx_date to etl_index_dates.csv in the deliverables folder, as etl.calculate_index_date does.
+    Return indx_date
+    '''
+    last_event = last_event_dates(read_events(filepath, chunksize), mortality['patient_id'].unique())
+    indx_date = index_dates(last_event, mortality)
+    indx_date.to_csv(deliverables_path + 'etl_index_dates.csv', index=False)
+    return indx_date
+
+
+class EventAccumulator:
+    '''
+    Running per (patient_id, event_id) aggregates: value sums for DIAG/DRUG events and value counts for LAB events.
+
+    Keys are patient_id * len(feature_map) + row of event_id in feature_map, kept sorted so a chunk is merged with
+    searchsorted. Sums use the same compensated (Kahan) update, in the same row order, as pandas' groupby sum, so the
+    result does not depend on where the chunk boundaries fall.
+    '''
+
+    def __init__(self, feature_map):
+        self.event_ids = feature_map['event_id'].values
+        self.event_pos = utils.pd.Series(utils.np.arange(len(self.event_ids)), index=self.event_ids)
+        self.is_lab = utils.pd.Series(self.event_ids).str.startswith('LAB').values
+        self.keys = utils.np.zeros(0, dtype=utils.np.int64)
+        self.sums = utils.np.zeros(0)
+        self.comp = utils.np.zeros(0)
+        self.counts = utils.np.zeros(0, dtype=utils.np.int64)
+
+    def _insert_keys(self, keys):
+        new = utils.np.setdiff1d(keys, self.keys, assume_unique=True)
+        if len(new):
+            at = utils.np.searchsorted(self.keys, new)
+            self.keys = utils.np.insert(self.keys, at, new)
+            self.sums = utils.np.insert(self.sums, at, 0.0)
+            self.comp = utils.np.insert(self.comp, at, 0.0)
+            self.counts = utils.np.insert(self.counts, at, 0)
+
+    def drop_patients(self, patient_ids):
+        '''
+        Forget the aggregates of the given patients, e.g. before re-accumulating them over a new window.
+        '''
+        keep = ~utils.np.isin(self.keys // len(self.event_ids), patient_ids)
+        self.keys, self.sums, self.comp, self.counts = self.keys[keep], self.sums[keep], self.comp[keep], self.counts[keep]
+
+    def update(self, events):
+        '''
+        Add a chunk of filtered events (patient_id, event_id, value), in file order.
+        '''
+        events = events[events['value'].notna() & events['event_id'].str.startswith(('DIAG', 'DRUG', 'LAB'), na=False)]
+        pos = self.event_pos.reindex(events['event_id'].values).values
+        mapped = ~utils.np.isnan(pos)
+        if not mapped.any():
+            return
+        keys = events['patient_id'].values[mapped].astype(utils.np.int64) * len(self.event_ids) + pos[mapped].astype(utils.np.int64)
+        values = events['value'].values[mapped].astype(utils.np.float64)
+
+        uniq, counts = utils.np.unique(keys, return_counts=True)
+        self._insert_keys(uniq)
+        self.counts[utils.np.searchsorted(self.keys, uniq)] += counts
+
+        # Kahan-sum the DIAG/DRUG values one occurrence at a time: round r updates every key with an r-th row
+        summed = ~self.is_lab[keys % len(self.event_ids)]
+        keys, values = keys[summed], values[summed]
+        order = utils.np.argsort(keys, kind='mergesort')
+        keys, values = keys[order], values[order]
+        starts = utils.np.flatnonzero(utils.np.r_[True, keys[1:] != keys[:-1]])
+        rank = utils.np.arange(len(keys)) - utils.np.repeat(starts, utils.np.diff(utils.np.r_[starts, len(keys)]))
+        by_rank = utils.np.argsort(rank, kind='mergesort')
+        bounds = utils.np.searchsorted(rank[by_rank], utils.np.arange(rank.max() + 2)) if len(rank) else [0]
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            rows = by_rank[lo:hi]
+            at = utils.np.searchsorted(self.keys, keys[rows])
+            y = values[rows] - self.comp[at]
+            t = self.sums[at] + y
+            comp = (t - self.sums[at]) - y
+            comp[comp != comp] = 0.0
+            self.comp[at] = comp
+            self.sums[at] = t
+
+    def to_frame(self, patient_ids=None):
+        '''
+        Return the aggregates as a (patient_id, event_id, value) DataFrame, as etl.aggregate_events builds before normalizing.
+        If patient_ids is given, only the aggregates of those patients.
+        '''
+        keys, sums, counts = self.keys, self.sums, self.counts
+        if patient_ids is not None:
+            selected = utils.np.isin(keys // len(self.event_ids), patient_ids)
+            keys, sums, counts = keys[selected], sums[selected], counts[selected]
+        pos = keys % len(self.event_ids)
+        value = utils.np.where(self.is_lab[pos], counts, sums)
+        return utils.pd.DataFrame({'patient_id': keys // len(self.event_ids),
+                                   'event_id': self.event_ids[pos],
+                                   'value': value.astype(utils.np.float64)})
+
+
+def filter_events(chunk, indx_date):
+    '''
+    Keep the events of a chunk that fall in the observation window before the patient's index date.
+    '''
+    timestamp = utils.parse_dates(chunk['timestamp'])
+    window = chunk['patient_id'].map(indx_date.set_index('patient_id')['indx_date']) - timestamp
+    in_window = (window >= utils.pd.Timedelta(days=0)) & (window <= utils.pd.Timedelta(days=etl.OBSERVATION_WINDOW))
+    return chunk.loc[in_window, ['patient_id', 'event_id', 'value']]
+
+
+def aggregate_events(filepath, indx_date, feature_map, deliverables_path, chunksize=CHUNK_SIZE):
+    '''
+    Second pass over events.csv: filter each chunk to the observation window and accumulate DIAG/DRUG sums
+    and LAB counts. Save etl_aggregated_events.csv in the deliverables folder.
+    Return agg_events
+    '''
+    accumulator = EventAccumulator(feature_map)
+    for chunk in read_events(filepath, chunksize):
+        accumulator.update(filter_events(chunk, indx_date))
+
+    return etl.normalize_events(accumulator.to_frame(), feature_map, deliverables_path)
+
+
+def create_features(filepath, mortality, feature_map, chunksize=CHUNK_SIZE, csr=False):
+    '''
+    Streaming counterpart of etl.create_features: events.csv is read twice in chunks of chunksize rows and never
+    held in memory as a whole. The filtered events are not materialized, so etl_filtered_events.csv is not written.
+    '''
+    deliverables_path = '../deliverables/'
+
+    indx_date = calculate_index_date(filepath, mortality, deliverables_path, chunksize)
+    agg_events = aggregate_events(filepath, indx_date, feature_map, deliverables_path, chunksize)
+
+    return etl.build_features(agg_events, mortality, csr)
+
+
+def main():
+    train_path = '../data/train/'
+    mortality = utils.pd.read_csv(train_path + 'mortality_events.csv')
+    feature_map = utils.pd.read_csv(train_path + 'event_feature_map.csv')
+    (patient_ids, indptr, indices, values), mortality = create_features(train_path, mortality, feature_map, csr=True)
+    etl.save_svmlight_csr(patient_ids, indptr, indices, values, [mortality[key] for key in patient_ids],
+                          '../deliverables/features_svmlight.train', '../deliverables/features.train',
+                          [train_path + 'events.csv', train_path + 'mortality_events.csv', train_path + 'event_feature_map.csv'])
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ import time
 import pandas as pd
 import numpy as np
 
+import utils
+
 # PLEASE USE THE GIVEN FUNCTION NAME, DO NOT CHANGE IT
 
 def read_csv(filepath):
@@ -14,46 +16,62 @@ def read_csv(filepath):
 
     return events, mortality
 
-def event_count_metrics(events, mortality):
+def patient_statistics(events, mortality):
+    '''
+    Per-patient table computed in one grouped pass over events: event count, encounter count (distinct dates),
+    first and last event date, record length in days, and whether the patient is in mortality.
+    All the metrics below are derived from this table instead of re-scanning events.
+    '''
+    timestamps = utils.parse_dates(events['timestamp'])
+    grouped = events[['patient_id', 'event_id']].assign(timestamp=timestamps).groupby('patient_id')
+    per_patient = grouped.agg(event_count=('event_id', 'count'), encounter_count=('timestamp', 'nunique'),
+                              first_event=('timestamp', 'min'), last_event=('timestamp', 'max'))
+    per_patient['record_length'] = (per_patient['last_event'] - per_patient['first_event']).dt.days
+    per_patient['dead'] = per_patient.index.isin(mortality['patient_id'])
+    return per_patient
+
+def summary_statistics(per_patient, percentiles=(0.25, 0.5, 0.75)):
+    '''
+    Min, max, mean, median and the given percentiles of each metric for dead and alive patients.
+    Return a dict keyed by (metric, 'dead' or 'alive'). Percentiles interpolate linearly, as Hive's percentile does.
+    '''
+    stats = {}
+    for metric in ['event_count', 'encounter_count', 'record_length']:
+        for group, values in [('dead', per_patient.loc[per_patient['dead'], metric]),
+                              ('alive', per_patient.loc[~per_patient['dead'], metric])]:
+            stats[(metric, group)] = {'min': values.min(), 'max': values.max(), 'avg': values.mean(),
+                                      'median': values.median(),
+                                      'percentiles': dict(zip(percentiles, values.quantile(list(percentiles)).tolist()))}
+    return stats
+
+def _min_max_avg(per_patient, metric):
+    dead = per_patient.loc[per_patient['dead'], metric]
+    alive = per_patient.loc[~per_patient['dead'], metric]
+    return dead.min(), dead.max(), dead.mean(), alive.min(), alive.max(), alive.mean()
+
+def _per_patient(events, mortality, per_patient):
+    return patient_statistics(events, mortality) if per_patient is None else per_patient
+
+def event_count_metrics(events, mortality, per_patient=None):
     '''
     Event count is defined as the number of events recorded for a given patient.
+    per_patient is the table of patient_statistics(events, mortality), computed here if not given.
     '''
-    avg_dead_event_count = events[events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id').count().mean()[0]
-    max_dead_event_count = events[events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id').count().max()[0]
-    min_dead_event_count = events[events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id').count().min()[0]
-    avg_alive_event_count = events[~events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id').count().mean()[0]
-    max_alive_event_count = events[~events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id').count().max()[0]
-    min_alive_event_count = events[~events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id').count().min()[0]
-
-    return min_dead_event_count, max_dead_event_count, avg_dead_event_count, min_alive_event_count, max_alive_event_count, avg_alive_event_count
-def encounter_count_metrics(events, mortality):
+    return _min_max_avg(_per_patient(events, mortality, per_patient), 'event_count')
+
+def encounter_count_metrics(events, mortality, per_patient=None):
     '''
     Encounter count is defined as the count of unique dates on which a given patient visited the ICU.
+    per_patient is the table of patient_statistics(events, mortality), computed here if not given.
     '''
+    return _min_max_avg(_per_patient(events, mortality, per_patient), 'encounter_count')
 
-    avg_dead_encounter_count = events[events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id')['timestamp'].nunique().mean()
-    max_dead_encounter_count = events[events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id')['timestamp'].nunique().max()
-    min_dead_encounter_count = events[events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id')['timestamp'].nunique().min()
-    avg_alive_encounter_count = events[~events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id')['timestamp'].nunique().mean()
-    max_alive_encounter_count = events[~events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id')['timestamp'].nunique().max()
-    min_alive_encounter_count = events[~events['patient_id'].isin(mortality['patient_id'])].groupby('patient_id')['timestamp'].nunique().min()
-
-    return min_dead_encounter_count, max_dead_encounter_count, avg_dead_encounter_count, min_alive_encounter_count, max_alive_encounter_count, avg_alive_encounter_count
-
-def record_length_metrics(events, mortality):
+def record_length_metrics(events, mortality, per_patient=None):
     '''
     Record length is the duration between the first event and the last event for a given patient.
+    per_patient is the table of patient_statistics(events, mortality), computed here if not given.
     '''
-    uniq_ts = events.groupby('patient_id')['timestamp'].unique().reset_index()
-    uniq_ts['length'] = uniq_ts.apply(lambda row: (pd.to_datetime(row['timestamp']).max() - pd.to_datetime(row['timestamp']).min()).days, axis=1)
-    avg_dead_rec_len = uniq_ts[uniq_ts['patient_id'].isin(mortality['patient_id'])]['length'].mean()
-    max_dead_rec_len = uniq_ts[uniq_ts['patient_id'].isin(mortality['patient_id'])]['length'].max()
-    min_dead_rec_len = uniq_ts[uniq_ts['patient_id'].isin(mortality['patient_id'])]['length'].min()
-    avg_alive_rec_len = uniq_ts[~uniq_ts['patient_id'].isin(mortality['patient_id'])]['length'].mean()
-    max_alive_rec_len = uniq_ts[~uniq_ts['patient_id'].isin(mortality['patient_id'])]['length'].max()
-    min_alive_rec_len = uniq_ts[~uniq_ts['patient_id'].isin(mortality['patient_id'])]['length'].min()
-
-    return min_dead_rec_len, max_dead_rec_len, avg_dead_rec_len, min_alive_rec_len, max_alive_rec_len, avg_alive_rec_len
+    return _min_max_avg(_per_patient(events, mortality, per_patient), 'record_length')
 
 def main():
 
@@ -61,26 +79,40 @@ def main():
 
     events, mortality = read_csv(train_path)
 
+    #Compute the per-patient table once, all the metrics are derived from it
+    start_time = time.time()
+    per_patient = patient_statistics(events, mortality)
+    end_time = time.time()
+    print(("Time to compute the per-patient table: " + str(end_time - start_time) + "s"))
+
     #Compute the event count metrics
     start_time = time.time()
-    event_count = event_count_metrics(events, mortality)
+    event_count = event_count_metrics(events, mortality, per_patient)
     end_time = time.time()
     print(("Time to compute event count metrics: " + str(end_time - start_time) + "s"))
     print(event_count)
 
     #Compute the encounter count metrics
     start_time = time.time()
-    encounter_count = encounter_count_metrics(events, mortality)
+    encounter_count = encounter_count_metrics(events, mortality, per_patient)
     end_time = time.time()
     print(("Time to compute encounter count metrics: " + str(end_time - start_time) + "s"))
     print(encounter_count)
 
     #Compute record length metrics
     start_time = time.time()
-    record_length = record_length_metrics(events, mortality)
+    record_length = record_length_metrics(events, mortality, per_patient)
     end_time = time.time()
     print(("Time to compute record length metrics: " + str(end_time - start_time) + "s"))
     print(record_length)
 
+    #Compute all metrics, with medians and percentiles, from the same per-patient table
+    start_time = time.time()
+    stats = summary_statistics(per_patient)
+    end_time = time.time()
+    print(("Time to compute all metrics: " + str(end_time - start_time) + "s"))
+    for (metric, group), values in sorted(stats.items()):
+        print(metric, group, values)
+
 if __name__ == "__main__":
     main()
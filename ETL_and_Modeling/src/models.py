@@ -1,3 +1,8 @@
+import json
+import time
+import warnings
+import tracemalloc
+from multiprocessing import Pool
 import numpy as np
 from sklearn.datasets import load_svmlight_file
 from sklearn.linear_model import LogisticRegression
@@ -9,52 +14,129 @@ import utils
 
 RANDOM_STATE = 545510477
 
+# Models trained by evaluate_models: name -> (classifier class, parameters), as in the *_pred functions below
+MODELS = [("Logistic Regression", LogisticRegression, {}),
+		  ("SVM", LinearSVC, {}),
+		  ("Decision Tree", DecisionTreeClassifier, {'max_depth': 5})]
+
 #input: X_train, Y_train and X_test
-#output: Y_pred
-def logistic_regression_pred(X_train, Y_train, X_test):
+#output: Y_pred (and Y_score if return_scores)
+def logistic_regression_pred(X_train, Y_train, X_test, return_scores=False):
 	#train a logistic regression classifier using X_train and Y_train. Use this to predict labels of X_test
 	#use default params for the classifier
 	clf = LogisticRegression().fit(X_train, Y_train)
 	Y_pred = clf.predict(X_test)
+	if return_scores:
+		return Y_pred, decision_scores(clf, X_test)
 	return Y_pred
 
 #input: X_train, Y_train and X_test
-#output: Y_pred
-def svm_pred(X_train, Y_train, X_test):
+#output: Y_pred (and Y_score if return_scores)
+def svm_pred(X_train, Y_train, X_test, return_scores=False):
 	#train a SVM classifier using X_train and Y_train. Use this to predict labels of X_test
 	#use default params for the classifier
 	clf = LinearSVC().fit(X_train, Y_train)
 	Y_pred = clf.predict(X_test)
+	if return_scores:
+		return Y_pred, decision_scores(clf, X_test)
 	return Y_pred
 
 #input: X_train, Y_train and X_test
-#output: Y_pred
-def decisionTree_pred(X_train, Y_train, X_test):
+#output: Y_pred (and Y_score if return_scores)
+def decisionTree_pred(X_train, Y_train, X_test, return_scores=False):
 	#train a logistic regression classifier using X_train and Y_train. Use this to predict labels of X_test
 	#IMPORTANT: use max_depth as 5. Else your test cases might fail.
 	clf = DecisionTreeClassifier(max_depth=5).fit(X_train, Y_train)
 	Y_pred = clf.predict(X_test)
+	if return_scores:
+		return Y_pred, decision_scores(clf, X_test)
 	return Y_pred
 
+#input: fitted classifier, X_test
+#output: Y_score, the probability of the positive class, or the decision function if the classifier has no probabilities
+def decision_scores(clf, X_test):
+	if hasattr(clf, 'predict_proba'):
+		return clf.predict_proba(X_test)[:, 1]
+	return clf.decision_function(X_test)
 
-#input: Y_pred,Y_true
+
+#input: Y_pred,Y_true and optionally Y_score
 #output: accuracy, auc, precision, recall, f1-score
-def classification_metrics(Y_pred, Y_true):
+def classification_metrics(Y_pred, Y_true, Y_score=None):
 	# Calculate the above mentioned metrics
 	#NOTE: It is important to provide the output in the same order
-	acc = accuracy_score(Y_true, Y_pred)
-	roc_auc = roc_auc_score(Y_true, Y_pred)
-	precision = precision_score(Y_true, Y_pred)
-	recall = recall_score(Y_true, Y_pred)
-	f1score = f1_score(Y_true, Y_pred)
+	#All five metrics come from one pass building the confusion matrix; the AUC of hard
+	#predictions is the mean of the true positive and true negative rates
+	#When Y_score is given, the AUC is computed from the scores instead
+	#The AUC is undefined when Y_true has a single class (e.g. a small CV fold): it is NaN with a warning,
+	#as roc_curve does, so one such split does not stop the run
+	tn, fp, fn, tp = confusion_counts(Y_pred, Y_true)
+	acc = (tp + tn) / (tp + tn + fp + fn)
+	if not (tp + fn and tn + fp):
+		warnings.warn("only one class in Y_true, the AUC is not defined")
+		roc_auc = float('nan')
+	elif Y_score is None:
+		roc_auc = (tp / (tp + fn) + tn / (tn + fp)) / 2
+	else:
+		roc_auc = roc_from_scores(Y_true, Y_score)[3]
+	precision = tp / (tp + fp) if tp + fp else 0.0
+	recall = tp / (tp + fn) if tp + fn else 0.0
+	f1score = 2 * tp / (2 * tp + fp + fn) if tp else 0.0
 	return acc,roc_auc,precision,recall,f1score
 
 
-#input: Name of classifier, predicted labels, actual labels
-def display_metrics(classifierName,Y_pred,Y_true):
+#input: Y_pred,Y_true
+#output: tn, fp, fn, tp
+def confusion_counts(Y_pred, Y_true):
+	return np.bincount(2 * (np.asarray(Y_true) == 1) + (np.asarray(Y_pred) == 1), minlength=4).tolist()
+
+
+#input: Y_true, Y_score
+#output: fpr, tpr, thresholds, auc
+#Note: one descending sort of the scores; tied scores form a single ROC point, so the
+#      trapezoidal AUC counts ties as half, as roc_auc_score does
+def roc_from_scores(Y_true, Y_score):
+	Y_score = np.asarray(Y_score, dtype=np.float64)
+	order = np.argsort(-Y_score, kind='mergesort')
+	scores = Y_score[order]
+	positive = (np.asarray(Y_true)[order] == 1)
+	last = np.r_[np.flatnonzero(scores[1:] != scores[:-1]), len(scores) - 1]
+	tps = np.cumsum(positive)[last]
+	fps = (last + 1) - tps
+	tpr = np.r_[0, tps] / max(tps[-1], 1)
+	fpr = np.r_[0, fps] / max(fps[-1], 1)
+	auc_ = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1])) / 2)
+	return fpr, tpr, np.r_[np.inf, scores[last]], auc_
+
+
+#input: Y_true, Y_score, thresholds
+#output: dict of arrays, one entry per threshold: tp, fp, fn, tn, accuracy, precision, recall, f1
+#Note: a sample is predicted positive when its score is >= the threshold; the counts for all thresholds
+#      come from one sort and a binary search, so operating points can be compared without re-predicting
+def threshold_metrics(Y_true, Y_score, thresholds):
+	Y_score = np.asarray(Y_score, dtype=np.float64)
+	order = np.argsort(Y_score, kind='mergesort')
+	positives_below = np.r_[0, np.cumsum(np.asarray(Y_true)[order] == 1)]
+	below = np.searchsorted(Y_score[order], np.asarray(thresholds, dtype=np.float64), side='left')
+	n_pos = positives_below[-1]
+	n_neg = len(Y_score) - n_pos
+	tp = n_pos - positives_below[below]
+	fp = n_neg - (below - positives_below[below])
+	fn = n_pos - tp
+	tn = n_neg - fp
+	with np.errstate(divide='ignore', invalid='ignore'):
+		precision = np.where(tp + fp > 0, tp / np.maximum(tp + fp, 1), 0.0)
+		recall = np.where(n_pos > 0, tp / max(n_pos, 1), 0.0)
+		f1score = np.where(tp > 0, 2 * tp / np.maximum(2 * tp + fp + fn, 1), 0.0)
+	return {'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn, 'accuracy': (tp + tn) / len(Y_score),
+			'precision': precision, 'recall': recall, 'f1': f1score}
+
+
+#input: Name of classifier, predicted labels, actual labels, optionally the scores
+def display_metrics(classifierName,Y_pred,Y_true,Y_score=None):
 	print("______________________________________________")
 	print(("Classifier: "+classifierName))
-	acc, auc_, precision, recall, f1score = classification_metrics(Y_pred,Y_true)
+	acc, auc_, precision, recall, f1score = classification_metrics(Y_pred,Y_true,Y_score)
 	print(("Accuracy: "+str(acc)))
 	print(("AUC: "+str(auc_)))
 	print(("Precision: "+str(precision)))
@@ -63,13 +145,60 @@ def display_metrics(classifierName,Y_pred,Y_true):
 	print("______________________________________________")
 	print("")
 
+# Train and test data of the worker processes, set once per worker by _init_worker
+_data = None
+
+def _init_worker(X_train, Y_train, X_test, Y_test):
+	global _data
+	_data = (X_train, Y_train, X_test, Y_test)
+
+def _evaluate_model(name, classifier, params):
+	X_train, Y_train, X_test, Y_test = _data
+	tracemalloc.start()
+	start_time = time.time()
+	clf = classifier(**params).fit(X_train, Y_train)
+	fit_time = time.time() - start_time
+	start_time = time.time()
+	Y_pred = clf.predict(X_test)
+	Y_score = decision_scores(clf, X_test)
+	predict_time = time.time() - start_time
+	peak_memory = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	acc, auc_, precision, recall, f1score = classification_metrics(Y_pred, Y_test)
+	score_auc = classification_metrics(Y_pred, Y_test, Y_score)[1]
+	result = {'model': name, 'accuracy': acc, 'auc': auc_, 'score_auc': score_auc, 'precision': precision, 'recall': recall, 'f1': f1score,
+			  'fit_seconds': fit_time, 'predict_seconds': predict_time, 'peak_memory_mb': peak_memory / 2 ** 20}
+	return result, Y_pred, Y_score
+
+#input: X_train, Y_train, X_test, Y_test
+#output: list of (result, Y_pred, Y_score), one per model in MODELS; result holds the five metrics (auc from the
+#        predicted labels, as display_metrics reports it), score_auc computed from Y_score,
+#        the fit and predict wall time and the peak memory traced while fitting and predicting
+#Note: each model trains in its own worker process, n_jobs at a time (all cores by default, in-process if 1)
+def evaluate_models(X_train, Y_train, X_test, Y_test, models=MODELS, n_jobs=None):
+	if n_jobs == 1:
+		_init_worker(X_train, Y_train, X_test, Y_test)
+		return [_evaluate_model(*model) for model in models]
+	with Pool(n_jobs, initializer=_init_worker, initargs=(X_train, Y_train, X_test, Y_test)) as pool:
+		return pool.starmap(_evaluate_model, models)
+
+#input: results of evaluate_models, path of the JSON report
+def write_report(results, path):
+	with open(path, 'w') as f:
+		json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'models': [result[0] for result in results]}, f, indent=2)
+
 def main():
-	X_train, Y_train = utils.get_data_from_svmlight("../deliverables/features_svmlight.train")
+	X_train, Y_train = utils.get_data_from_svmlight("../deliverables/features_svmlight.train", cache=True)
 	X_test, Y_test = utils.get_data_from_svmlight("../data/features_svmlight.validate")
 
-	display_metrics("Logistic Regression",logistic_regression_pred(X_train,Y_train,X_test),Y_test)
-	display_metrics("SVM",svm_pred(X_train,Y_train,X_test),Y_test)
-	display_metrics("Decision Tree",decisionTree_pred(X_train,Y_train,X_test),Y_test)
+	results = evaluate_models(X_train, Y_train, X_test, Y_test)
+	for result, Y_pred, Y_score in results:
+		display_metrics(result['model'], Y_pred, Y_test)
+		print(("AUC from scores: " + str(result['score_auc'])))
+		print(("Fit time: %.3fs, predict time: %.3fs, peak memory: %.1fMB" %
+			   (result['fit_seconds'], result['predict_seconds'], result['peak_memory_mb'])))
+	write_report(results, "../deliverables/model_report.json")
 
 if __name__ == "__main__":
 	main()
@@ -1,30 +1,174 @@
+import gzip
+import hashlib
+import json
+import os
+import warnings
+import numpy as np
 import pandas as pd
+from scipy.sparse import csr_matrix
 from datetime import datetime
 from datetime import timedelta
+from functools import lru_cache
 from sklearn.datasets import load_svmlight_file
 
+DATE_FORMAT = '%Y-%m-%d'
+
 def date_offset(x,no_days):
-    return datetime.strptime(x, '%Y-%m-%d') + timedelta(days=no_days)
+    return date_convert(x) + timedelta(days=no_days)
 
+@lru_cache(maxsize=None)
 def date_convert(x):
-    return datetime.strptime(x, '%Y-%m-%d')
+    return datetime.strptime(x, DATE_FORMAT)
+
+#input: column of date strings (or an already converted datetime64 column)
+#output: the column as datetime64
+#Note: each distinct string is parsed once with DATE_FORMAT, falling back to pandas' format inference
+def parse_dates(values, fmt=DATE_FORMAT):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    codes, uniques = pd.factorize(values)
+    try:
+        parsed = pd.to_datetime(uniques, format=fmt)
+    except (ValueError, TypeError):
+        parsed = pd.to_datetime(uniques)
+    converted = np.append(np.asarray(parsed, dtype='datetime64[ns]'), np.datetime64('NaT', 'ns'))[codes]
+    if isinstance(values, pd.Series):
+        return pd.Series(converted, index=values.index, name=values.name)
+    return converted
 
 def bag_to_svmlight(input):
     return ' '.join(( "%d:%f" % (fid, float(fvalue)) for fid, fvalue in input))
 
+#input: CSR rows (row i has features indices[indptr[i]:indptr[i+1]] with values values[...]) and their labels
+#output: number of bytes written to op_file and op_deliverable
+#Note: lines are formatted a block of rows at a time with a single % operation and written in one call per block,
+#      op_deliverable lines are prefixed with the patient id; paths ending in .gz are gzip-compressed
+def write_svmlight(patient_ids, labels, indptr, indices, values, op_file, op_deliverable=None, block_rows=10000):
+    def open_output(path):
+        return gzip.open(path, 'wb', compresslevel=6) if path.endswith('.gz') else open(path, 'wb', buffering=1 << 20)
+
+    indptr = np.asarray(indptr)
+    sizes = np.diff(indptr).tolist()
+    labels = ['%d' % label for label in np.asarray(labels).tolist()]
+    patient_ids = ['%d' % pid for pid in np.asarray(patient_ids).tolist()]
+    row_formats = {}
+    written = [0, 0]
+
+    outputs = [open_output(op_file)] + ([open_output(op_deliverable)] if op_deliverable else [])
+    try:
+        for start in range(0, len(sizes), block_rows):
+            stop = min(start + block_rows, len(sizes))
+            lo, hi = int(indptr[start]), int(indptr[stop])
+            args = [None] * (2 * (hi - lo))
+            args[0::2] = np.asarray(indices[lo:hi]).tolist()
+            args[1::2] = np.asarray(values[lo:hi], dtype=np.float64).tolist()
+            template = []
+            for size in sizes[start:stop]:
+                if size not in row_formats:
+                    row_formats[size] = '%d:%f ' * size if size else ' '
+                template.append(row_formats[size])
+            bodies = ('\n'.join(template) % tuple(args)).split('\n')
+
+            block = ''.join([label + ' ' + body + '\n' for label, body in zip(labels[start:stop], bodies)]).encode('UTF-8')
+            outputs[0].write(block)
+            written[0] += len(block)
+            if op_deliverable:
+                block = ''.join([pid + ' ' + label + ' ' + body + '\n' for pid, label, body in
+                                 zip(patient_ids[start:stop], labels[start:stop], bodies)]).encode('UTF-8')
+                outputs[1].write(block)
+                written[1] += len(block)
+    finally:
+        for output in outputs:
+            output.close()
+    return tuple(written)
+
+#Binary feature cache: <svmlight_file>.cache/ holds one .npy file per array plus meta.json, which records
+#the svmlight file and the inputs (e.g. events.csv) it was derived from, and a key hashed from their
+#contents and the ETL parameters. The cache is stale as soon as any of those files changes: a file is unchanged
+#only if it has the same size and the same SHA-1, whatever its modification time.
+FEATURE_CACHE_SUFFIX = '.cache'
+
+def file_digest(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _unchanged(signature):
+    try:
+        current = file_signature(signature['path'])
+    except OSError:
+        return False
+    return current['size'] == signature['size'] and file_digest(signature['path']) == signature['sha1']
+
+def save_feature_cache(svmlight_file, inputs=(), params=None, **arrays):
+    cache_dir = svmlight_file + FEATURE_CACHE_SUFFIX
+    os.makedirs(cache_dir, exist_ok=True)
+    sources = []
+    for path in [svmlight_file] + list(inputs):
+        signature = file_signature(path)
+        signature['sha1'] = file_digest(path)
+        sources.append(signature)
+    key = hashlib.sha1(json.dumps([[x['sha1'] for x in sources], params], sort_keys=True).encode('UTF-8')).hexdigest()
+    for name, array in arrays.items():
+        np.save(os.path.join(cache_dir, name + '.npy'), np.asarray(array))
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+        json.dump({'key': key, 'params': params, 'sources': sources, 'arrays': sorted(arrays)}, f)
+    return key
+
+#output: dict of the cached arrays (memory-mapped, not copied) or None if there is no up to date cache
+def load_feature_cache(svmlight_file):
+    cache_dir = svmlight_file + FEATURE_CACHE_SUFFIX
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not all(_unchanged(signature) for signature in meta['sources']):
+        return None
+    return {name: np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r') for name in meta['arrays']}
+
 #input: features and label stored in the svmlight_file
 #output: X_train, Y_train
 #Note: If the number of features exceed 3190, please use the appropriate number
-def get_data_from_svmlight(svmlight_file):
+#Note: with cache=True, the arrays are read from the binary feature cache when it is up to date, and cached after
+#parsing otherwise (best effort: if the cache cannot be written, e.g. in a read-only data directory, a warning is
+#issued and the parsed arrays are returned). By default nothing is written next to svmlight_file.
+def get_data_from_svmlight(svmlight_file, cache=False):
+    cached = load_feature_cache(svmlight_file) if cache else None
+    if cached is not None and 'indptr' in cached:
+        return get_data_from_csr(cached['indptr'], cached['indices'], cached['values'], cached['labels'])
     data_train = load_svmlight_file(svmlight_file,n_features=3190)
     X_train = data_train[0]
     Y_train = data_train[1]
+    if cache:
+        try:
+            save_feature_cache(svmlight_file, indptr=X_train.indptr, indices=X_train.indices, values=X_train.data, labels=Y_train)
+        except OSError as e:
+            warnings.warn("feature cache of %s not written: %s" % (svmlight_file, e))
+    return X_train, Y_train
+
+#input: CSR arrays and labels as returned by etl.create_features(..., csr=True)
+#output: X_train, Y_train without a round trip through the svmlight text format
+def get_data_from_csr(indptr, indices, values, labels):
+    X_train = csr_matrix((np.asarray(values, dtype=np.float64), np.asarray(indices), np.asarray(indptr)),
+                         shape=(len(indptr) - 1, 3190), copy=False)
+    Y_train = np.asarray(labels, dtype=np.float64)
     return X_train, Y_train
 
 def generate_submission(svmlight_with_ids_file, Y_pred):
-    f = open(svmlight_with_ids_file)
-    lines = f.readlines()
-    target = open('../deliverables/my_predictions.csv', 'w')
-    target.write("%s,%s\n" %("patient_id","label"));
-    for i in range(len(lines)):
-        target.write("%s,%s\n" %(str(lines[i].split()[0]),str(Y_pred[i])));
+    cached = load_feature_cache(svmlight_with_ids_file)
+    if cached is not None and 'patient_ids' in cached:
+        patient_ids = cached['patient_ids'].tolist()
+    else:
+        with open(svmlight_with_ids_file) as f:
+            patient_ids = [line.split()[0] for line in f]
+    with open('../deliverables/my_predictions.csv', 'w') as target:
+        target.write("%s,%s\n" %("patient_id","label"));
+        for i in range(len(patient_ids)):
+            target.write("%s,%s\n" %(str(patient_ids[i]),str(Y_pred[i])));
@@ -0,0 +1,43 @@
+import math
+import os
+import sys
+import warnings
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import cross
+import models
+
+
+def test_single_class_auc_is_nan():
+    Y_true = np.zeros(6)
+    Y_pred = np.array([0, 1, 0, 0, 1, 0])
+    with pytest.warns(UserWarning):
+        acc, auc_, precision, recall, f1score = models.classification_metrics(Y_pred, Y_true)
+    assert acc == pytest.approx(4 / 6) and math.isnan(auc_)
+    assert precision == 0.0 and recall == 0.0 and f1score == 0.0
+    with pytest.warns(UserWarning):
+        assert math.isnan(models.classification_metrics(Y_pred, Y_true, np.linspace(0, 1, 6))[1])
+
+
+def test_two_class_auc():
+    Y_true = np.array([0, 0, 1, 1])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert models.classification_metrics(np.array([0, 1, 1, 1]), Y_true)[1] == pytest.approx(0.75)
+        assert models.classification_metrics(np.array([0, 1, 1, 1]), Y_true, [0.1, 0.6, 0.4, 0.9])[1] == 0.75
+
+
+def test_cv_with_a_single_class_fold():
+    rng = np.random.RandomState(0)
+    X = rng.rand(40, 3)
+    Y = np.r_[np.zeros(30), np.ones(10)]
+    # the first two test sets have a single class, the training sets all have both
+    splits = [(np.arange(5, 40), np.arange(5)), (np.r_[np.arange(30), np.arange(35, 40)], np.arange(30, 35)),
+              (np.r_[np.arange(25), np.arange(35, 40)], np.arange(25, 35))]
+    with pytest.warns(UserWarning):
+        (acc, auc_), = cross.get_acc_auc_cv(X, Y, splits, [models.logistic_regression_pred], n_jobs=1)
+    assert 0 <= acc <= 1 and math.isnan(auc_)
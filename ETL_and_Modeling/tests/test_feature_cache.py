@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import utils
+
+SVMLIGHT = '1 3:0.500000 7:1.000000 \n0 2:0.250000 \n'
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    return str(path)
+
+
+def test_no_cache_by_default(tmp_path):
+    path = write(tmp_path / 'features_svmlight.train', SVMLIGHT)
+    X, Y = utils.get_data_from_svmlight(path)
+    assert X.nnz == 3 and list(Y) == [1, 0]
+    assert os.listdir(tmp_path) == ['features_svmlight.train']
+
+
+def test_cache_round_trip(tmp_path):
+    path = write(tmp_path / 'features_svmlight.train', SVMLIGHT)
+    X, Y = utils.get_data_from_svmlight(path, cache=True)
+    assert utils.load_feature_cache(path) is not None
+    X_cached, Y_cached = utils.get_data_from_svmlight(path, cache=True)
+    assert (X_cached != X).nnz == 0 and list(Y_cached) == list(Y)
+
+
+def test_same_size_and_mtime_edit_is_stale(tmp_path):
+    path = write(tmp_path / 'features_svmlight.train', SVMLIGHT)
+    utils.get_data_from_svmlight(path, cache=True)
+    stat = os.stat(path)
+    write(path, SVMLIGHT.replace('3:0.5', '4:0.5'))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert utils.load_feature_cache(path) is None
+    X, Y = utils.get_data_from_svmlight(path, cache=True)
+    assert list(X.indices[:2]) == list(utils.get_data_from_svmlight(path)[0].indices[:2])
+
+
+def test_unwritable_cache_warns(tmp_path):
+    path = write(tmp_path / 'features_svmlight.train', SVMLIGHT)
+    write(path + utils.FEATURE_CACHE_SUFFIX, '')
+    with pytest.warns(UserWarning):
+        X, Y = utils.get_data_from_svmlight(path, cache=True)
+    assert X.nnz == 3 and list(Y) == [1, 0]
@@ -0,0 +1,74 @@
+import gzip
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import utils
+
+
+def write_per_line(patient_ids, indptr, indices, values, labels, op_file, op_deliverable):
+    '''
+    The line-at-a-time writer of save_svmlight that write_svmlight replaced.
+    '''
+    deliverable1 = open(op_file, 'wb')
+    deliverable2 = open(op_deliverable, 'wb')
+    for i, key in enumerate(patient_ids):
+        features = list(zip(indices[indptr[i]:indptr[i + 1]], values[indptr[i]:indptr[i + 1]]))
+        d1 = str(int(labels[i])) + ' ' + str(utils.bag_to_svmlight(features))
+        d2 = str(int(key)) + ' ' + str(labels[i]) + ' ' + str(utils.bag_to_svmlight(features))
+        deliverable1.write(bytes((f"{d1} \n"), 'UTF-8'))
+        deliverable2.write(bytes((f"{d2} \n"), 'UTF-8'))
+    deliverable1.close()
+    deliverable2.close()
+
+
+@pytest.fixture
+def features():
+    '''
+    Sorted CSR features of 50 patients, some without features, with 0/1 labels and values from 1e-6,
+    which %f writes with a single significant digit.
+    '''
+    rng = np.random.RandomState(0)
+    sizes = rng.randint(0, 20, 50)
+    sizes[[0, 17, 49]] = 0
+    indptr = np.concatenate(([0], np.cumsum(sizes)))
+    indices = np.concatenate([np.sort(rng.choice(3190, size, replace=False)) for size in sizes]).astype(np.int64)
+    values = (rng.rand(indptr[-1]) + 1e-3) * 10.0 ** rng.randint(-3, 1, indptr[-1])
+    return np.arange(50) * 3 + 1, indptr, indices, values, rng.randint(0, 2, 50)
+
+
+def read(path):
+    with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('suffix', ['', '.gz'])
+def test_same_text_as_line_writer(tmp_path, features, suffix):
+    patient_ids, indptr, indices, values, labels = features
+    old_paths = [str(tmp_path / 'old_svmlight'), str(tmp_path / 'old_deliverable')]
+    new_paths = [str(tmp_path / ('new_svmlight' + suffix)), str(tmp_path / ('new_deliverable' + suffix))]
+    write_per_line(patient_ids, indptr, indices, values, labels, *old_paths)
+    written = utils.write_svmlight(patient_ids, labels, indptr, indices, values, *new_paths, block_rows=7)
+    for old_path, new_path, size in zip(old_paths, new_paths, written):
+        assert read(new_path) == read(old_path)
+        assert size == len(read(old_path))
+
+
+@pytest.mark.parametrize('suffix', ['', '.gz'])
+def test_round_trip(tmp_path, features, suffix):
+    patient_ids, indptr, indices, values, labels = features
+    path = str(tmp_path / ('svmlight' + suffix))
+    utils.write_svmlight(patient_ids, labels, indptr, indices, values, path, block_rows=7)
+    X, Y = utils.load_svmlight_file(path, n_features=3190, zero_based=True)
+    assert (X.indptr == indptr).all() and (X.indices == indices).all() and (Y == labels).all()
+    assert np.abs(X.data - values).max() <= 5e-7
+
+
+def test_no_rows(tmp_path):
+    path = str(tmp_path / 'svmlight')
+    assert utils.write_svmlight([], [], [0], [], [], path, str(tmp_path / 'deliverable')) == (0, 0)
+    assert read(path) == b''
@@ -0,0 +1,185 @@
+"""
+Benchmark of the vectorized ICD-9 conversion and codemap building of etl_mortality_data against the per-row versions
+they replace, checking that both give the same codes, codemap and sequences.
+
+python benchmark.py [DIAGNOSES_ICD.csv]
+
+Without a file, a synthetic table of the size of MIMIC-III DIAGNOSES_ICD is generated.
+"""
+import os
+import sys
+import time
+import tempfile
+import pandas as pd
+import numpy as np
+
+from etl_mortality_data import convert_icd9, transform_codes, build_codemap, load_codemap, create_dataset
+
+# Size of the synthetic DIAGNOSES_ICD table: rows, distinct codes, admissions and patients
+N_ROWS = 651047
+N_CODES = 6984
+N_ADMISSIONS = 58976
+N_PATIENTS = 46520
+
+
+def timed(fn, *args):
+	start_time = time.time()
+	result = fn(*args)
+	return result, time.time() - start_time
+
+
+def synthetic_codes(n_codes, seed=6505):
+	"""
+	:return: distinct ICD-9 codes as they are read from the csv: numeric (some of 3 digits), V and E codes
+	"""
+	rng = np.random.RandomState(seed)
+	codes = set()
+	while len(codes) < n_codes:
+		kind = rng.randint(10)
+		if kind < 7:
+			code = "%03d%s" % (rng.randint(1000), "".join(map(str, rng.randint(10, size=rng.randint(3)))))
+		elif kind < 9:
+			code = "V%02d%s" % (rng.randint(100), "".join(map(str, rng.randint(10, size=rng.randint(3)))))
+		else:
+			code = "E%03d%s" % (rng.randint(1000), "".join(map(str, rng.randint(10, size=rng.randint(2)))))
+		codes.add(code)
+	return np.array(sorted(codes), dtype=object)
+
+
+def synthetic_diagnoses(n_rows=N_ROWS, n_codes=N_CODES, n_admissions=N_ADMISSIONS, seed=6505):
+	"""
+	:return: DIAGNOSES_ICD-like DataFrame, with Zipf-like code frequencies and a few missing codes
+	"""
+	rng = np.random.RandomState(seed)
+	codes = synthetic_codes(n_codes, seed)
+	weights = 1.0 / np.arange(1, n_codes + 1)
+	icd9 = codes[rng.choice(n_codes, size=n_rows, p=weights / weights.sum())]
+	icd9[rng.rand(n_rows) < 0.001] = np.nan
+	# every admission has at least one diagnosis
+	hadm_ids = np.concatenate([np.arange(n_admissions), rng.randint(n_admissions, size=n_rows - n_admissions)])
+	return pd.DataFrame({'HADM_ID': 100000 + hadm_ids, 'SEQ_NUM': 1, 'ICD9_CODE': icd9})
+
+
+def write_split(path, df_diagnoses, n_patients, seed=6505):
+	"""
+	Write the MORTALITY.csv, ADMISSIONS.csv and DIAGNOSES_ICD.csv of a split whose admissions are those of df_diagnoses
+	"""
+	rng = np.random.RandomState(seed)
+	hadm_ids = np.unique(df_diagnoses['HADM_ID'].values)
+	subject_ids = rng.randint(n_patients, size=len(hadm_ids))
+	admit_times = pd.Timestamp('2100-01-01') + pd.to_timedelta(rng.randint(3650, size=len(hadm_ids)), unit='D')
+	df_admission = pd.DataFrame({'SUBJECT_ID': subject_ids, 'HADM_ID': hadm_ids,
+								 'ADMITTIME': admit_times.strftime('%Y-%m-%d %H:%M:%S')})
+	df_mortality = pd.DataFrame({'SUBJECT_ID': np.unique(subject_ids)})
+	df_mortality['MORTALITY'] = rng.randint(2, size=len(df_mortality))
+
+	os.makedirs(path, exist_ok=True)
+	df_mortality.to_csv(os.path.join(path, "MORTALITY.csv"), index=False)
+	df_admission.to_csv(os.path.join(path, "ADMISSIONS.csv"), index=False)
+	df_diagnoses.to_csv(os.path.join(path, "DIAGNOSES_ICD.csv"), index=False)
+
+
+def build_codemap_rowwise(df_icd9, transform):
+	"""
+	build_codemap before vectorization
+	"""
+	df_digits = df_icd9['ICD9_CODE'].dropna().apply(transform).unique()
+	return dict(zip(df_digits, np.arange(len(df_digits))))
+
+
+def create_dataset_rowwise(path, codemap, transform):
+	"""
+	create_dataset before vectorization
+	"""
+	df_mortality = pd.read_csv(os.path.join(path, "MORTALITY.csv"))
+	df_diagnoses = pd.read_csv(os.path.join(path, "DIAGNOSES_ICD.csv"))
+	df_admission = pd.read_csv(os.path.join(path, "ADMISSIONS.csv"))
+
+	df_diagnoses['ICD9_CODE'] = df_diagnoses['ICD9_CODE'].transform(transform)
+	group_diagnoses_visit = df_diagnoses.groupby(['HADM_ID'])
+	group_visit_patient = df_admission.groupby(['SUBJECT_ID'])
+
+	patient_ids = []
+	labels = []
+	seq_data = []
+	for id, v in group_visit_patient:
+		id = id[0] if isinstance(id, tuple) else id
+		patient_ids.append(id)
+		label = df_mortality.loc[df_mortality['SUBJECT_ID'] == id]['MORTALITY'].values[0]
+		labels.append(label)
+
+		v = v.sort_values(by=['ADMITTIME'])
+		stored_visit = []
+		for i, visit in v.iterrows():
+			diag = group_diagnoses_visit.get_group((visit['HADM_ID'],))['ICD9_CODE'].values
+			diag = list(filter(lambda a: a in codemap.keys(), diag))
+			stored_visit.append(list(map(lambda a: codemap[a], diag)))
+		seq_data.append(stored_visit)
+
+	return patient_ids, labels, seq_data
+
+
+def bench_codes(df_diagnoses):
+	expected, before = timed(lambda codes: codes.apply(convert_icd9).values, df_diagnoses['ICD9_CODE'])
+	actual, after = timed(transform_codes, df_diagnoses['ICD9_CODE'], convert_icd9)
+	assert list(actual) == list(expected)
+	print("convert_icd9: %d rows, %d codes, apply %.3fs, vectorized %.3fs (%.1fx)" %
+		  (len(df_diagnoses), df_diagnoses['ICD9_CODE'].nunique(), before, after, before / max(after, 1e-9)))
+
+	expected, before = timed(build_codemap_rowwise, df_diagnoses, convert_icd9)
+	actual, after = timed(build_codemap, df_diagnoses, convert_icd9)
+	assert actual == expected
+	print("build_codemap: %d features, apply %.3fs, vectorized %.3fs (%.1fx)" %
+		  (len(actual), before, after, before / max(after, 1e-9)))
+
+
+def bench_codemap_file(df_diagnoses, tmp_dir):
+	source = os.path.join(tmp_dir, "DIAGNOSES_ICD.csv")
+	df_diagnoses.to_csv(source, index=False)
+	path = os.path.join(tmp_dir, "mortality.codemap.train")
+
+	expected = build_codemap(df_diagnoses, convert_icd9)
+	built, before = timed(load_codemap, source, path, convert_icd9)
+	loaded, after = timed(load_codemap, source, path, convert_icd9)
+	assert built == expected and loaded == expected
+	print("load_codemap: built %.3fs, reused %.3fs" % (before, after))
+
+	# a changed source file is not served the saved codemap
+	df_diagnoses.iloc[:len(df_diagnoses) // 2].to_csv(source, index=False)
+	os.utime(source, ns=(0, 0))
+	rebuilt = load_codemap(source, path, convert_icd9)
+	assert rebuilt == build_codemap(df_diagnoses.iloc[:len(df_diagnoses) // 2], convert_icd9)
+
+	# nor is another transform of the same source file
+	rebuilt = load_codemap(source, path, str)
+	assert rebuilt == build_codemap(df_diagnoses.iloc[:len(df_diagnoses) // 2], str)
+	assert load_codemap(source, path, convert_icd9) == build_codemap(df_diagnoses.iloc[:len(df_diagnoses) // 2], convert_icd9)
+
+
+def bench_dataset(df_diagnoses, tmp_dir, n_patients=N_PATIENTS):
+	codemap = build_codemap(df_diagnoses, convert_icd9)
+	path = os.path.join(tmp_dir, "split")
+	write_split(path, df_diagnoses, n_patients)
+
+	expected, before = timed(create_dataset_rowwise, path, codemap, convert_icd9)
+	actual, after = timed(create_dataset, path, codemap, convert_icd9)
+	assert actual[0] == expected[0] and actual[1] == expected[1]
+	assert actual[2] == [[[int(feature) for feature in visit] for visit in seq] for seq in expected[2]]
+	print("create_dataset: %d patients, row-wise %.3fs, vectorized %.3fs (%.1fx)" %
+		  (len(actual[0]), before, after, before / max(after, 1e-9)))
+
+
+def main():
+	if len(sys.argv) > 1:
+		df_diagnoses = pd.read_csv(sys.argv[1])
+	else:
+		df_diagnoses = synthetic_diagnoses()
+
+	bench_codes(df_diagnoses)
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		bench_codemap_file(df_diagnoses, tmp_dir)
+		bench_dataset(df_diagnoses, tmp_dir)
+
+
+if __name__ == '__main__':
+	main()
@@ -19,17 +19,91 @@ def convert_icd9(icd9_object):
 	converted = icd9_str if i >= len(icd9_str) else icd9_str[0:i]
 	return converted
 
+def convert_icd9_codes(icd9_codes):
+	"""
+	Vectorized convert_icd9, with the same truncation rules: 4 characters for codes starting with a letter other than V
+	(E codes), 3 for V and numeric codes, the whole code if it is shorter.
+	:param icd9_codes: distinct ICD-9 codes (array-like of objects).
+	:return: ndarray of their main digits
+	"""
+	codes = pd.Series(icd9_codes, dtype=object).map(str)
+	first = codes.str[:1]
+	converted = codes.str[:3].where(~(first.str.isalpha() & (first != 'V')), codes.str[:4])
+	return converted.values
+
+
+def _factorize_codes(codes, transform):
+	"""
+	:return: the index of every code in the distinct codes (-1 if missing), and the transformed distinct codes followed
+	by transform(nan), so that both index the result
+	"""
+	labels, uniques = pd.factorize(codes)
+	if transform is convert_icd9:
+		converted = convert_icd9_codes(uniques)
+	else:
+		converted = np.array([transform(code) for code in uniques], dtype=object)
+	return labels, np.append(converted, np.array([transform(np.nan)], dtype=object))
+
+
+def transform_codes(codes, transform):
+	"""
+	Apply transform once per distinct code instead of once per row, since codes repeat enormously.
+	convert_icd9 is computed with vectorized string operations.
+	:param codes: Series of codes.
+	:param transform: e.g. convert_icd9
+	:return: ndarray of the transformed codes, transform(nan) for missing ones
+	"""
+	labels, converted = _factorize_codes(codes, transform)
+	return converted[labels]
+
+
+def map_codes(codes, codemap, transform):
+	"""
+	:param codes: Series of codes.
+	:return: ndarray of the feature ID of every code whose transform is in codemap, -1 for the others
+	"""
+	labels, converted = _factorize_codes(codes, transform)
+	feature_ids = np.array([codemap.get(code, -1) for code in converted], dtype=np.int64)
+	return feature_ids[labels]
+
+
 def build_codemap(df_icd9, transform):
 	"""
 	:return: Dict of code map {main-digits of ICD9: unique feature ID}
 	"""
 
-	df_digits = df_icd9['ICD9_CODE'].dropna().apply(transform).unique()
+	df_digits = pd.unique(transform_codes(df_icd9['ICD9_CODE'].dropna(), transform))
 	codemap = dict(zip(df_digits, np.arange(len(df_digits))))
 
 	return codemap
 
 
+def load_codemap(source, path, transform):
+	"""
+	Load the codemap saved at path if it was built from the same source file (same path, size and modification time)
+	with the same transform (same qualified name), otherwise build it from the ICD9_CODE column of source and save it,
+	with the key of source and transform in path + '.source'.
+	:param source: DIAGNOSES_ICD.csv the codemap is built from
+	:param transform: e.g. convert_icd9
+	:return: Dict of code map {main-digits of ICD9: unique feature ID}
+	"""
+	stat = os.stat(source)
+	key = (os.path.abspath(source), stat.st_size, stat.st_mtime_ns, transform.__module__ + '.' + transform.__qualname__)
+	if os.path.exists(path) and os.path.exists(path + '.source'):
+		with open(path + '.source', 'rb') as f:
+			if pickle.load(f) == key:
+				with open(path, 'rb') as f:
+					return pickle.load(f)
+
+	df_icd9 = pd.read_csv(source, usecols=["ICD9_CODE"])
+	codemap = build_codemap(df_icd9, transform)
+	with open(path, 'wb') as f:
+		pickle.dump(codemap, f, pickle.HIGHEST_PROTOCOL)
+	with open(path + '.source', 'wb') as f:
+		pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+	return codemap
+
+
 def create_dataset(path, codemap, transform):
 	"""
 	:param path: path to the directory contains raw files.
@@ -41,25 +115,20 @@ def create_dataset(path, codemap, transform):
 	df_diagnoses = pd.read_csv(os.path.join(path, "DIAGNOSES_ICD.csv"))
 	df_admission = pd.read_csv(os.path.join(path, "ADMISSIONS.csv"))
 
-	df_diagnoses['ICD9_CODE'] = df_diagnoses['ICD9_CODE'].transform(transform)
-	group_diagnoses_visit = df_diagnoses.groupby(['HADM_ID'])
-	group_visit_patient = df_admission.groupby(['SUBJECT_ID'])
+	# codes are converted and mapped to feature IDs once for the whole split; codes not in codemap are dropped
+	df_diagnoses['FEATURE_ID'] = map_codes(df_diagnoses['ICD9_CODE'], codemap, transform)
+	df_diagnoses = df_diagnoses[df_diagnoses['FEATURE_ID'] >= 0]
+	visit_features = df_diagnoses.groupby('HADM_ID', sort=False)['FEATURE_ID'].agg(list).to_dict()
+	mortality = df_mortality.drop_duplicates('SUBJECT_ID').set_index('SUBJECT_ID')['MORTALITY']
+	df_admission = df_admission.sort_values(by=['SUBJECT_ID', 'ADMITTIME'], kind='mergesort')
 
 	patient_ids = []
 	labels = []
 	seq_data = []
-	for id, v in group_visit_patient:
+	for id, visits in df_admission.groupby('SUBJECT_ID')['HADM_ID']:
 		patient_ids.append(id)
-		label = df_mortality.loc[df_mortality['SUBJECT_ID'] == id]['MORTALITY'].values[0]
-		labels.append(label)
-
-		v = v.sort_values(by=['ADMITTIME'])
-		stored_visit = []
-		for i, visit in v.iterrows():
-			diag = group_diagnoses_visit.get_group(visit['HADM_ID'])['ICD9_CODE'].values
-			diag = list(filter(lambda a: a in codemap.keys(), diag))
-			stored_visit.append(list(map(lambda a: codemap[a], diag)))
-		seq_data.append(stored_visit)
+		labels.append(mortality[id])
+		seq_data.append([visit_features.get(visit, []) for visit in visits.values])
 
 	return patient_ids, labels, seq_data
 
@@ -67,10 +136,8 @@ def create_dataset(path, codemap, transform):
 def main():
 	# Build a code map from the train set
 	print("Build feature id map")
-	df_icd9 = pd.read_csv(os.path.join(PATH_TRAIN, "DIAGNOSES_ICD.csv"), usecols=["ICD9_CODE"])
-	codemap = build_codemap(df_icd9, convert_icd9)
 	os.makedirs(PATH_OUTPUT, exist_ok=True)
-	pickle.dump(codemap, open(os.path.join(PATH_OUTPUT, "mortality.codemap.train"), 'wb'), pickle.HIGHEST_PROTOCOL)
+	codemap = load_codemap(os.path.join(PATH_TRAIN, "DIAGNOSES_ICD.csv"), os.path.join(PATH_OUTPUT, "mortality.codemap.train"), convert_icd9)
 
 	# Train set
 	print("Construct train set")